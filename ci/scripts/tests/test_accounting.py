@@ -0,0 +1,78 @@
+import sys
+import os
+import json
+from datetime import datetime
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_dir, '..', '..', '..', 'workflow'))
+
+from rocoto.accounting import get_accounting, FakeScheduler
+
+sacct_output = """\
+1001|gfsfcst|COMPLETED|2024-01-12T10:00:00|2024-01-12T10:05:00|2024-01-12T11:05:00|3600|01:00:00|480
+1001.batch|batch|COMPLETED|2024-01-12T10:05:00|2024-01-12T10:05:00|2024-01-12T11:05:00|3600|00:00:10|40
+1001.0|fv3.x|COMPLETED|2024-01-12T10:05:10|2024-01-12T10:05:10|2024-01-12T11:05:00|3590|1-00:00:00|480
+1002|gfsatmos_prod|PENDING|2024-01-12T10:00:00|Unknown|Unknown|0|00:00:00|24
+"""
+
+qstat_output = json.dumps({
+    "Jobs": {
+        "2001.dbqs01": {
+            "Job_Name": "gdasanal", "job_state": "F",
+            "qtime": "Fri Jan 12 10:00:00 2024", "stime": "Fri Jan 12 10:02:00 2024",
+            "obittime": "Fri Jan 12 10:32:00 2024",
+            "resources_used": {"cput": "10:00:00", "walltime": "00:30:00"},
+            "Resource_List": {"ncpus": 1024}
+        }
+    }
+})
+
+bjobs_output = """\
+3001;gdasfcst;DONE;96;Jan 12 10:00:00 2024;Jan 12 10:01:00 2024 L;Jan 12 10:11:00 2024 L;5760.5 second(s);600 second(s)
+"""
+
+
+def test_slurm_accounting():
+
+    fake = FakeScheduler({'sacct': sacct_output})
+    accounting = get_accounting('slurm', runner=fake)
+    result = accounting.query(['1001', '1002'])
+
+    assert len(fake.calls) == 1
+    assert result['1001']['qtime'] == 300
+    assert result['1001']['runtime'] == 3600
+    assert result['1001']['cputime'] == 86400 + 10
+    assert result['1001']['slots'] == 480
+    assert result['1001']['finished']
+    assert not result['1002']['finished']
+    assert result['1002']['start_time'] is None
+
+    # Finished jobs are cached, unfinished ones are reused until the ttl expires
+    accounting.query(['1001', '1002'])
+    assert len(fake.calls) == 1
+    accounting.ttl = 0
+    accounting.query(['1001', '1002'])
+    assert fake.calls[-1][-1] == '1002'
+
+
+def test_pbs_accounting():
+
+    accounting = get_accounting('pbspro', runner=FakeScheduler({'qstat': qstat_output}))
+    result = accounting.query(['2001.dbqs01'])
+
+    assert result['2001.dbqs01']['qtime'] == 120
+    assert result['2001.dbqs01']['runtime'] == 1800
+    assert result['2001.dbqs01']['cputime'] == 36000
+    assert result['2001.dbqs01']['slots'] == 1024
+
+
+def test_lsf_accounting():
+
+    accounting = get_accounting('lsf', runner=FakeScheduler({'bjobs': bjobs_output}))
+    result = accounting.query(['3001'])
+
+    assert result['3001']['qtime'] == 60
+    assert result['3001']['runtime'] == 600
+    assert result['3001']['cputime'] == 5760.5
+    assert result['3001']['slots'] == 96
+    assert result['3001']['end_time'] == datetime(2024, 1, 12, 10, 11).timestamp()
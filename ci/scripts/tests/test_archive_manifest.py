@@ -0,0 +1,98 @@
+import os
+import sys
+
+import pytest
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_dir, '..', '..', '..', 'ush', 'python'))
+
+from wxflow import AttrDict
+
+from pygfs.utils.archive_manifest import ArchiveManifest
+from pygfs.utils.archive_utils import create_tarball
+
+CYCLES = ['2024010100', '2024010106', '2024010112', '2024010118']
+
+
+@pytest.fixture
+def rotdir(tmp_path, monkeypatch):
+    """ROTDIR with two files (the working directory) and an ATARDIR"""
+    rotdir = tmp_path / 'ROTDIR'
+    rotdir.mkdir()
+    (rotdir / 'a.txt').write_text('a' * 1000)
+    (rotdir / 'b.txt').write_text('b' * 1000)
+    monkeypatch.chdir(rotdir)
+    return rotdir
+
+
+def archive(manifest, cycle, atardir):
+    """Plan, create (unless skipped) and record the tarball of a cycle"""
+    dataset = AttrDict(name='gdas', target=str(atardir / cycle / 'gdas.tar'), fileset=['a.txt', 'b.txt'])
+    manifest.plan(dataset, cycle)
+    digests = None
+    if not dataset.skip:
+        os.makedirs(os.path.dirname(dataset.target), exist_ok=True)
+        digests = {}
+        create_tarball(dataset.target, dataset.fileset, digests=digests)
+    manifest.record(dataset, cycle, digests)
+    return dataset
+
+
+def stored_in(dataset):
+    return {member.path: os.path.basename(os.path.dirname(member.stored_in)) for member in dataset.members}
+
+
+def test_record_skip_delta(rotdir, tmp_path):
+    atardir = tmp_path / 'ATARDIR'
+    path = str(tmp_path / 'archive_manifest.db')
+
+    # The first cycle records the tarball, hashing its members as they are written
+    dataset = archive(ArchiveManifest(path, mode='record'), CYCLES[0], atardir)
+    assert not dataset.skip
+    assert all(member.hash for member in dataset.members)
+
+    # Nothing changed: the second tarball is not created
+    manifest = ArchiveManifest(path, mode='skip')
+    dataset = archive(manifest, CYCLES[1], atardir)
+    assert dataset.skip
+    assert not os.path.exists(dataset.target)
+    assert stored_in(dataset) == {'a.txt': CYCLES[0], 'b.txt': CYCLES[0]}
+
+    # One file changed: the delta tarball only holds that file
+    (rotdir / 'b.txt').write_text('c' * 1000)
+    os.utime(rotdir / 'b.txt', (0, os.path.getmtime(rotdir / 'b.txt') + 60))
+    manifest = ArchiveManifest(path, mode='delta')
+    dataset = archive(manifest, CYCLES[2], atardir)
+    assert dataset.fileset == ['b.txt']
+    assert stored_in(dataset) == {'a.txt': CYCLES[0], 'b.txt': CYCLES[2]}
+    assert [location.stored_in for location in manifest.locate('a.txt', CYCLES[1])] == \
+        [str(atardir / CYCLES[0] / 'gdas.tar')]
+
+    # Once the first tarball is purged, its contents are archived again
+    os.remove(atardir / CYCLES[0] / 'gdas.tar')
+    manifest = ArchiveManifest(path, mode='delta')
+    assert manifest.prune() == 5
+    assert manifest.locate('a.txt') == []
+    assert [location.cycle for location in manifest.locate('b.txt')] == [CYCLES[2]]
+    dataset = archive(manifest, CYCLES[3], atardir)
+    assert dataset.fileset == ['a.txt']
+    assert stored_in(dataset) == {'a.txt': CYCLES[3], 'b.txt': CYCLES[2]}
+    manifest.close()
+
+
+def test_removed_tarball_is_not_reused(rotdir, tmp_path):
+    atardir = tmp_path / 'ATARDIR'
+    path = str(tmp_path / 'archive_manifest.db')
+    archive(ArchiveManifest(path, mode='record'), CYCLES[0], atardir)
+
+    # Even if the manifest was not pruned
+    os.remove(atardir / CYCLES[0] / 'gdas.tar')
+    dataset = archive(ArchiveManifest(path, mode='skip'), CYCLES[1], atardir)
+    assert not dataset.skip
+    assert os.path.exists(dataset.target)
+
+
+def test_hpss_is_only_recorded(tmp_path):
+    manifest = ArchiveManifest(str(tmp_path / 'archive_manifest.db'), mode='delta', local=False)
+    assert manifest.mode == 'record'
+    assert manifest.prune() == 0
@@ -0,0 +1,110 @@
+import os
+import shutil
+import sys
+
+import numpy as np
+import pytest
+
+netCDF4 = pytest.importorskip('netCDF4')
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_dir, '..', '..', '..', 'ush', 'python'))
+
+from pygfs.utils.fv3_increment_utils import add_fv3_increments, add_tile_increments
+
+NTILES = 2
+INCVARS = ['T', 'delp', 'sphum']
+
+
+def whole_array_add(inc_path, bkg_path, incvars):
+    """Add the increments with masked arrays, a whole variable at a time"""
+    with netCDF4.Dataset(inc_path, mode='r') as incfile, netCDF4.Dataset(bkg_path, mode='a') as rstfile:
+        for vname in incvars:
+            increment = incfile.variables[vname][:]
+            bkg = rstfile.variables[vname][:]
+            anl = bkg + increment
+            rstfile.variables[vname][:] = anl[:]
+            try:
+                rstfile.variables[vname].delncattr('checksum')
+            except (AttributeError, RuntimeError):
+                pass
+
+
+def write_tile(path, seed, increment=False):
+    rng = np.random.default_rng(seed)
+    with netCDF4.Dataset(path, mode='w') as ncfile:
+        for dim, size in [('Time', 1), ('zaxis_1', 7), ('yaxis_1', 5), ('xaxis_1', 4)]:
+            ncfile.createDimension(dim, size)
+        dims = ('Time', 'zaxis_1', 'yaxis_1', 'xaxis_1')
+
+        # Temperature with a fill value in both files
+        temp = ncfile.createVariable('T', 'f4', dims, fill_value=-999.)
+        data = rng.normal(0. if increment else 250., 1., temp.shape).astype('f4')
+        data[0, 2, 1, :] = -999.
+        temp[:] = data
+        if not increment:
+            temp.setncattr('checksum', 'abc')
+
+        # Pressure thickness with the default fill value and, in the increment, a valid range
+        delp = ncfile.createVariable('delp', 'f8', dims)
+        data = rng.normal(0. if increment else 500., 10., delp.shape)
+        if increment:
+            data[0, 5, 3, 2] = 1.e3
+            delp.setncattr('valid_min', -100.)
+            delp.setncattr('valid_max', 100.)
+        else:
+            data[0, 0, 0, 0] = netCDF4.default_fillvals['f8']
+        delp[:] = data
+
+        # Humidity without any masked value
+        sphum = ncfile.createVariable('sphum', 'f4', dims)
+        sphum[:] = rng.uniform(0., 1.e-3, sphum.shape).astype('f4')
+
+
+@pytest.fixture
+def tiles(tmp_path):
+    for itile in range(1, NTILES + 1):
+        write_tile(tmp_path / f'inc.tile{itile}.nc', seed=itile, increment=True)
+        write_tile(tmp_path / f'bkg.tile{itile}.nc', seed=10 + itile)
+        shutil.copy(tmp_path / f'bkg.tile{itile}.nc', tmp_path / f'ref.tile{itile}.nc')
+    return tmp_path
+
+
+def assert_same_tiles(tiles):
+    for itile in range(1, NTILES + 1):
+        with netCDF4.Dataset(tiles / f'bkg.tile{itile}.nc') as bkg, netCDF4.Dataset(tiles / f'ref.tile{itile}.nc') as ref:
+            for vname in INCVARS:
+                bkg.variables[vname].set_auto_mask(False)
+                ref.variables[vname].set_auto_mask(False)
+                np.testing.assert_array_equal(bkg.variables[vname][:], ref.variables[vname][:])
+                assert bkg.variables[vname].ncattrs() == ref.variables[vname].ncattrs()
+
+
+@pytest.mark.parametrize('chunk_bytes', [1, 400, 1024 ** 3])
+def test_chunked_add_matches_whole_array_add(tiles, chunk_bytes):
+    for itile in range(1, NTILES + 1):
+        add_tile_increments(str(tiles / f'inc.tile{itile}.nc'), str(tiles / f'bkg.tile{itile}.nc'), INCVARS,
+                            chunk_bytes=chunk_bytes)
+        whole_array_add(tiles / f'inc.tile{itile}.nc', tiles / f'ref.tile{itile}.nc', INCVARS)
+    assert_same_tiles(tiles)
+
+
+def test_tiles_in_parallel(tiles):
+    add_fv3_increments(str(tiles / 'inc.tile{tilenum}.nc'), str(tiles / 'bkg.tile{tilenum}.nc'), INCVARS,
+                       ntiles=NTILES, nprocs=NTILES, chunk_bytes=400)
+    for itile in range(1, NTILES + 1):
+        whole_array_add(tiles / f'inc.tile{itile}.nc', tiles / f'ref.tile{itile}.nc', INCVARS)
+    assert_same_tiles(tiles)
+
+
+def test_readonly_background_in_parallel(tiles, tmp_path):
+    from pygfs.utils.staging_utils import StagingPlan
+
+    staged = tmp_path / 'staged'
+    StagingPlan().add({'readonly': [[str(tiles / f'bkg.tile{itile}.nc'), str(staged / f'bkg.tile{itile}.nc')]
+                                    for itile in range(1, NTILES + 1)]}).execute()
+    with pytest.raises(PermissionError):
+        add_fv3_increments(str(tiles / 'inc.tile{tilenum}.nc'), str(staged / 'bkg.tile{tilenum}.nc'), INCVARS,
+                           ntiles=NTILES, nprocs=NTILES)
+    # The sources of the read-only backgrounds are unchanged
+    assert_same_tiles(tiles)
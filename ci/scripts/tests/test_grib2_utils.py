@@ -0,0 +1,104 @@
+import os
+import socket
+import struct
+import sys
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_dir, '..', '..', '..', 'ush', 'python'))
+
+from pygfs.utils.grib2_utils import scan_grib2, write_grb2index, write_inventory
+
+# Identification section: NCEP, master table 2, 2024-01-01 00Z
+SECTION1 = struct.pack('>IBHHBBBHBBBBBBB', 21, 1, 7, 0, 2, 1, 1, 2024, 1, 1, 0, 0, 0, 0, 1)
+# Grid definition section (not decoded by the scanner): 4 points, template 3.0
+SECTION3 = struct.pack('>IBBIBBH', 14, 3, 0, 4, 0, 0, 0)
+# Data representation section: template 5.0, the rest of it is not decoded
+SECTION5 = struct.pack('>IBIH', 21, 5, 4, 0) + bytes(10)
+# No bit map
+SECTION6 = struct.pack('>IBB', 6, 6, 255)
+SECTION7 = struct.pack('>IB', 9, 7) + b'\x01\x02\x03\x04'
+
+
+def product_section(category, number, time_unit, forecast_time, surface, scale, value, statistics=b''):
+    """Product definition section of template 4.0, or of 4.8 with the statistics octets 35-58"""
+    template = 8 if statistics else 0
+    body = struct.pack('>HHBBBBBHBBiBBIBBI', 0, template, category, number, 2, 0, 96, 0, 0, time_unit,
+                       forecast_time, surface, scale, value, 255, 0, 0)
+    return struct.pack('>IB', 5 + len(body + statistics), 4) + body + statistics
+
+
+# TMP at 500 mb, 6 hour forecast
+SECTION4_TMP = product_section(0, 0, 1, 6, 100, 0, 50000)
+# APCP at the surface, accumulated over the first 6 hours (template 4.8)
+STATISTICS_APCP = struct.pack('>HBBBBBBIBBBIBI', 2024, 1, 1, 6, 0, 0, 1, 0, 1, 2, 1, 6, 1, 0)
+SECTION4_APCP = product_section(1, 8, 1, 0, 1, 0, 0, STATISTICS_APCP)
+
+
+def message(discipline, section4):
+    sections = SECTION1 + SECTION3 + section4 + SECTION5 + SECTION6 + SECTION7
+    length = 16 + len(sections) + 4
+    return b'GRIB' + b'\x00\x00' + bytes([discipline, 2]) + struct.pack('>Q', length) + sections + b'7777'
+
+
+MESSAGES = [message(0, SECTION4_TMP), message(0, SECTION4_APCP)]
+
+
+def write_grib2(tmp_path):
+    path = tmp_path / 'GFSPRS.GrbF06'
+    path.write_bytes(b''.join(MESSAGES))
+    return str(path)
+
+
+def expected_record(offset, section4, length):
+    """grb2index record (NCEPLIBS-g2 index version 1) of a message without local use section"""
+    offsets = [0, 37, 51, 51 + len(section4), 72 + len(section4), 78 + len(section4)]
+    body = (struct.pack('>7IQBBH', offset, *offsets, length, 2, 0, 1) +
+            SECTION1 + SECTION3 + section4 + SECTION5 + SECTION6)
+    return struct.pack('>I', 4 + len(body)) + body
+
+
+def test_scan_grib2(tmp_path):
+    fields = scan_grib2(write_grib2(tmp_path))
+
+    assert [(field.number, field.field, field.nfields) for field in fields] == [(1, 1, 1), (2, 1, 1)]
+    assert [field.offset for field in fields] == [0, len(MESSAGES[0])]
+    assert [field.length for field in fields] == [len(msg) for msg in MESSAGES]
+    assert fields[0].offsets == {2: 0, 3: 37, 4: 51, 5: 85, 6: 106, 7: 112}
+    assert fields[1].offsets == {2: 0, 3: 37, 4: 51, 5: 109, 6: 130, 7: 136}
+    assert fields[0].sections == {1: SECTION1, 3: SECTION3, 4: SECTION4_TMP, 5: SECTION5, 6: SECTION6}
+
+
+def test_index_record(tmp_path):
+    fields = scan_grib2(write_grib2(tmp_path))
+
+    assert fields[0].index_record() == expected_record(0, SECTION4_TMP, len(MESSAGES[0]))
+    assert fields[1].index_record() == expected_record(len(MESSAGES[0]), SECTION4_APCP, len(MESSAGES[1]))
+
+
+def test_write_grb2index(tmp_path):
+    path = write_grib2(tmp_path)
+    fields = scan_grib2(path)
+    write_grb2index(path, fields, str(tmp_path / 'GFSPRS.GrbF06.idx'))
+    index = (tmp_path / 'GFSPRS.GrbF06.idx').read_bytes()
+    records = b''.join(field.index_record() for field in fields)
+
+    # The two 81-byte header records (columns of grb2index), then the records
+    header1, header2 = index[:81].decode(), index[81:162].decode()
+    assert header1[0:20] == '!GFHDR!  1   1   162'
+    assert header1[20] + header1[31] + header1[40] == '   '
+    assert header1[21:25].isdigit() and header1[25] == '-' and header1[34] == ':'
+    assert header1[41:47] == 'GB2IX1'
+    assert header1[55:70] == socket.gethostname()[:15].ljust(15)
+    assert header1[71:] == 'grb2index\n'
+    assert header2 == f'IX1FORM:{162:10d}{len(records):10d}{2:10d}  {"GFSPRS.GrbF06":40s}\n'
+    assert index[162:] == records
+
+
+def test_write_inventory(tmp_path):
+    path = write_grib2(tmp_path)
+    write_inventory(scan_grib2(path), str(tmp_path / 'GFSPRS.GrbF06.inv'))
+
+    assert (tmp_path / 'GFSPRS.GrbF06.inv').read_text().splitlines() == [
+        '1:0:d=2024010100:TMP:500 mb:6 hour fcst:',
+        f'2:{len(MESSAGES[0])}:d=2024010100:APCP:surface:0-6 hour acc fcst:',
+    ]
@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+pygfs_path = os.path.join(script_dir, '..', '..', '..', 'ush', 'python')
+
+# Modules a job does not need unless it runs a task that uses them
+HEAVY_MODULES = ['netCDF4', 'xarray', 'f90nml', 'jcb', 'pygfs.task.analysis', 'pygfs.utils.marine_da_utils']
+
+
+def import_benchmark(statement: str):
+    """
+    Run an import statement in a fresh interpreter with -X importtime
+
+    Returns
+    -------
+    modules : set
+        The modules loaded (of those in HEAVY_MODULES)
+    cumulative : Dict[str, int]
+        The cumulative import time of each module (microseconds)
+    """
+
+    code = f"import sys\n{statement}\nprint(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([pygfs_path, os.environ.get('PYTHONPATH', '')]))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env,
+                            capture_output=True, text=True, check=True)
+
+    cumulative = dict()
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumul, name = [field.strip() for field in line[len('import time:'):].split('|')]
+            if cumul.isdigit():
+                cumulative[name] = int(cumul)
+
+    return set(result.stdout.split()), cumulative
+
+
+def test_package_import_is_lazy():
+
+    loaded, cumulative = import_benchmark('import pygfs')
+    assert loaded == set()
+    assert not any(name.startswith('pygfs.task') for name in cumulative)
+
+
+def test_upp_and_archive_imports():
+
+    for statement in ['from pygfs.task.upp import UPP', 'from pygfs.task.archive import Archive']:
+        loaded, _ = import_benchmark(statement)
+        assert loaded == set(), f"{statement} loads {', '.join(sorted(loaded))}"
+
+
+def test_lazy_attributes():
+
+    loaded, _ = import_benchmark('import pygfs\nassert pygfs.UPP.__name__ == "UPP"\nassert "UPP" in dir(pygfs)')
+    assert loaded == set()
@@ -0,0 +1,124 @@
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_dir, '..', '..', '..', 'workflow'))
+
+import rocoto_critical_path
+import rocoto_simulate
+from rocoto.critical_path import INF, CriticalPath, TaskHistory
+from rocoto.workflow_graph import WorkflowGraph
+
+# prep waits for the fcst of the previous cycle, except at the first cycle (or/not cycleexist);
+# the two post tasks come from a metatask
+workflow_xml = """\
+<?xml version="1.0"?>
+<!DOCTYPE workflow>
+<workflow realtime="F" scheduler="slurm" cyclethrottle="2" taskthrottle="25">
+    <cycledef group="gdas">202401010000 202401011800 06:00:00</cycledef>
+    <task name="prep" cycledefs="gdas" maxtries="2">
+        <command>prep.sh</command>
+        <walltime>00:10:00</walltime>
+        <nodes>1:ppn=4:tpp=1</nodes>
+        <dependency>
+            <or>
+                <taskdep task="fcst" cycle_offset="-06:00:00"/>
+                <not><cycleexistdep cycle_offset="-06:00:00"/></not>
+            </or>
+        </dependency>
+    </task>
+    <task name="anal" cycledefs="gdas" maxtries="2">
+        <command>anal.sh</command>
+        <walltime>00:30:00</walltime>
+        <nodes>2:ppn=4:tpp=2</nodes>
+        <dependency><taskdep task="prep"/></dependency>
+    </task>
+    <metatask name="post">
+        <var name="fhr">f000 f006</var>
+        <var name="wall">00:05:00 00:20:00</var>
+        <task name="post_#fhr#" cycledefs="gdas" maxtries="2">
+            <command>post.sh #fhr#</command>
+            <walltime>#wall#</walltime>
+            <nodes>1:ppn=1:tpp=1</nodes>
+            <dependency><taskdep task="anal"/></dependency>
+        </task>
+    </metatask>
+    <task name="fcst" cycledefs="gdas" maxtries="2">
+        <command>fcst.sh</command>
+        <walltime>01:00:00</walltime>
+        <nodes>2:ppn=4:tpp=1</nodes>
+        <dependency><taskdep task="anal"/></dependency>
+    </task>
+</workflow>
+"""
+
+CYCLES = [datetime(2024, 1, 1, hour) for hour in [0, 6, 12, 18]]
+
+
+@pytest.fixture
+def workflow_file(tmp_path):
+    path = tmp_path / 'workflow.xml'
+    path.write_text(workflow_xml)
+    return str(path)
+
+
+def test_graph(workflow_file):
+    graph = WorkflowGraph.from_file(workflow_file)
+    assert list(graph.tasks) == ['prep', 'anal', 'post_f000', 'post_f006', 'fcst']
+    assert graph.metatasks == {'post': ['post_f000', 'post_f006']}
+    assert graph.cycles() == CYCLES
+    assert graph.tasks['post_f006'].walltime.total_seconds() == 1200
+    assert (graph.tasks['anal'].nodes, graph.tasks['anal'].cores, graph.tasks['anal'].threads) == (2, 8, 2)
+
+
+def test_schedule(workflow_file):
+    model = CriticalPath(WorkflowGraph.from_file(workflow_file), TaskHistory())
+    timings = model.schedule(CYCLES[:2])
+
+    # The first cycle has no previous cycle: prep only waits for the activation
+    assert timings[('prep', CYCLES[0])]['ready'] == 0.
+    assert model.completion(timings, CYCLES[0]) == 6000.
+
+    # The second cycle is active at once (cyclethrottle 2) but prep waits for the previous fcst
+    assert timings[('prep', CYCLES[1])]['ready'] == 6000.
+    assert timings[('prep', CYCLES[1])]['binding'] == ('fcst', CYCLES[0])
+    assert model.completion(timings, CYCLES[1]) == 12000.
+
+    path = model.critical_path(timings, CYCLES[1])
+    assert path == [(name, cycle) for cycle in CYCLES[:2] for name in ['prep', 'anal', 'fcst']]
+
+    slack = model.slack(timings, CYCLES[1])
+    assert slack == {'prep': 0., 'anal': 0., 'fcst': 0., 'post_f000': 3300., 'post_f006': 2400.}
+
+    # A window starting after the first cycle assumes the previous cycles are complete
+    timings = model.schedule(CYCLES[2:3])
+    assert timings[('prep', CYCLES[2])]['ready'] == 0.
+    assert all(timing['finish'] < INF for timing in timings.values())
+
+
+def test_rocoto_critical_path(workflow_file, capsys):
+    rocoto_critical_path.main(['-w', workflow_file, '--ncycles', '2'])
+    output = capsys.readouterr().out
+
+    assert 'WARNING: 5 tasks never ran, their walltime is used' in output
+    assert 'Critical path of cycle 202401010600' in output
+    assert '202401010000  fcst' in output
+    assert 'Cycle latency: 1:40:00 from the activation of the cycle' in output
+    assert 'post_f000                            0:55:00' in output
+    assert 'post_f006                            0:40:00' in output
+    assert 'never satisfied' not in output
+
+
+def test_rocoto_simulate(workflow_file, capsys):
+    rocoto_simulate.main([workflow_file, '--nodes', '8', '--poll', '0'])
+    output = capsys.readouterr().out
+
+    assert 'Simulation of all the cycles on 8 nodes' in output
+    lines = {line[2:22].strip(): line[22:].strip() for line in output.splitlines() if line.startswith('  ')}
+    assert lines['cycles completed'] == '4'
+    # The cycles are chained by the dependency of prep on the previous fcst (1h40 each)
+    assert lines['makespan'] == '6:40:00'
+    assert lines['peak node demand'] == '4'
@@ -6,8 +6,7 @@ import wget
 script_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.join(os.path.dirname(script_dir), 'utils'))
 
-from rocotostat import rocoto_statcount, rocotostat_summary, is_done, is_stalled, CommandNotFoundError
-from wxflow import which
+from rocotostat import rocoto_statcount, rocotostat_summary, is_done, is_stalled
 
 test_data_url = 'https://noaa-nws-global-pds.s3.amazonaws.com/data/CI/'
 
@@ -25,16 +24,13 @@ if not os.path.isfile(os.path.join(testdata_full_path, 'database.db')):
     database_destination = os.path.join(testdata_full_path, 'database.db')
     wget.download(database_url, database_destination)
 
-rocotostat_cmd = which('rocotostat')
-if not rocotostat_cmd:
-    raise CommandNotFoundError("rocotostat not found in PATH")
-
-rocotostat_cmd.add_default_arg(['-w', os.path.join(testdata_path, 'workflow.xml'), '-d', os.path.join(testdata_path, 'database.db')])
+workflow_file = os.path.join(testdata_full_path, 'workflow.xml')
+database_file = os.path.join(testdata_full_path, 'database.db')
 
 
 def test_rocoto_statcount():
 
-    result = rocoto_statcount(rocotostat_cmd)
+    result = rocoto_statcount(workflow_file, database_file)
 
     assert result['SUCCEEDED'] == 20
     assert result['FAIL'] == 0
@@ -46,7 +42,7 @@ def test_rocoto_statcount():
 
 def test_rocoto_summary():
 
-    result = rocotostat_summary(rocotostat_cmd)
+    result = rocotostat_summary(workflow_file, database_file)
 
     assert result['CYCLES_TOTAL'] == 1
     assert result['CYCLES_DONE'] == 1
@@ -54,7 +50,7 @@ def test_rocoto_summary():
 
 def test_rocoto_done():
 
-    result = rocotostat_summary(rocotostat_cmd)
+    result = rocotostat_summary(workflow_file, database_file)
 
     assert is_done(result)
 
@@ -78,10 +74,7 @@ def test_rocoto_stalled():
         database_destination = os.path.join(testdata_full_path, 'stalled.db')
         wget.download(database_url, database_destination)
 
-    rocotostat_cmd = which('rocotostat')
-    rocotostat_cmd.add_default_arg(['-w', xml, '-d', db])
-
-    result = rocoto_statcount(rocotostat_cmd)
+    result = rocoto_statcount(xml, db)
 
     assert result['SUCCEEDED'] == 11
     assert is_stalled(result)
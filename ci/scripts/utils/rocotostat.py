@@ -2,13 +2,16 @@
 
 import sys
 import os
-import copy
+import re
+import sqlite3
 from time import sleep
 
-from wxflow import which, Logger, CommandNotFoundError, ProcessError
+from wxflow import Logger
 from argparse import ArgumentParser, FileType
 
-from collections import Counter
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'workflow'))
+from rocoto.accounting import get_accounting
+from rocoto.state import read_workflow_state, get_rocoto_state, is_done, is_stalled
 
 logger = Logger(level=os.environ.get("LOGGING_LEVEL", "DEBUG"), colored_log=False)
 
@@ -67,7 +70,7 @@ def input_args():
     """
 
     description = """
-        Using rocotostat to get the status of all jobs this scripts
+        Reading the status of all jobs from the Rocoto database this scripts
         determines rocoto_state: if all cycles are done, then rocoto_state is Done.
         Assuming rocotorun had just been run, and the rocoto_state is not Done, then
         rocoto_state is Stalled if there are no jobs that are RUNNING, SUBMITTING, or QUEUED.
@@ -80,153 +83,119 @@ def input_args():
     parser.add_argument('--verbose', action='store_true', help='List the states and the number of jobs that are in each', required=False)
     parser.add_argument('-v', action='store_true', help='List the states and the number of jobs that are in each', required=False)
     parser.add_argument('--export', action='store_true', help='create and export list of the status values for bash', required=False)
+    parser.add_argument('--metrics', action='store_true', help='add the queue and run times reported by the scheduler', required=False)
 
     args = parser.parse_args()
 
     return args
 
 
-def rocotostat_summary(rocotostat):
+def rocotostat_summary(workflow_file, database_file):
     """
-    rocoto_summary Run rocotostat and process its output.
+    rocoto_summary Read the cycles of a workflow.
 
-    rocoto_summary(rocotostat) adds a default argument '--summary' to the rocotostat
-    command, runs it, and processes its output to return a dictionary with the total
-    number of cycles and the number of cycles marked as 'Done'.
+    rocoto_summary(workflow_file, database_file) reads the cycles defined by the
+    workflow and their state in the Rocoto database (as rocotostat --summary) and
+    returns a dictionary with the total number of cycles and the number of cycles marked as 'Done'.
 
     Input:
-    rocotostat - The rocotostat command.
+    workflow_file - The Rocoto XML workflow document.
+    database_file - The Rocoto database.
 
     Output:
     rocoto_status - A dictionary with the total number of cycles and the number of cycles marked as 'Done'.
     """
-    rocotostat = copy.deepcopy(rocotostat)
-    rocotostat.add_default_arg('--summary')
-    rocotostat_output = attempt_multiple_times(lambda: rocotostat(output=str), 3, 90, ProcessError)
-    rocotostat_output = rocotostat_output.splitlines()[1:]
-    rocotostat_output = [line.split()[0:2] for line in rocotostat_output]
 
-    rocoto_status = {
-        'CYCLES_TOTAL': len(rocotostat_output),
-        'CYCLES_DONE': sum([sublist.count('Done') for sublist in rocotostat_output])
-    }
-    return rocoto_status
+    rocoto_status = read_state(workflow_file, database_file).status
+    return {status: rocoto_status[status] for status in ['CYCLES_TOTAL', 'CYCLES_DONE']}
 
 
-def rocoto_statcount(rocotostat):
+def rocoto_statcount(workflow_file, database_file):
     """
-    rocoto_statcount Run rocotostat and process its output.
+    rocoto_statcount Count the jobs of a workflow in each state.
 
-    rocoto_statcount(rocotostat) adds a default argument '--all' to the rocotostat
-    command, runs it, and processes its output to return a dictionary with the count
-    of each status case.
+    rocoto_statcount(workflow_file, database_file) reads the state of all the jobs
+    from the Rocoto database (as rocotostat --all) and returns a dictionary with the
+    count of each status case.
 
     Input:
-    rocotostat - The rocotostat command.
+    workflow_file - The Rocoto XML workflow document.
+    database_file - The Rocoto database.
 
     Output:
     rocoto_status - A dictionary with the count of each status case.
     """
 
-    rocotostat = copy.deepcopy(rocotostat)
-    rocotostat.add_default_arg('--all')
-
-    rocotostat_output = attempt_multiple_times(lambda: rocotostat(output=str), 4, 120, ProcessError)
-    rocotostat_output = rocotostat_output.splitlines()[1:]
-    rocotostat_output = [line.split()[0:4] for line in rocotostat_output]
-    rocotostat_output = [line for line in rocotostat_output if len(line) != 1]
-
-    status_cases = ['SUCCEEDED', 'FAIL', 'DEAD', 'RUNNING', 'SUBMITTING', 'QUEUED']
-
-    rocoto_status = {}
-    status_counts = Counter(case for sublist in rocotostat_output for case in sublist)
-    for case in status_cases:
-        rocoto_status[case] = status_counts[case]
-
+    rocoto_status = read_state(workflow_file, database_file).status
+    for status in ['CYCLES_TOTAL', 'CYCLES_DONE']:
+        del rocoto_status[status]
     return rocoto_status
 
 
-def is_done(rocoto_status):
+def read_state(workflow_file, database_file):
     """
-    is_done Check if all cycles are done.
-
-    is_done(rocoto_status) checks if the total number of cycles equals the number of
-    done cycles in the rocoto_status dictionary.
-
-    Input:
-    rocoto_status - A dictionary with the count of each status case.
-
-    Output:
-    boolean - True if all cycles are done, False otherwise.
+    read_state Read the state of a workflow, retrying if the Rocoto database is busy.
     """
-
-    if rocoto_status['CYCLES_TOTAL'] == rocoto_status['CYCLES_DONE']:
-        return True
-    else:
-        return False
+    return attempt_multiple_times(lambda: read_workflow_state(workflow_file, database_file), 3, 10, sqlite3.OperationalError)
 
 
-def is_stalled(rocoto_status):
+def rocoto_metrics(workflow_file, database_file, accounting=None):
     """
-    is_stalled Check if all cycles are stalled.
+    rocoto_metrics Gather the scheduler accounting of the jobs of a workflow.
 
-    is_stalled(rocoto_status) checks if all cycles are stalled by verifying if
-    there are no jobs that are RUNNING, SUBMITTING, or QUEUED.
+    rocoto_metrics(workflow_file, database_file) reads the jobids from the Rocoto
+    database and queries the scheduler named in the workflow for all of them at once.
 
     Input:
-    rocoto_status - A dictionary with the count of each status case.
+    workflow_file - The Rocoto XML workflow document.
+    database_file - The Rocoto database.
+    accounting - The accounting provider, by default the one for the scheduler of the workflow.
 
     Output:
-    boolean - True if all cycles are stalled, False otherwise.
+    rocoto_status - A dictionary with the longest queue time of the jobs waiting in the
+                    queue and the total run and CPU times (all in seconds).
     """
 
-    if rocoto_status['RUNNING'] + rocoto_status['SUBMITTING'] + rocoto_status['QUEUED'] == 0:
-        return True
-    else:
-        return False
+    if accounting is None:
+        with open(workflow_file, 'r') as fh:
+            scheduler = re.search(r'<workflow[^>]*scheduler\s*=\s*"([^"]+)"', fh.read())
+        accounting = get_accounting(scheduler.group(1) if scheduler else None)
+
+    connection = sqlite3.connect(database_file)
+    jobids = [row[0] for row in connection.execute("SELECT jobid FROM jobs WHERE jobid IS NOT NULL")]
+    connection.close()
+
+    metrics = accounting.query(jobids).values()
+    rocoto_status = {
+        'QUEUE_TIME_MAX': int(max([job['qtime'] for job in metrics if job['start_time'] is None and job['qtime'] is not None], default=0)),
+        'RUN_TIME_TOTAL': int(sum(job['runtime'] or 0 for job in metrics)),
+        'CPU_TIME_TOTAL': int(sum(job['cputime'] or 0 for job in metrics))
+    }
+    return rocoto_status
 
 
 if __name__ == '__main__':
     """
     main Execute the script.
 
-    main() parses the input arguments, checks if the rocotostat command is available,
-    adds default arguments to the rocotostat command, and runs it and reports
-    out to stdout spcific information of rocoto workflow.
+    main() parses the input arguments, reads the state of the workflow from the
+    Rocoto database and reports out to stdout spcific information of rocoto workflow.
     """
 
     args = input_args()
 
-    try:
-        rocotostat = which("rocotostat")
-    except CommandNotFoundError:
-        logger.exception("rocotostat not found in PATH")
-        raise CommandNotFoundError("rocotostat not found in PATH")
-
-    rocotostat.add_default_arg(['-w', os.path.abspath(args.w.name), '-d', os.path.abspath(args.d.name)])
-
-    rocoto_status = rocoto_statcount(rocotostat)
-    rocoto_status.update(rocotostat_summary(rocotostat))
-
-    error_return = 0
-    if is_done(rocoto_status):
-        rocoto_state = 'DONE'
-    elif rocoto_status['DEAD'] > 0:
-        error_return = rocoto_status['FAIL'] + rocoto_status['DEAD']
-        rocoto_state = 'FAIL'
-    elif 'UNKNOWN' in rocoto_status:
-        error_return = rocoto_status['UNKNOWN']
-        rocoto_state = 'UNKNOWN'
-    elif is_stalled(rocoto_status):
-        rocoto_status = attempt_multiple_times(lambda: rocoto_statcount(rocotostat), 2, 120, ProcessError)
-        if is_stalled(rocoto_status):
-            error_return = 3
-            rocoto_state = 'STALLED'
-    else:
-        rocoto_state = 'RUNNING'
+    # A single read of the database gives both the job counts and the cycles
+    rocoto_status = read_state(os.path.abspath(args.w.name), os.path.abspath(args.d.name)).status
+    rocoto_state, error_return = get_rocoto_state(rocoto_status)
 
     rocoto_status['ROCOTO_STATE'] = rocoto_state
 
+    if args.metrics:
+        try:
+            rocoto_status.update(rocoto_metrics(os.path.abspath(args.w.name), os.path.abspath(args.d.name)))
+        except NotImplementedError as err:
+            logger.warning(str(err))
+
     if args.verbose or args.v:
         for status in rocoto_status:
             if args.v:
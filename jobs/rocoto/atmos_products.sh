@@ -13,15 +13,35 @@ status=$?
 if (( status != 0 )); then exit "${status}"; fi
 
 export job="atmos_products"
-export jobid="${job}.$$"
-
-# Negatation needs to be before the base
-fhr3_base="10#${FHR3}"
-export FORECAST_HOUR=$(( ${fhr3_base/10#-/-10#} ))
 
 ###############################################################
-# Execute the JJOB
+# Execute the JJOB, in turn for each forecast hour of the job
 ###############################################################
-"${HOMEgfs}/jobs/JGLOBAL_ATMOS_PRODUCTS"
+for fhr3 in $(echo "${FHRLST:-f${FHR3}}" | sed -e 's/_/ /g; s/f/ /g; s/,/ /g'); do
+
+  export FHR3="${fhr3}"
+  # Negatation needs to be before the base
+  fhr3_base="10#${FHR3}"
+  export FORECAST_HOUR=$(( ${fhr3_base/10#-/-10#} ))
+
+  if [[ -n "${FHRLST:-}" ]]; then
+    export jobid="${job}.f${FHR3}.$$"
+  else
+    export jobid="${job}.$$"
+  fi
+
+  if [[ -n "${FHR_LOG_PREFIX:-}" ]]; then
+    # Keep a log per forecast hour
+    "${HOMEgfs}/jobs/JGLOBAL_ATMOS_PRODUCTS" > "${FHR_LOG_PREFIX}f${FHR3}.log" 2>&1
+  else
+    "${HOMEgfs}/jobs/JGLOBAL_ATMOS_PRODUCTS"
+  fi
+  status=$?
+  if (( status != 0 )); then
+    echo "FATAL ERROR: JGLOBAL_ATMOS_PRODUCTS failed for forecast hour ${FHR3}"
+    exit "${status}"
+  fi
+
+done
 
-exit $?
+exit 0
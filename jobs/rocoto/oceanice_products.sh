@@ -13,13 +13,33 @@ status=$?
 if (( status != 0 )); then exit "${status}"; fi
 
 export job="oceanice_products"
-export jobid="${job}.$$"
-
-export FORECAST_HOUR=$(( 10#${FHR3} ))
 
 ###############################################################
-# Execute the JJOB
+# Execute the JJOB, in turn for each forecast hour of the job
 ###############################################################
-"${HOMEgfs}/jobs/JGLOBAL_OCEANICE_PRODUCTS"
+for fhr3 in $(echo "${FHRLST:-f${FHR3}}" | sed -e 's/_/ /g; s/f/ /g; s/,/ /g'); do
+
+  export FHR3="${fhr3}"
+  export FORECAST_HOUR=$(( 10#${FHR3} ))
+
+  if [[ -n "${FHRLST:-}" ]]; then
+    export jobid="${job}.f${FHR3}.$$"
+  else
+    export jobid="${job}.$$"
+  fi
+
+  if [[ -n "${FHR_LOG_PREFIX:-}" ]]; then
+    # Keep a log per forecast hour
+    "${HOMEgfs}/jobs/JGLOBAL_OCEANICE_PRODUCTS" > "${FHR_LOG_PREFIX}f${FHR3}.log" 2>&1
+  else
+    "${HOMEgfs}/jobs/JGLOBAL_OCEANICE_PRODUCTS"
+  fi
+  status=$?
+  if (( status != 0 )); then
+    echo "FATAL ERROR: JGLOBAL_OCEANICE_PRODUCTS failed for forecast hour ${FHR3}"
+    exit "${status}"
+  fi
+
+done
 
-exit $?
+exit 0
@@ -44,7 +44,10 @@ fi
 export job="upp"
 export jobid="${job}.$$"
 
-export FORECAST_HOUR=$(( 10#${FHR3} ))
+# A batch of forecast hours (FHRLST) is post-processed by a single UPP job (see pygfs.task.upp)
+if [[ -z "${FHRLST:-}" ]]; then
+  export FORECAST_HOUR=$(( 10#${FHR3} ))
+fi
 
 ###############################################################
 # Execute the JJOB
@@ -4,8 +4,8 @@
 'script'-level control of the aerosol init job.
 
 Reads environment variables, determines the atmospheric IC files and most recent available
-restart files, then calls the script that merges the tracers from the restart files into
-the IC files.
+restart files, then merges the tracers from the restart files into the IC files of all
+tiles concurrently (using merge_fv3_aerosol_tile.merge_tiles).
 
 INPUTS
 ---------
@@ -35,7 +35,7 @@ The tiled atmospheric intial condition files will be updated with conservation-a
 '''
 
 import os
-import subprocess
+import sys
 import typing
 from datetime import datetime, timedelta
 from functools import partial
@@ -49,7 +49,6 @@ restart_file_pattern = "{file_base}/{timestamp}fv_core.res.{tile}.nc"         #
 tracer_file_pattern = "{file_base}/{timestamp}fv_tracer.res.{tile}.nc"        # Name of restart tracer files (time when restart is valid)
 dycore_file_pattern = "{file_base}/{timestamp}fv_core.res.nc"                 # Name of restart dycore file (time when restart is valid)
 tracer_list_file_pattern = "{parm_gfs}/ufs/gocart/gocart_tracer.list"         # Text list of tracer names to copy
-merge_script_pattern = "{ush_gfs}/merge_fv3_aerosol_tile.py"
 n_tiles = 6
 max_lookback = 4                                                              # Maximum number of past cycles to look for for tracer data
 debug = True
@@ -75,21 +74,20 @@ def main() -> None:
 
     # os.chdir(data)
 
-    merge_script = merge_script_pattern.format(ush_gfs=ush_gfs)
     tracer_list_file = tracer_list_file_pattern.format(parm_gfs=parm_gfs)
 
     time = datetime.strptime(cdate, "%Y%m%d%H")
     atm_source_path = time.strftime(atm_base_pattern.format(**locals()))
 
     if (debug):
-        for var in ['merge_script', 'tracer_list_file', 'atm_source_path']:
+        for var in ['tracer_list_file', 'atm_source_path']:
             print(f'{var} = {f"{var}"}')
 
     atm_files, ctrl_files = get_atm_files(atm_source_path)
     tracer_files, rest_files, core_files = get_restart_files(time, incr, max_lookback, fcst_length, rot_dir, run)
 
     if (tracer_files is not None):
-        merge_tracers(merge_script, atm_files, tracer_files, rest_files, core_files[0], ctrl_files[0], tracer_list_file)
+        merge_tracers(ush_gfs, atm_files, tracer_files, rest_files, core_files[0], ctrl_files[0], tracer_list_file)
 
     return
 
@@ -167,10 +165,35 @@ def get_atm_files(path: str) -> typing.List[typing.List[str]]:
     return file_list
 
 
+def list_directory(path: str) -> typing.Set[str]:
+    '''
+    Lists the names in a directory with a single call
+
+    Parameters
+    ----------
+    path : str
+            Directory to list
+
+    Returns
+    ----------
+    set of str
+            Names of the entries in the directory, empty if the directory does not exist
+
+    '''
+    try:
+        with os.scandir(path) as entries:
+            return {entry.name for entry in entries if not entry.is_dir()}
+    except (FileNotFoundError, NotADirectoryError):
+        return set()
+
+
 def get_restart_files(time: datetime, incr: int, max_lookback: int, fcst_length: int, rot_dir: str, run: str) -> typing.List[typing.List[str]]:
     '''
     Determines the last cycle where all the necessary restart files are available. Ideally the immediate previous cycle
 
+    Each candidate restart directory is listed once and the tracer, core and dycore files
+    of all tiles are looked up in that listing.
+
     Parameters
     ----------
     time : datetime
@@ -208,31 +231,34 @@ def get_restart_files(time: datetime, incr: int, max_lookback: int, fcst_length:
 
         if (debug):
             print(f"\tChecking {last_time}")
-        file_list = []
         file_base = last_time.strftime(restart_base_pattern.format(**locals()))
+        available = list_directory(file_base)
 
+        file_list = []
         for file_pattern in tracer_file_pattern, restart_file_pattern, dycore_file_pattern:
             files = list(map(lambda tile: file_pattern.format(timestamp=timestamp, file_base=file_base, tile=tile), tiles))
             if (debug):
                 print(f"\t\tLooking for files {files} in directory {file_base}")
             file_list = file_list + [files]
 
-        found = all([os.path.isfile(file) for file in files for files in file_list])
+        missing = sorted({file for files in file_list for file in files if os.path.basename(file) not in available})
 
-        if (found):
-            break
+        if (len(missing) == 0):
+            return file_list
+
+        print(last_time.strftime("Restart files not found for %Y%m%d_%H"))
+        if (len(available) == 0):
+            print(f"\tDirectory {file_base} does not exist or is empty")
         else:
-            print(last_time.strftime("Restart files not found for %Y%m%d_%H"))
+            for file in missing:
+                print(f"\tMissing {file}")
 
-    if (found):
-        return file_list
-    else:
-        print("WARNING: Unable to find restart files, will use zero fields")
-        return [None, None, None]
+    print("WARNING: Unable to find restart files, will use zero fields")
+    return [None, None, None]
 
 
 # Merge tracer data into atmospheric data
-def merge_tracers(merge_script: str,
+def merge_tracers(ush_gfs: str,
                   atm_files: typing.List[str],
                   tracer_files: typing.List[str],
                   rest_files: typing.List[str],
@@ -240,13 +266,13 @@ def merge_tracers(merge_script: str,
                   ctrl_file: str,
                   tracer_list_file: str) -> None:
     '''
-    Call the merger script to merge the tracers into the atmospheric IC files. Merged file is written to a temp file
-    which then overwrites the original upon successful completion of the script.
+    Merge the tracers into the atmospheric IC files of all tiles, one tile per process. Each merged file is
+    written to a temp file which then overwrites the original upon successful completion.
 
     Parameters
     ----------
-    merge_script : str
-            Full path to the merge script
+    ush_gfs : str
+            Path to global-workflow `ush` directory, containing merge_fv3_aerosol_tile.py
     atm_files : list of str
             List of paths to atmospheric IC files
     tracer_files : list of str
@@ -268,8 +294,6 @@ def merge_tracers(merge_script: str,
     ----------
     ValueError
             If `atm_files`, `tracer_files`, and `rest_files` are not all the same length
-    CalledProcessError
-            If merge script exits with a non-zero error
 
     '''
     print("Merging tracers")
@@ -279,12 +303,17 @@ def merge_tracers(merge_script: str,
     if (len(atm_files) != len(rest_files)):
         raise ValueError("Atmosphere file list and dycore file list are not the same length")
 
-    for atm_file, tracer_file, rest_file in zip(atm_files, tracer_files, rest_files):
-        if debug:
+    sys.path.insert(0, ush_gfs)
+    from merge_fv3_aerosol_tile import merge_tiles
+
+    with open(tracer_list_file) as variable_file:
+        variable_names = variable_file.read().splitlines()
+
+    if debug:
+        for atm_file, tracer_file in zip(atm_files, tracer_files):
             print(f"\tMerging tracers from {tracer_file} into {atm_file}")
-        temp_file = f'{atm_file}.tmp'
-        subprocess.run([merge_script, atm_file, tracer_file, core_file, ctrl_file, rest_file, tracer_list_file, temp_file], check=True)
-        os.replace(temp_file, atm_file)
+
+    merge_tiles(atm_files, ctrl_file, core_file, rest_files, tracer_files, variable_names)
 
 
 if __name__ == "__main__":
@@ -37,6 +37,13 @@ def main():
     for key in keys:
         archive_dict[key] = archive.task_config[key]
 
+    # Optional tarball settings, with the defaults of Archive.configure
+    optional_keys = {'ARCH_TAR_NTHREADS': 1, 'ARCH_TAR_NPARALLEL': 1,
+                     'ARCH_MANIFEST': False, 'ARCH_MANIFEST_MODE': 'record',
+                     'ARCH_COMPRESS': 'none', 'ARCH_COMPRESS_LEVEL': 1}
+    for key, default in optional_keys.items():
+        archive_dict[key] = archive.task_config.get(key, default)
+
     # Also import all COMIN* and COMOUT* directory and template variables
     for key in archive.task_config.keys():
         if key.startswith("COMIN_") or key.startswith("COMOUT_"):
@@ -53,8 +60,7 @@ def main():
     archive.execute_store_products(arcdir_set)
 
     # Create the backup tarballs and store in ATARDIR
-    for atardir_set in atardir_sets:
-        archive.execute_backup_dataset(atardir_set)
+    archive.execute_backup_datasets(atardir_sets)
 
     os.chdir(cwd)
 
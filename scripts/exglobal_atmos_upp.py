@@ -34,6 +34,12 @@ def main():
     # Initialize the DATA/ directory; copy static data
     upp.initialize(upp_yaml)
 
+    # A batch of forecast hours: stage the static data once and loop over the hours
+    if len(upp.task_config.forecast_hours) > 1:
+        upp.execute_hours(upp_dict.APRUN_UPP, upp.task_config.get('UPP_NCONCURRENT', 1),
+                          upp.task_config.get('FHR_LOG_PREFIX', None))
+        return
+
     # Configure DATA/ directory for execution; prepare namelist etc.
     upp.configure(upp_dict, upp_yaml)
 
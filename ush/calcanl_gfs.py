@@ -9,12 +9,68 @@ import shutil
 import subprocess
 import sys
 import gsi_utils
-from collections import OrderedDict
+from collections import OrderedDict, deque
 import datetime
 
 python2fortran_bool = {True: '.true.', False: '.false.'}
 
 
+# run independent MPI launches at the same time, at most one per host slot
+# (the setup of each job must place its launch on the hosts of its slot)
+class LaunchScheduler:
+    def __init__(self, slots):
+        # slots: list of lists of hosts, each list is used by one launch at a time
+        self.slots = slots
+
+    def run(self, jobs):
+        # jobs: list of dicts with keys
+        #   name:  label used in messages
+        #   cmd:   command to launch (through the shell)
+        #   cwd:   directory to launch in
+        #   setup: function called with the slot (list of hosts) just before
+        #          the launch, returning the environment for the launch
+        # all jobs are waited on together; on the first failure the other
+        # running jobs are killed, diagnostics printed and the script exits
+        pending = deque(jobs)
+        free = deque(range(len(self.slots)))
+        running = {}
+        while pending or running:
+            while pending and free:
+                job = pending.popleft()
+                islot = free.popleft()
+                env = job['setup'](self.slots[islot])
+                # exec so that killing the job kills the launcher rather than just the shell
+                proc = subprocess.Popen('exec ' + job['cmd'], shell=True, cwd=job['cwd'], env=env)
+                print(job['cmd'] + ' submitted on ' + ','.join(self.slots[islot]) + ' for ' + job['name'])
+                sys.stdout.flush()
+                running[proc.pid] = (proc, job, islot, datetime.datetime.utcnow())
+
+            pid, status = os.wait()
+            if pid not in running:
+                continue
+            proc, job, islot, start = running.pop(pid)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            elapsed = (datetime.datetime.utcnow() - start).total_seconds()
+            if proc.returncode != 0:
+                self._fail(job, islot, proc.returncode, elapsed, running)
+            print(job['name'] + ' completed in ' + format(elapsed, '.1f') + ' s')
+            sys.stdout.flush()
+            free.append(islot)
+
+    def _fail(self, job, islot, ec, elapsed, running):
+        print('Error with ' + job['name'] + ', exit code=' + str(ec) + ' after ' + format(elapsed, '.1f') + ' s')
+        print('  command: ' + job['cmd'])
+        print('  directory: ' + job['cwd'])
+        print('  hosts: ' + ','.join(self.slots[islot]))
+        for proc, other, _, _ in running.values():
+            print('Killing ' + other['name'] + ' (still running)')
+            proc.kill()
+        for proc, _, _, _ in running.values():
+            proc.wait()
+        sys.stdout.flush()
+        sys.exit(ec)
+
+
 # function to calculate analysis from a given increment file and background
 def calcanl_gfs(DoIAU, l4DEnsVar, Write4Danl, ComOut, APrefix,
                 ComIn_Ges, GPrefix,
@@ -175,7 +231,8 @@ def calcanl_gfs(DoIAU, l4DEnsVar, Write4Danl, ComOut, APrefix,
             ExecCMDMPILevs_host = 'mpiexec -l -n ' + str(levs)
             ExecCMDMPILevs_nohost = 'mpiexec -l -n ' + str(levs)
         ExecCMDMPI1_host = 'mpiexec -l -n 1 --cpu-bind depth --depth ' + str(NThreads)
-        ExecCMDMPI13_host = 'mpiexec -l -n 13 --cpu-bind depth --depth ' + str(NThreads)
+        # the hosts file of each chgres_inc.x instance places it on its own host
+        ExecCMDMPI13_host = 'mpiexec -l -n 13 --cpu-bind depth --depth ' + str(NThreads) + ' --hostfile hosts'
     elif launcher == 'srun':
         nodes = os.getenv('SLURM_JOB_NODELIST', '')
         hosts_tmp = subprocess.check_output('scontrol show hostnames ' + nodes, shell=True)
@@ -219,8 +276,33 @@ def calcanl_gfs(DoIAU, l4DEnsVar, Write4Danl, ComOut, APrefix,
         sys.exit(1)
 
     # generate the full resolution analysis
-    ihost = 0
-    # interpolate increment to full background resolution
+    # host slots for the chgres_inc.x instances; on xjet each instance runs on two nodes
+    if launcher == 'srun' and os.getenv('SLURM_JOB_PARTITION', '') == 'xjet':
+        slots = [hosts[i:i + 2] for i in range(0, nhosts - 1, 2)] or [[hosts[0], hosts[0]]]
+    else:
+        slots = [[host] for host in hosts]
+
+    def chgres_inc_setup(CalcAnlDir):
+        def setup(slot):
+            with open(CalcAnlDir + '/hosts', 'w') as hostfile:
+                hostfile.write(slot[0] + '\n')
+                if launcher == 'srun':  # need to write host per task not per node for slurm
+                    # For xjet, each instance of chgres_inc must run on two nodes each
+                    if len(slot) > 1:
+                        for a in range(0, 4):
+                            hostfile.write(slot[0] + '\n')
+                        for a in range(0, 5):
+                            hostfile.write(slot[1] + '\n')
+                    for a in range(0, 12):  # need 12 more of the same host for the 13 tasks for chgres_inc
+                        hostfile.write(slot[-1] + '\n')
+            env = os.environ.copy()
+            if launcher == 'srun':
+                env['SLURM_HOSTFILE'] = CalcAnlDir + '/hosts'
+            return env
+        return setup
+
+    # interpolate increment to full background resolution, all forecast hours at once
+    chgres_jobs = []
     for fh in IAUHH:
         # first check to see if increment file exists
         CalcAnlDir = RunDir + '/calcanl_' + format(fh, '02')
@@ -235,37 +317,16 @@ def calcanl_gfs(DoIAU, l4DEnsVar, Write4Danl, ComOut, APrefix,
                                  "outfile": "'inc.fullres." + format(fh, '02') + "'",
                                  }
             gsi_utils.write_nml(namelist, CalcAnlDir + '/fort.43')
-
-            if ihost >= nhosts:
-                ihost = 0
-            with open(CalcAnlDir + '/hosts', 'w') as hostfile:
-                hostfile.write(hosts[ihost] + '\n')
-                if launcher == 'srun':  # need to write host per task not per node for slurm
-                    # For xjet, each instance of chgres_inc must run on two nodes each
-                    if os.getenv('SLURM_JOB_PARTITION', '') == 'xjet':
-                        for a in range(0, 4):
-                            hostfile.write(hosts[ihost] + '\n')
-                        ihost += 1
-                        for a in range(0, 5):
-                            hostfile.write(hosts[ihost] + '\n')
-                    for a in range(0, 12):  # need 12 more of the same host for the 13 tasks for chgres_inc
-                        hostfile.write(hosts[ihost] + '\n')
-            if launcher == 'srun':
-                os.environ['SLURM_HOSTFILE'] = CalcAnlDir + '/hosts'
             print('interp_inc', fh, namelist)
-            job = subprocess.Popen(ExecCMDMPI13_host + ' ' + CalcAnlDir + '/chgres_inc.x', shell=True, cwd=CalcAnlDir)
-            print(ExecCMDMPI13_host + ' ' + CalcAnlDir + '/chgres_inc.x submitted on ' + hosts[ihost])
-            sys.stdout.flush()
-            ec = job.wait()
-            if ec != 0:
-                print('Error with chgres_inc.x at forecast hour: f' + format(fh, '03'))
-                print('Error with chgres_inc.x, exit code=' + str(ec))
-                print(locals())
-                sys.exit(ec)
-            ihost += 1
+            chgres_jobs.append({'name': 'chgres_inc.x at forecast hour f' + format(fh, '03'),
+                                'cmd': ExecCMDMPI13_host + ' ' + CalcAnlDir + '/chgres_inc.x',
+                                'cwd': CalcAnlDir,
+                                'setup': chgres_inc_setup(CalcAnlDir)})
         else:
             print('f' + format(fh, '03') + ' is in $IAUFHRS but increment file is missing. Skipping.')
 
+    LaunchScheduler(slots).run(chgres_jobs)
+
     # generate analysis from interpolated increment
     CalcAnlDir6 = RunDir + '/calcanl_' + format(6, '02')
     # set up the namelist
@@ -281,10 +342,6 @@ def calcanl_gfs(DoIAU, l4DEnsVar, Write4Danl, ComOut, APrefix,
     gsi_utils.write_nml(namelist, CalcAnlDir6 + '/calc_analysis.nml')
 
     # run the executable
-    if ihost >= nhosts - 1:
-        ihost = 0
-    if launcher == 'srun':
-        del os.environ['SLURM_HOSTFILE']
     print('fullres_calc_anl', namelist)
     fullres_anl_job = subprocess.Popen(ExecCMDMPILevs_nohost + ' ' + CalcAnlDir6 + '/calc_anl.x', shell=True, cwd=CalcAnlDir6)
     print(ExecCMDMPILevs_nohost + ' ' + CalcAnlDir6 + '/calc_anl.x submitted')
@@ -320,8 +377,7 @@ def calcanl_gfs(DoIAU, l4DEnsVar, Write4Danl, ComOut, APrefix,
                 gsi_utils.write_nml(namelist, CalcAnlDir6 + '/calc_analysis.nml')
 
                 # run the executable
-                if ihost > nhosts - 1:
-                    ihost = 0
+                # (the ensemble resolution analyses share calcanl_ensres_06 and use all tasks, so they run one at a time)
                 print('ensres_calc_anl', namelist)
                 ensres_anl_job = subprocess.Popen(ExecCMDMPILevs_nohost + ' ' + CalcAnlDir6 + '/calc_anl.x', shell=True, cwd=CalcAnlDir6)
                 print(ExecCMDMPILevs_nohost + ' ' + CalcAnlDir6 + '/calc_anl.x submitted')
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 """
 Appends tracer data from one NetCDF file to another and updates the tracer
-count.
+count.  The merge can also be done in-process for all tiles at once with
+merge_tiles().
 
 usage: merge_fv3_chem_tile.py [-h] atm_file chem_file core_file ctrl_file rest_file variable_file [out_file]
 
@@ -27,10 +28,9 @@ optional arguments:
 """
 import os
 import sys
-import subprocess
-from typing import List
+from typing import List, Optional
 from functools import partial
-from shutil import copyfile
+from concurrent.futures import ProcessPoolExecutor
 import argparse
 import numpy as np
 import netCDF4
@@ -40,7 +40,37 @@ import netCDF4
 print = partial(print, flush=True)
 
 
-def merge_tile(base_file_name: str, ctrl_file_name: str, core_file_name: str, rest_file_name: str, append_file_name: str, tracers_to_append: List[str]) -> None:
+def _create_variable_like(out_file: netCDF4.Dataset, name: str, variable: netCDF4.Variable,
+                          datatype=None, dimensions=None) -> netCDF4.Variable:
+    """Define a variable in out_file with the storage settings (fill value, chunking, compression) of variable"""
+    kwargs = {}
+    if not out_file.data_model.startswith("NETCDF3"):
+        filters = variable.filters() or {}
+        for key in ['zlib', 'complevel', 'shuffle', 'fletcher32']:
+            if key in filters:
+                kwargs[key] = filters[key]
+        chunking = variable.chunking()
+        if chunking not in (None, 'contiguous') and dimensions is None:
+            kwargs['chunksizes'] = chunking
+    fill_value = variable.getncattr('_FillValue') if '_FillValue' in variable.ncattrs() else None
+    return out_file.createVariable(name, datatype or variable.datatype, dimensions or variable.dimensions,
+                                   fill_value=fill_value, **kwargs)
+
+
+def _attributes(variable) -> dict:
+    """Attributes of a variable or dataset, without the checksum (which would no longer be valid)"""
+    return {key: variable.getncattr(key) for key in variable.ncattrs() if key not in ('checksum', '_FillValue')}
+
+
+def merge_tile(base_file_name: str, ctrl_file_name: str, core_file_name: str, rest_file_name: str, append_file_name: str,
+               tracers_to_append: List[str], out_file_name: Optional[str] = None) -> str:
+    """
+    Write a copy of base_file_name with the tracers appended from append_file_name, ntracer
+    updated and all checksums removed.  The output is written in a single pass to a temporary
+    file that replaces out_file_name (base_file_name if not given) once complete.
+
+    Returns the report of the total tracer masses.
+    """
     if not os.path.isfile(base_file_name):
         print("FATAL ERROR: Atmosphere file " + base_file_name + " does not exist!")
         sys.exit(102)
@@ -61,82 +91,118 @@ def merge_tile(base_file_name: str, ctrl_file_name: str, core_file_name: str, re
         print("FATAL ERROR: Chemistry file " + append_file_name + " does not exist!")
         sys.exit(106)
 
-    append_file = netCDF4.Dataset(append_file_name, "r")
-    base_file = netCDF4.Dataset(base_file_name, "r+")
-    core_file = netCDF4.Dataset(core_file_name, "r")
-    ctrl_file = netCDF4.Dataset(ctrl_file_name, "r")
-    rest_file = netCDF4.Dataset(rest_file_name, "r")
-
-    # read pressure layer thickness from restart file
-    delp = rest_file["delp"][0, :]
-    # read a, b coefficients to generate sigma levels
-    ak = core_file["ak"][0, :]
-    bk = core_file["bk"][0, :]
-
-    # read surface pressure from initial conditions file
-    psfc = base_file["ps"][:, :]
-    # read sigma-level a, b coefficients from initial conditions control file
-    ai = ctrl_file["vcoord"][0, 1:]
-    bi = ctrl_file["vcoord"][1, 1:]
-
-    # IC sigma levels must match model restart sigma levels
-    if ak.size != ai.size:
-        print("FATAL ERROR: Inconsistent size of A(k) arrays: src=", ak.size, ", dst=", ai.size)
-        sys.exit(107)
-
-    if bk.size != bi.size:
-        print("FATAL ERROR: Inconsistent size of B(k) arrays: src=", bk.size, ", dst=", bi.size)
-        sys.exit(108)
-
-    dp = np.zeros(delp.shape)
-    for k in range(0, dp.shape[0]):
-        dp[k, :, :] = ak[k + 1] - ak[k] + psfc * (bk[k + 1] - bk[k])
-
-    scale_factor = delp / dp
-
-    # print(base_file)
-    # print(base_file.dimensions["ntracer"])
-
-    old_ntracer = base_file.dimensions["ntracer"].size
-    new_ntracer = old_ntracer
-
-    print("Adding the following variables to " + base_file_name + ":\n")
-
-    print(" Name   | Total mass (restart) | Total mass (IC)      | Max column abs. diff.")
-    print("-" * 8 + "+" + "-" * 22 + "+" + "-" * 22 + "+" + "-" * 24)
-    for variable_name in tracers_to_append:
-        variable = append_file[variable_name]
-        if variable_name not in base_file.variables.keys():
-            new_ntracer = new_ntracer + 1
-            base_file.createVariable(variable_name, variable.datatype, base_file["sphum"].dimensions)
-        base_file[variable_name][0, :, :] = 0.
-        base_file[variable_name][1:, :, :] = scale_factor * variable[0, :, :, :]
-        base_file[variable_name].setncatts(variable.__dict__)
-        mass_src = variable * delp
-        mass_dst = base_file[variable_name][1:, :, :] * dp
-        mass_err_max = np.max(np.abs(mass_src - mass_dst))
-        total_mass_src = np.sum(mass_src)
-        total_mass_dst = np.sum(mass_dst)
-        print(f' {variable_name:6}   {total_mass_src:20}   {total_mass_dst:20}    {mass_err_max:22}')
-        # print("Done adding " + variable_name)
-
-    print("-" * 79 + "\n")
-
-    base_file.close()
-
-    if new_ntracer != old_ntracer:
-        print("Updating ntracer")
-
-        # Use ncks to rewrite file without ntracer so we can define it anew
-        subprocess.run(["ncks", "-x", "-v", "ntracer", "-O", base_file_name, base_file_name], check=True)
-
-        base_file = netCDF4.Dataset(base_file_name, "r+")
-        base_file.createDimension("ntracer", new_ntracer)
-        # print(base_file.dimensions["ntracer"])
-        base_file.close()
-
-    # Remove checksum
-    subprocess.run(["ncatted", "-a", "checksum,,d,,", base_file_name], check=True)
+    if out_file_name is None:
+        out_file_name = base_file_name
+    temp_file_name = f"{out_file_name}.tmp"
+
+    with netCDF4.Dataset(append_file_name, "r") as append_file, \
+            netCDF4.Dataset(base_file_name, "r") as base_file, \
+            netCDF4.Dataset(core_file_name, "r") as core_file, \
+            netCDF4.Dataset(ctrl_file_name, "r") as ctrl_file, \
+            netCDF4.Dataset(rest_file_name, "r") as rest_file:
+
+        # read pressure layer thickness from restart file
+        delp = rest_file["delp"][0, :]
+        # read a, b coefficients to generate sigma levels
+        ak = core_file["ak"][0, :]
+        bk = core_file["bk"][0, :]
+
+        # read surface pressure from initial conditions file
+        psfc = base_file["ps"][:, :]
+        # read sigma-level a, b coefficients from initial conditions control file
+        ai = ctrl_file["vcoord"][0, 1:]
+        bi = ctrl_file["vcoord"][1, 1:]
+
+        # IC sigma levels must match model restart sigma levels
+        if ak.size != ai.size:
+            print("FATAL ERROR: Inconsistent size of A(k) arrays: src=", ak.size, ", dst=", ai.size)
+            sys.exit(107)
+
+        if bk.size != bi.size:
+            print("FATAL ERROR: Inconsistent size of B(k) arrays: src=", bk.size, ", dst=", bi.size)
+            sys.exit(108)
+
+        nlev = delp.shape[0]
+        dp = np.diff(ak)[:nlev, np.newaxis, np.newaxis] + psfc[np.newaxis, :, :] * np.diff(bk)[:nlev, np.newaxis, np.newaxis]
+
+        scale_factor = delp / dp
+
+        new_tracers = [name for name in tracers_to_append if name not in base_file.variables.keys()]
+        old_ntracer = base_file.dimensions["ntracer"].size
+        new_ntracer = old_ntracer + len(new_tracers)
+
+        report = [f"Adding the following variables to {out_file_name}:\n",
+                  " Name   | Total mass (restart) | Total mass (IC)      | Max column abs. diff.",
+                  "-" * 8 + "+" + "-" * 22 + "+" + "-" * 22 + "+" + "-" * 24]
+
+        with netCDF4.Dataset(temp_file_name, "w", format=base_file.data_model) as out_file:
+            # Copy the header, with the updated ntracer and without checksums
+            out_file.setncatts(_attributes(base_file))
+            for name, dimension in base_file.dimensions.items():
+                if name == "ntracer":
+                    out_file.createDimension(name, new_ntracer)
+                else:
+                    out_file.createDimension(name, None if dimension.isunlimited() else dimension.size)
+
+            for name, variable in base_file.variables.items():
+                out_variable = _create_variable_like(out_file, name, variable)
+                attributes = _attributes(variable)
+                if name in tracers_to_append:
+                    attributes.update(_attributes(append_file[name]))
+                out_variable.setncatts(attributes)
+            for name in new_tracers:
+                variable = append_file[name]
+                out_variable = _create_variable_like(out_file, name, variable, datatype=variable.datatype,
+                                                     dimensions=base_file["sphum"].dimensions)
+                out_variable.setncatts(_attributes(variable))
+
+            # Copy the data of the base file
+            for name, variable in base_file.variables.items():
+                if name not in tracers_to_append:
+                    variable.set_auto_maskandscale(False)
+                    out_file[name].set_auto_maskandscale(False)
+                    out_file[name][...] = variable[...]
+
+            # Append the tracers
+            for variable_name in tracers_to_append:
+                variable = append_file[variable_name]
+                out_variable = out_file[variable_name]
+                out_variable[0, :, :] = 0.
+                out_variable[1:, :, :] = scale_factor * variable[0, :, :, :]
+                mass_src = variable * delp
+                mass_dst = out_variable[1:, :, :] * dp
+                mass_err_max = np.max(np.abs(mass_src - mass_dst))
+                total_mass_src = np.sum(mass_src)
+                total_mass_dst = np.sum(mass_dst)
+                report.append(f' {variable_name:6}   {total_mass_src:20}   {total_mass_dst:20}    {mass_err_max:22}')
+
+        report.append("-" * 79 + "\n")
+        if new_ntracer != old_ntracer:
+            report.append(f"Updated ntracer from {old_ntracer} to {new_ntracer}")
+
+    os.replace(temp_file_name, out_file_name)
+
+    return "\n".join(report)
+
+
+def merge_tiles(atm_files: List[str], ctrl_file_name: str, core_file_name: str, rest_files: List[str],
+                tracer_files: List[str], tracers_to_append: List[str], nprocs: Optional[int] = None) -> None:
+    """
+    Merge the tracers into the atmosphere files of all tiles (in place), one tile per process.
+    """
+    if not (len(atm_files) == len(rest_files) == len(tracer_files)):
+        raise ValueError("Atmosphere, restart and tracer file lists are not the same length")
+
+    if nprocs is None:
+        nprocs = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    nprocs = max(1, min(nprocs, len(atm_files)))
+
+    with ProcessPoolExecutor(max_workers=nprocs) as executor:
+        futures = [executor.submit(merge_tile, atm_file, ctrl_file_name, core_file_name, rest_file,
+                                   tracer_file, tracers_to_append)
+                   for atm_file, rest_file, tracer_file in zip(atm_files, rest_files, tracer_files)]
+        for future in futures:
+            print(future.result())
 
 
 def main() -> None:
@@ -163,16 +229,15 @@ def main() -> None:
     if out_file_name is None:
         print("INFO: No out_file specified, will edit atm_file in-place")
         out_file_name = atm_file_name
-    else:
-        if os.path.isfile(out_file_name):
-            print("WARNING: Specified out file " + out_file_name + " exists and will be overwritten")
-        copyfile(atm_file_name, out_file_name)
+    elif os.path.isfile(out_file_name):
+        print("WARNING: Specified out file " + out_file_name + " exists and will be overwritten")
 
     variable_file = open(variable_file)
     variable_names = variable_file.read().splitlines()
     variable_file.close()
 
-    merge_tile(out_file_name, ctrl_file_name, core_file_name, rest_file_name, chem_file_name, variable_names)
+    print(merge_tile(atm_file_name, ctrl_file_name, core_file_name, rest_file_name, chem_file_name, variable_names,
+                     out_file_name=out_file_name))
 
     # print(variable_names)
 
@@ -1,18 +1,46 @@
-
+import importlib
 import os
 
-from .task.analysis import Analysis
-from .task.aero_emissions import AerosolEmissions
-from .task.aero_analysis import AerosolAnalysis
-from .task.atm_analysis import AtmAnalysis
-from .task.atmens_analysis import AtmEnsAnalysis
-from .task.marine_bmat import MarineBMat
-from .task.snow_analysis import SnowAnalysis
-from .task.upp import UPP
-from .task.oceanice_products import OceanIceProducts
-from .task.gfs_forecast import GFSForecast
-from .utils import marine_da_utils
+# The tasks and utilities are only imported when they are first used (PEP 562),
+# so that a job does not load the dependencies (netCDF4, xarray, jcb, ...) of
+# the tasks it does not run
+_lazy_attributes = {
+    'Analysis': '.task.analysis',
+    'AerosolEmissions': '.task.aero_emissions',
+    'AerosolAnalysis': '.task.aero_analysis',
+    'AtmAnalysis': '.task.atm_analysis',
+    'AtmEnsAnalysis': '.task.atmens_analysis',
+    'MarineBMat': '.task.marine_bmat',
+    'SnowAnalysis': '.task.snow_analysis',
+    'UPP': '.task.upp',
+    'OceanIceProducts': '.task.oceanice_products',
+    'GFSForecast': '.task.gfs_forecast',
+}
+_lazy_modules = {
+    'marine_da_utils': '.utils.marine_da_utils',
+}
 
+__all__ = list(_lazy_attributes) + list(_lazy_modules)
 __docformat__ = "restructuredtext"
 __version__ = "0.1.0"
 pygfs_directory = os.path.dirname(__file__)
+
+# Opt-in timing trace of the tasks (see pygfs.utils.trace_utils)
+if os.environ.get('PYGFS_TRACE', 'NO').upper() not in ['NO', '']:
+    from .utils import trace_utils
+    trace_utils.enable()
+
+
+def __getattr__(name):
+    if name in _lazy_attributes:
+        value = getattr(importlib.import_module(_lazy_attributes[name], __name__), name)
+    elif name in _lazy_modules:
+        value = importlib.import_module(_lazy_modules[name], __name__)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
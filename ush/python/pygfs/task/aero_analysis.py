@@ -69,31 +69,47 @@ class AerosolAnalysis(Analysis):
         - staging model backgrounds
         - generating a YAML file for the JEDI executable
         - creating output directories
+
+        The files are staged by Analysis.initialize (see get_staging_dicts)
         """
         super().initialize()
 
+        # generate variational YAML file
+        logger.debug(f"Generate variational YAML file: {self.task_config.jedi_yaml}")
+        save_as_yaml(self.task_config.jedi_config, self.task_config.jedi_yaml)
+        logger.info(f"Wrote variational YAML to: {self.task_config.jedi_yaml}")
+
+    @logit(logger)
+    def get_staging_dicts(self: Analysis) -> List[Dict[str, Any]]:
+        """Compile the FileHandler dictionaries of the files a global aerosol analysis stages
+
+        This includes the CRTM fix files, FV3-JEDI fix files, B error files
+        and model backgrounds
+
+        Returns
+        ----------
+        staging_dicts: List[Dict]
+            a list of dictionaries for FileHandler
+        """
+        staging_dicts = []
+
         # stage CRTM fix files
         logger.info(f"Staging CRTM fix files from {self.task_config.CRTM_FIX_YAML}")
         crtm_fix_list = parse_j2yaml(self.task_config.CRTM_FIX_YAML, self.task_config)
-        FileHandler(crtm_fix_list).sync()
+        staging_dicts.append(crtm_fix_list)
 
         # stage fix files
         logger.info(f"Staging JEDI fix files from {self.task_config.JEDI_FIX_YAML}")
         jedi_fix_list = parse_j2yaml(self.task_config.JEDI_FIX_YAML, self.task_config)
-        FileHandler(jedi_fix_list).sync()
+        staging_dicts.append(jedi_fix_list)
 
         # stage berror files
         # copy BUMP files, otherwise it will assume ID matrix
         if self.task_config.get('STATICB_TYPE', 'identity') in ['bump']:
-            FileHandler(self.get_berror_dict(self.task_config)).sync()
+            staging_dicts.append(self.get_berror_dict(self.task_config))
 
         # stage backgrounds
-        FileHandler(self.get_bkg_dict(AttrDict(self.task_config, **self.task_config))).sync()
-
-        # generate variational YAML file
-        logger.debug(f"Generate variational YAML file: {self.task_config.jedi_yaml}")
-        save_as_yaml(self.task_config.jedi_config, self.task_config.jedi_yaml)
-        logger.info(f"Wrote variational YAML to: {self.task_config.jedi_yaml}")
+        staging_dicts.append(self.get_bkg_dict(AttrDict(self.task_config, **self.task_config)))
 
         # need output dir for diags and anl
         logger.debug("Create empty output [anl, diags] directories to receive output from executable")
@@ -101,7 +117,9 @@ class AerosolAnalysis(Analysis):
             os.path.join(self.task_config['DATA'], 'anl'),
             os.path.join(self.task_config['DATA'], 'diags'),
         ]
-        FileHandler({'mkdir': newdirs}).sync()
+        staging_dicts.append({'mkdir': newdirs})
+
+        return staging_dicts
 
     @logit(logger)
     def execute(self: Analysis) -> None:
@@ -217,10 +235,11 @@ class AerosolAnalysis(Analysis):
 
     @logit(logger)
     def get_bkg_dict(self, task_config: Dict[str, Any]) -> Dict[str, List[str]]:
-        """Compile a dictionary of model background files to copy
+        """Compile a dictionary of model background files to stage
 
         This method constructs a dictionary of FV3 RESTART files (coupler, core, tracer)
-        that are needed for global aerosol DA and returns said dictionary for use by the FileHandler class.
+        that are needed for global aerosol DA and returns said dictionary for use by the StagingPlan class.
+        The backgrounds are only read by the analysis, they are staged read-only.
 
         Parameters
         ----------
@@ -230,7 +249,7 @@ class AerosolAnalysis(Analysis):
         Returns
         ----------
         bkg_dict: Dict
-            a dictionary containing the list of model background files to copy for FileHandler
+            a dictionary containing the list of model background files to stage for StagingPlan
         """
         # NOTE for now this is FV3 RESTART files and just assumed to be fh006
 
@@ -262,7 +281,7 @@ class AerosolAnalysis(Analysis):
 
         bkg_dict = {
             'mkdir': [run_dir],
-            'copy': bkglist,
+            'readonly': bkglist,
         }
         return bkg_dict
 
@@ -5,14 +5,16 @@ import glob
 import tarfile
 from logging import getLogger
 from pprint import pformat
-from netCDF4 import Dataset
 from typing import List, Dict, Any, Union, Optional
 
 from jcb import render
-from wxflow import (parse_j2yaml, FileHandler, rm_p, logit,
+from wxflow import (parse_j2yaml, rm_p, logit,
                     Task, Executable, WorkflowException, to_fv3time, to_YMD,
                     Template, TemplateConstants)
 
+from pygfs.utils import fv3_increment_utils
+from pygfs.utils.staging_utils import StagingPlan
+
 logger = getLogger(__name__.split('.')[-1])
 
 
@@ -35,13 +37,14 @@ class Analysis(Task):
         # all JEDI analyses need a JEDI config
         self.task_config.jedi_config = self.get_jedi_config()
 
-        # all analyses need to stage observations
-        obs_dict = self.get_obs_dict()
-        FileHandler(obs_dict).sync()
-
-        # some analyses need to stage bias corrections
-        bias_dict = self.get_bias_dict()
-        FileHandler(bias_dict).sync()
+        # all analyses need to stage observations, some need bias corrections;
+        # they are staged in one plan with the files of the analysis
+        plan = StagingPlan.from_config(self.task_config)
+        plan.add(self.get_obs_dict())
+        plan.add(self.get_bias_dict())
+        for staging_dict in self.get_staging_dicts():
+            plan.add(staging_dict)
+        plan.execute()
 
         # link jedi executable to run directory
         self.link_jediexe()
@@ -93,6 +96,21 @@ class Analysis(Task):
 
         return jedi_config
 
+    @logit(logger)
+    def get_staging_dicts(self) -> List[Dict[str, Any]]:
+        """Compile the FileHandler dictionaries of the files an analysis stages
+
+        The fix files, background error and backgrounds of an analysis are staged,
+        with the observations and bias corrections, in one plan at initialize
+        (see pygfs.utils.staging_utils). Analyses override this method.
+
+        Returns
+        ----------
+        staging_dicts: List[Dict]
+            a list of dictionaries for FileHandler
+        """
+        return []
+
     @logit(logger)
     def get_obs_dict(self) -> Dict[str, Any]:
         """Compile a dictionary of observation files to copy
@@ -170,6 +188,10 @@ class Analysis(Task):
     def add_fv3_increments(self, inc_file_tmpl: str, bkg_file_tmpl: str, incvars: List) -> None:
         """Add cubed-sphere increments to cubed-sphere backgrounds
 
+        The tiles are processed concurrently, each in its own process, and the
+        increments are added in place a group of vertical levels at a time
+        (see pygfs.utils.fv3_increment_utils).
+
         Parameters
         ----------
         inc_file_tmpl : str
@@ -180,19 +202,8 @@ class Analysis(Task):
            List of increment variables to add to the background
         """
 
-        for itile in range(1, self.task_config.ntiles + 1):
-            inc_path = inc_file_tmpl.format(tilenum=itile)
-            bkg_path = bkg_file_tmpl.format(tilenum=itile)
-            with Dataset(inc_path, mode='r') as incfile, Dataset(bkg_path, mode='a') as rstfile:
-                for vname in incvars:
-                    increment = incfile.variables[vname][:]
-                    bkg = rstfile.variables[vname][:]
-                    anl = bkg + increment
-                    rstfile.variables[vname][:] = anl[:]
-                    try:
-                        rstfile.variables[vname].delncattr('checksum')  # remove the checksum so fv3 does not complain
-                    except (AttributeError, RuntimeError):
-                        pass  # checksum is missing, move on
+        fv3_increment_utils.add_fv3_increments(inc_file_tmpl, bkg_file_tmpl, incvars,
+                                               ntiles=self.task_config.ntiles)
 
     @logit(logger)
     def link_jediexe(self) -> None:
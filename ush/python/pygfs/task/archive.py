@@ -3,14 +3,17 @@
 import glob
 import os
 import shutil
-import tarfile
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
 from typing import Any, Dict, List
 
 from wxflow import (AttrDict, FileHandler, Hsi, Htar, Task,
-                    chgrp, get_gid, logit, mkdir_p, parse_j2yaml, rm_p, strftime,
+                    chgrp, get_gid, logit, parse_j2yaml, rm_p, strftime,
                     to_YMDH)
 
+from pygfs.utils.archive_manifest import ArchiveManifest
+from pygfs.utils.archive_utils import COMPRESS_SUFFIX, FilesetResolver, available_cores, check_codec, create_tarball
+
 logger = getLogger(__name__.split('.')[-1])
 
 
@@ -99,6 +102,10 @@ class Archive(Task):
         # Collect datasets that need to be archived
         # Each dataset represents one tarball
 
+        # Number of read-ahead threads per local tarball and number of tarballs built at once
+        self.tar_nthreads = arch_dict.get("ARCH_TAR_NTHREADS", 1)
+        self.tar_nparallel = arch_dict.get("ARCH_TAR_NPARALLEL", 1)
+
         if arch_dict.HPSSARCH:
             self.tar_cmd = "htar"
             self.hsi = Hsi()
@@ -109,7 +116,7 @@ class Archive(Task):
             self.chmod_cmd = self.hsi.chmod
         elif arch_dict.LOCALARCH:
             self.tar_cmd = "tar"
-            self.cvf = Archive._create_tarball
+            self.cvf = self._create_tarball
             self.chgrp_cmd = chgrp
             self.chmod_cmd = os.chmod
             self.rm_cmd = rm_p
@@ -117,18 +124,42 @@ class Archive(Task):
             self.tar_cmd = ""
             return arcdir_set, []
 
+        # Globs are expanded by listing each directory once; the listings also
+        # answer the stat calls made for the rstprod check and by tar
+        self.fileset_resolver = FilesetResolver(nthreads=self.tar_nthreads)
+
+        # Optionally record the archived members in a manifest, kept next to the tarballs
+        # (or in ARCDIR for HPSS), and use it to avoid re-archiving unchanged contents
+        self.manifest = None
+        self.cycle = to_YMDH(arch_dict.current_cycle)
+        if arch_dict.get("ARCH_MANIFEST", False):
+            manifest_dir = arch_dict.ATARDIR if arch_dict.LOCALARCH else arch_dict.ARCDIR
+            self.manifest = ArchiveManifest(os.path.join(manifest_dir, "archive_manifest.db"),
+                                            mode=arch_dict.get("ARCH_MANIFEST_MODE", "record"),
+                                            nthreads=self.tar_nthreads, local=arch_dict.LOCALARCH)
+            self.manifest.prune()
+
         master_yaml = "master_" + arch_dict.RUN + ".yaml.j2"
 
         parsed_sets = parse_j2yaml(os.path.join(archive_parm, master_yaml),
                                    arch_dict,
                                    allow_missing=False)
 
+        # Compression settings for local tarballs; a "default" entry applies to all
+        # datasets and may be overridden by dataset name or within the dataset itself
+        compression = parsed_sets.get("compression", None) or {}
+
         atardir_sets = []
 
-        for dataset in parsed_sets.datasets.values():
+        for name, dataset in parsed_sets.datasets.items():
+
+            dataset["compression"] = self._get_compression(name, dataset, compression)
+            dataset["target"] = dataset.target + COMPRESS_SUFFIX[dataset.compression.codec]
 
-            dataset["fileset"] = Archive._create_fileset(dataset)
-            dataset["has_rstprod"] = Archive._has_rstprod(dataset.fileset)
+            dataset["fileset"] = Archive._create_fileset(dataset, self.fileset_resolver)
+            if self.manifest is not None and len(dataset.fileset) > 0:
+                self.manifest.plan(dataset, self.cycle, lstat=self.fileset_resolver.lstat)
+            dataset["has_rstprod"] = Archive._has_rstprod(dataset.fileset, self.fileset_resolver)
 
             atardir_sets.append(dataset)
 
@@ -170,10 +201,23 @@ class Archive(Task):
             logger.warning(f"WARNING: skipping would-be empty archive {atardir_set.target}.")
             return
 
+        if atardir_set.get("skip", False):
+            logger.info(f"Contents of {atardir_set.target} are already archived, not creating it.")
+            self.manifest.record(atardir_set, self.cycle)
+            return
+
+        # Only local tarballs can be compressed; they hash their members for the manifest as they are written
+        cvf_kwargs = {}
+        digests = None
+        if self.tar_cmd == "tar":
+            cvf_kwargs = {'codec': atardir_set.compression.codec, 'level': atardir_set.compression.level}
+            if self.manifest is not None:
+                digests = cvf_kwargs['digests'] = {}
+
         if atardir_set.has_rstprod:
 
             try:
-                self.cvf(atardir_set.target, atardir_set.fileset)
+                self.cvf(atardir_set.target, atardir_set.fileset, **cvf_kwargs)
             # Regardless of exception type, attempt to remove the target
             except Exception:
                 self.rm_cmd(atardir_set.target)
@@ -182,11 +226,50 @@ class Archive(Task):
             self._protect_rstprod(atardir_set)
 
         else:
-            self.cvf(atardir_set.target, atardir_set.fileset)
+            self.cvf(atardir_set.target, atardir_set.fileset, **cvf_kwargs)
+
+        if self.manifest is not None:
+            self.manifest.record(atardir_set, self.cycle, digests)
+
+    @logit(logger)
+    def execute_backup_datasets(self, atardir_sets: List[Dict[str, Any]]) -> None:
+        """Create the backup tarballs for a list of yaml dicts, building up to
+        ARCH_TAR_NPARALLEL of them at the same time.  The manifest, if any, is
+        closed once all the tarballs have been attempted.
+
+        Parameters
+        ----------
+        atardir_sets: List[Dict[str, Any]]
+            List of dicts defining the sets of files to backup and the target tarballs.
+
+        Return
+        ------
+        None
+        """
+
+        nparallel = max(1, self.tar_nparallel)
+
+        try:
+            if nparallel == 1 or len(atardir_sets) <= 1:
+                for atardir_set in atardir_sets:
+                    self.execute_backup_dataset(atardir_set)
+                return
+
+            logger.info(f"Creating {len(atardir_sets)} tarballs, {nparallel} at a time")
+            with ThreadPoolExecutor(max_workers=nparallel) as executor:
+                futures = [executor.submit(self.execute_backup_dataset, atardir_set)
+                           for atardir_set in atardir_sets]
+
+            # Re-raise the first failure, if any, once all tarballs have been attempted
+            for future in futures:
+                future.result()
+        finally:
+            if self.manifest is not None:
+                self.manifest.close()
 
     @staticmethod
     @logit(logger)
-    def _create_fileset(atardir_set: Dict[str, Any]) -> List:
+    def _create_fileset(atardir_set: Dict[str, Any], resolver: FilesetResolver = None) -> List:
         """
         Collect the list of all available files from the parsed yaml dict.
         Globs are expanded and if required files are missing, an error is
@@ -200,13 +283,17 @@ class Archive(Task):
         ----------
         atardir_set: Dict
             Contains full paths for required and optional files to be archived.
+        resolver: FilesetResolver
+            Glob resolver caching the directory listings (a new one is created if not provided)
         """
 
+        if resolver is None:
+            resolver = FilesetResolver()
+
         fileset = []
         if "required" in atardir_set:
             if atardir_set.required is not None:
-                for item in atardir_set.required:
-                    glob_set = glob.glob(item)
+                for item, glob_set in zip(atardir_set.required, resolver.expand(atardir_set.required)):
                     if len(glob_set) == 0:
                         raise FileNotFoundError(f"FATAL ERROR: Required file, directory, or glob {item} not found!")
                     for entry in glob_set:
@@ -214,8 +301,7 @@ class Archive(Task):
 
         if "optional" in atardir_set:
             if atardir_set.optional is not None:
-                for item in atardir_set.optional:
-                    glob_set = glob.glob(item)
+                for item, glob_set in zip(atardir_set.optional, resolver.expand(atardir_set.optional)):
                     if len(glob_set) == 0:
                         logger.warning(f"WARNING: optional file/glob {item} not found!")
                     else:
@@ -226,14 +312,16 @@ class Archive(Task):
 
     @staticmethod
     @logit(logger)
-    def _has_rstprod(fileset: List) -> bool:
+    def _has_rstprod(fileset: List, resolver: FilesetResolver = None) -> bool:
         """
         Checks if any files in the input fileset belongs to rstprod.
 
         Parameters
         ----------
         fileset : List
-            List of filenames to check.
+            List of (already expanded) filenames to check.
+        resolver: FilesetResolver
+            Resolver used to expand the fileset, whose cached stat results are reused
         """
 
         try:
@@ -242,12 +330,11 @@ class Archive(Task):
             # rstprod does not exist on this machine
             return False
 
-        # Expand globs and check each file for group ownership
-        for file_or_glob in fileset:
-            glob_set = glob.glob(file_or_glob)
-            for filename in glob_set:
-                if os.stat(filename).st_gid == rstprod_gid:
-                    return True
+        # Check each file for group ownership
+        stat_file = os.stat if resolver is None else resolver.stat
+        for filename in fileset:
+            if stat_file(filename).st_gid == rstprod_gid:
+                return True
 
         return False
 
@@ -273,10 +360,46 @@ class Archive(Task):
                 raise RuntimeError(f"FATAL ERROR: Failed to protect {atardir_set.target}!\n"
                                    f"Please verify that it has been deleted!!")
 
-    @staticmethod
     @logit(logger)
-    def _create_tarball(target: str, fileset: List) -> None:
+    def _get_compression(self, name: str, dataset: Dict[str, Any], compression: Dict[str, Any]) -> AttrDict:
+        """Determine the compression codec and level of a dataset's tarball.
+
+        Parameters
+        ----------
+        name : str
+            Name (key) of the dataset in the master yaml
+        dataset : Dict[str, Any]
+            The dataset, which may contain its own "compression" settings
+        compression : Dict[str, Any]
+            "compression" section of the master yaml
+
+        Return
+        ------
+        settings : AttrDict
+            codec and level of the tarball
+        """
+
+        settings = AttrDict(codec="none", level=1)
+        for overrides in [compression.get("default", None), compression.get(name, None), dataset.get("compression", None)]:
+            if overrides:
+                settings.update(overrides)
+
+        if settings.codec != "none" and self.tar_cmd != "tar":
+            logger.warning(f"WARNING: compression is only supported for local archives, {dataset.target} "
+                           "will not be compressed.")
+            settings.codec = "none"
+
+        check_codec(settings.codec)
+
+        return settings
+
+    @logit(logger)
+    def _create_tarball(self, target: str, fileset: List, codec: str = "none", level: int = 1,
+                        digests: Dict[str, str] = None) -> None:
         """Method to create a local tarball.
+        Files are read ahead of the tar writer by ARCH_TAR_NTHREADS threads and,
+        if requested, the tarball is compressed by the cores available to the job,
+        shared by the ARCH_TAR_NPARALLEL tarballs created at the same time.
 
         Parameters
         ----------
@@ -285,16 +408,21 @@ class Archive(Task):
 
         file_list : List
             List of files to add to an archive
+
+        codec : str
+            Compression codec ("none", "gzip" or "zstd")
+
+        level : int
+            Compression level
+
+        digests : Dict[str, str]
+            Filled with the hash of each member, for the manifest (optional)
         """
 
         # TODO create a set of tar helper functions in wxflow
-        # Attempt to create the parent directory if it does not exist
-        mkdir_p(os.path.dirname(os.path.realpath(target)))
-
-        # Create the archive
-        with tarfile.open(target, "w") as tarball:
-            for filename in fileset:
-                tarball.add(filename)
+        create_tarball(target, fileset, nthreads=self.tar_nthreads, lstat=self.fileset_resolver.lstat,
+                       codec=codec, level=level, digests=digests,
+                       ncompress=max(1, available_cores() // max(1, self.tar_nparallel)))
 
     @logit(logger)
     def _gen_relative_paths(self, root_path: str) -> Dict:
@@ -70,18 +70,39 @@ class AtmAnalysis(Analysis):
         - staging model backgrounds
         - generating a YAML file for the JEDI executable
         - creating output directories
+
+        The files are staged by Analysis.initialize (see get_staging_dicts)
         """
         super().initialize()
 
+        # generate variational YAML file
+        logger.debug(f"Generate variational YAML file: {self.task_config.jedi_yaml}")
+        save_as_yaml(self.task_config.jedi_config, self.task_config.jedi_yaml)
+        logger.info(f"Wrote variational YAML to: {self.task_config.jedi_yaml}")
+
+    @logit(logger)
+    def get_staging_dicts(self: Analysis) -> List[Dict[str, Any]]:
+        """Compile the FileHandler dictionaries of the files a global atm analysis stages
+
+        This includes the CRTM fix files, FV3-JEDI fix files, B error files,
+        ensemble files for the hybrid B and model backgrounds
+
+        Returns
+        ----------
+        staging_dicts: List[Dict]
+            a list of dictionaries for FileHandler
+        """
+        staging_dicts = []
+
         # stage CRTM fix files
         logger.info(f"Staging CRTM fix files from {self.task_config.CRTM_FIX_YAML}")
         crtm_fix_list = parse_j2yaml(self.task_config.CRTM_FIX_YAML, self.task_config)
-        FileHandler(crtm_fix_list).sync()
+        staging_dicts.append(crtm_fix_list)
 
         # stage fix files
         logger.info(f"Staging JEDI fix files from {self.task_config.JEDI_FIX_YAML}")
         jedi_fix_list = parse_j2yaml(self.task_config.JEDI_FIX_YAML, self.task_config)
-        FileHandler(jedi_fix_list).sync()
+        staging_dicts.append(jedi_fix_list)
 
         # stage static background error files, otherwise it will assume ID matrix
         logger.info(f"Stage files for STATICB_TYPE {self.task_config.STATICB_TYPE}")
@@ -89,23 +110,18 @@ class AtmAnalysis(Analysis):
             berror_staging_dict = parse_j2yaml(self.task_config.BERROR_STAGING_YAML, self.task_config)
         else:
             berror_staging_dict = {}
-        FileHandler(berror_staging_dict).sync()
+        staging_dicts.append(berror_staging_dict)
 
         # stage ensemble files for use in hybrid background error
         if self.task_config.DOHYBVAR:
             logger.debug(f"Stage ensemble files for DOHYBVAR {self.task_config.DOHYBVAR}")
             fv3ens_staging_dict = parse_j2yaml(self.task_config.FV3ENS_STAGING_YAML, self.task_config)
-            FileHandler(fv3ens_staging_dict).sync()
+            staging_dicts.append(fv3ens_staging_dict)
 
         # stage backgrounds
         logger.info(f"Staging background files from {self.task_config.VAR_BKG_STAGING_YAML}")
         bkg_staging_dict = parse_j2yaml(self.task_config.VAR_BKG_STAGING_YAML, self.task_config)
-        FileHandler(bkg_staging_dict).sync()
-
-        # generate variational YAML file
-        logger.debug(f"Generate variational YAML file: {self.task_config.jedi_yaml}")
-        save_as_yaml(self.task_config.jedi_config, self.task_config.jedi_yaml)
-        logger.info(f"Wrote variational YAML to: {self.task_config.jedi_yaml}")
+        staging_dicts.append(bkg_staging_dict)
 
         # need output dir for diags and anl
         logger.debug("Create empty output [anl, diags] directories to receive output from executable")
@@ -113,7 +129,9 @@ class AtmAnalysis(Analysis):
             os.path.join(self.task_config.DATA, 'anl'),
             os.path.join(self.task_config.DATA, 'diags'),
         ]
-        FileHandler({'mkdir': newdirs}).sync()
+        staging_dicts.append({'mkdir': newdirs})
+
+        return staging_dicts
 
     @logit(logger)
     def variational(self: Analysis) -> None:
@@ -5,7 +5,7 @@ import glob
 import gzip
 import tarfile
 from logging import getLogger
-from typing import Dict, List
+from typing import Dict, List, Any
 
 from wxflow import (AttrDict,
                     FileHandler,
@@ -67,6 +67,8 @@ class AtmEnsAnalysis(Analysis):
         - generating a YAML file for the JEDI executable
         - creating output directories
 
+        The files are staged by Analysis.initialize (see get_staging_dicts)
+
         Parameters
         ----------
         Analysis: parent class for GDAS task
@@ -77,25 +79,39 @@ class AtmEnsAnalysis(Analysis):
         """
         super().initialize()
 
+        # generate ensemble da YAML file
+        logger.debug(f"Generate ensemble da YAML file: {self.task_config.jedi_yaml}")
+        save_as_yaml(self.task_config.jedi_config, self.task_config.jedi_yaml)
+        logger.info(f"Wrote ensemble da YAML to: {self.task_config.jedi_yaml}")
+
+    @logit(logger)
+    def get_staging_dicts(self: Analysis) -> List[Dict[str, Any]]:
+        """Compile the FileHandler dictionaries of the files a global atmens analysis stages
+
+        This includes the CRTM fix files, FV3-JEDI fix files and the backgrounds
+        of the ensemble members
+
+        Returns
+        ----------
+        staging_dicts: List[Dict]
+            a list of dictionaries for FileHandler
+        """
+        staging_dicts = []
+
         # stage CRTM fix files
         logger.info(f"Staging CRTM fix files from {self.task_config.CRTM_FIX_YAML}")
         crtm_fix_list = parse_j2yaml(self.task_config.CRTM_FIX_YAML, self.task_config)
-        FileHandler(crtm_fix_list).sync()
+        staging_dicts.append(crtm_fix_list)
 
         # stage fix files
         logger.info(f"Staging JEDI fix files from {self.task_config.JEDI_FIX_YAML}")
         jedi_fix_list = parse_j2yaml(self.task_config.JEDI_FIX_YAML, self.task_config)
-        FileHandler(jedi_fix_list).sync()
+        staging_dicts.append(jedi_fix_list)
 
         # stage backgrounds
         logger.info(f"Stage ensemble member background files")
         bkg_staging_dict = parse_j2yaml(self.task_config.LGETKF_BKG_STAGING_YAML, self.task_config)
-        FileHandler(bkg_staging_dict).sync()
-
-        # generate ensemble da YAML file
-        logger.debug(f"Generate ensemble da YAML file: {self.task_config.jedi_yaml}")
-        save_as_yaml(self.task_config.jedi_config, self.task_config.jedi_yaml)
-        logger.info(f"Wrote ensemble da YAML to: {self.task_config.jedi_yaml}")
+        staging_dicts.append(bkg_staging_dict)
 
         # need output dir for diags and anl
         logger.debug("Create empty output [anl, diags] directories to receive output from executable")
@@ -103,7 +119,9 @@ class AtmEnsAnalysis(Analysis):
             os.path.join(self.task_config.DATA, 'anl'),
             os.path.join(self.task_config.DATA, 'diags'),
         ]
-        FileHandler({'mkdir': newdirs}).sync()
+        staging_dicts.append({'mkdir': newdirs})
+
+        return staging_dicts
 
     @logit(logger)
     def letkf(self: Analysis) -> None:
@@ -4,6 +4,7 @@ import os
 import glob
 from logging import getLogger
 import pygfs.utils.marine_da_utils as mdau
+from pygfs.utils.staging_utils import StagingPlan
 
 from wxflow import (AttrDict,
                     FileHandler,
@@ -73,7 +74,7 @@ class MarineBMat(Task):
         # stage fix files
         logger.info(f"Staging SOCA fix files from {self.task_config.SOCA_INPUT_FIX_DIR}")
         soca_fix_list = parse_j2yaml(self.task_config.SOCA_FIX_YAML_TMPL, self.task_config)
-        FileHandler(soca_fix_list).sync()
+        StagingPlan.from_config(self.task_config).add(soca_fix_list).execute()
 
         # prepare the MOM6 input.nml
         mdau.prep_input_nml(self.task_config)
@@ -81,7 +82,7 @@ class MarineBMat(Task):
         # stage backgrounds
         # TODO(G): Check ocean backgrounds dates for consistency
         bkg_list = parse_j2yaml(self.task_config.MARINE_DET_STAGE_BKG_YAML_TMPL, self.task_config)
-        FileHandler(bkg_list).sync()
+        StagingPlan.from_config(self.task_config).add(bkg_list).execute()
         for cice_fname in ['./INPUT/cice.res.nc', './bkg/ice.bkg.f006.nc', './bkg/ice.bkg.f009.nc']:
             mdau.cice_hist2fms(cice_fname, cice_fname)
 
@@ -17,6 +17,7 @@ from wxflow import (AttrDict,
                     Executable,
                     WorkflowException)
 from pygfs.task.analysis import Analysis
+from pygfs.utils.staging_utils import StagingPlan, check_mutable
 
 logger = getLogger(__name__.split('.')[-1])
 
@@ -159,7 +160,7 @@ class SnowAnalysis(Analysis):
 
         # stage backgrounds
         logger.info("Staging backgrounds")
-        FileHandler(self.get_bkg_dict(localconf)).sync()
+        StagingPlan.from_config(self.task_config).add(self.get_bkg_dict(localconf)).execute()
 
         # Read and render the IMS_OBS_LIST yaml
         logger.info(f"Reading {self.task_config.IMS_OBS_LIST}")
@@ -237,6 +238,7 @@ class SnowAnalysis(Analysis):
         - creates artifacts in the DATA directory by copying fix files
         - creates the JEDI LETKF yaml from the template
         - stages backgrounds, observations and ensemble members
+          (in Analysis.initialize, see get_staging_dicts)
 
         Parameters
         ----------
@@ -246,6 +248,28 @@ class SnowAnalysis(Analysis):
 
         super().initialize()
 
+        # Write out letkfoi YAML file
+        save_as_yaml(self.task_config.jedi_config, self.task_config.jedi_yaml)
+        logger.info(f"Wrote letkfoi YAML to: {self.task_config.jedi_yaml}")
+
+    @logit(logger)
+    def get_staging_dicts(self) -> List[Dict]:
+        """Compile the FileHandler dictionaries of the files a snow analysis stages
+
+        This includes the member directories, the JEDI fix files and the
+        ensemble backgrounds
+
+        Parameters
+        ----------
+        self : Analysis
+            Instance of the SnowAnalysis object
+
+        Returns
+        ----------
+        staging_dicts: List[Dict]
+            a list of dictionaries for FileHandler
+        """
+
         # create a temporary dict of all keys needed in this method
         localconf = AttrDict()
         keys = ['DATA', 'current_cycle', 'COM_OBS', 'COM_ATMOS_RESTART_PREV',
@@ -257,20 +281,16 @@ class SnowAnalysis(Analysis):
         dirlist = []
         for imem in range(1, SnowAnalysis.NMEM_SNOWENS + 1):
             dirlist.append(os.path.join(localconf.DATA, 'bkg', f'mem{imem:03d}'))
-        FileHandler({'mkdir': dirlist}).sync()
+        staging_dicts = [{'mkdir': dirlist}]
 
         # stage fix files
         logger.info(f"Staging JEDI fix files from {self.task_config.JEDI_FIX_YAML}")
         jedi_fix_list = parse_j2yaml(self.task_config.JEDI_FIX_YAML, self.task_config)
-        FileHandler(jedi_fix_list).sync()
+        staging_dicts.append(jedi_fix_list)
 
         # stage backgrounds
         logger.info("Staging ensemble backgrounds")
-        FileHandler(self.get_ens_bkg_dict(localconf)).sync()
-
-        # Write out letkfoi YAML file
-        save_as_yaml(self.task_config.jedi_config, self.task_config.jedi_yaml)
-        logger.info(f"Wrote letkfoi YAML to: {self.task_config.jedi_yaml}")
+        staging_dicts.append(self.get_ens_bkg_dict(localconf))
 
         # need output dir for diags and anl
         logger.info("Create empty output [anl, diags] directories to receive output from executable")
@@ -278,7 +298,9 @@ class SnowAnalysis(Analysis):
             os.path.join(localconf.DATA, "anl"),
             os.path.join(localconf.DATA, "diags"),
         ]
-        FileHandler({'mkdir': newdirs}).sync()
+        staging_dicts.append({'mkdir': newdirs})
+
+        return staging_dicts
 
     @logit(logger)
     def execute(self) -> None:
@@ -385,10 +407,11 @@ class SnowAnalysis(Analysis):
     @staticmethod
     @logit(logger)
     def get_bkg_dict(config: Dict) -> Dict[str, List[str]]:
-        """Compile a dictionary of model background files to copy
+        """Compile a dictionary of model background files to stage
 
         This method constructs a dictionary of FV3 RESTART files (coupler, sfc_data)
-        that are needed for global snow DA and returns said dictionary for use by the FileHandler class.
+        that are needed for global snow DA and returns said dictionary for use by the StagingPlan class.
+        The backgrounds are only read, they are staged read-only.
 
         Parameters
         ----------
@@ -403,7 +426,7 @@ class SnowAnalysis(Analysis):
         Returns
         ----------
         bkg_dict: Dict
-            a dictionary containing the list of model background files to copy for FileHandler
+            a dictionary containing the list of model background files to stage for StagingPlan
         """
         # NOTE for now this is FV3 RESTART files and just assumed to be fh006
 
@@ -427,16 +450,18 @@ class SnowAnalysis(Analysis):
 
         bkg_dict = {
             'mkdir': [run_dir],
-            'copy': bkglist
+            'readonly': bkglist
         }
         return bkg_dict
 
     @staticmethod
     @logit(logger)
     def get_ens_bkg_dict(config: Dict) -> Dict:
-        """Compile a dictionary of model background files to copy for the ensemble
+        """Compile a dictionary of model background files to stage for the ensemble
         Note that a "Fake" 2-member ensemble backgroud is being created by copying FV3 RESTART files (coupler, sfc_data)
         from the deterministic background to DATA/bkg/mem001, 002.
+        The sfc_data files are perturbed in place (see create_ensemble), they are staged mutable;
+        the coupler files are staged read-only.
 
          Parameters
          ----------
@@ -451,11 +476,12 @@ class SnowAnalysis(Analysis):
          Returns
          ----------
          bkg_dict: Dict
-             a dictionary containing the list of model background files to copy for FileHandler
+             a dictionary containing the list of model background files to stage for StagingPlan
          """
 
         dirlist = []
         bkglist = []
+        couplerlist = []
 
         # get FV3 sfc_data RESTART files; Note an ensemble is being created
         rst_dir = os.path.join(config.COM_ATMOS_RESTART_PREV)
@@ -468,7 +494,7 @@ class SnowAnalysis(Analysis):
 
             # Snow DA needs coupler
             basename = f'{to_fv3time(config.current_cycle)}.coupler.res'
-            bkglist.append([os.path.join(rst_dir, basename), os.path.join(run_dir, basename)])
+            couplerlist.append([os.path.join(rst_dir, basename), os.path.join(run_dir, basename)])
 
             # Snow DA only needs sfc_data
             for ftype in ['sfc_data']:
@@ -479,7 +505,8 @@ class SnowAnalysis(Analysis):
 
         bkg_dict = {
             'mkdir': dirlist,
-            'copy': bkglist
+            'readonly': couplerlist,
+            'mutable': bkglist
         }
 
         return bkg_dict
@@ -520,6 +547,7 @@ class SnowAnalysis(Analysis):
                 # open file
                 out_netcdf = os.path.join(workdir, memchar, 'RESTART', f"{to_fv3time(config.current_cycle)}.sfc_data.tile{tt}.nc")
                 logger.debug(f"creating member {out_netcdf}")
+                check_mutable(out_netcdf)
                 with Dataset(out_netcdf, "r+") as ncOut:
                     slmsk_array = ncOut.variables['slmsk'][:]
                     vtype_array = ncOut.variables['vtype'][:]
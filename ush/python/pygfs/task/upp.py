@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 
 import os
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from logging import getLogger
-from typing import Dict, Any, Union
+from typing import Dict, Any, List, Optional, Tuple, Union
 from pprint import pformat
 
 from wxflow import (AttrDict,
@@ -15,6 +17,8 @@ from wxflow import (AttrDict,
                     WorkflowException,
                     Executable, which)
 
+from pygfs.utils.grib2_utils import index_grib2_files
+
 logger = getLogger(__name__.split('.')[-1])
 
 
@@ -51,15 +55,18 @@ class UPP(Task):
                                       'Valid UPP_RUN values are:\n' +
                                       f'{", ".join(self.VALID_UPP_RUN)}')
 
-        valid_datetime = add_to_datetime(self.task_config.current_cycle, to_timedelta(f"{self.task_config.FORECAST_HOUR}H"))
+        # A batch of forecast hours (FHRLST e.g. f000_f001_f002) or a single one (FORECAST_HOUR)
+        fhrlst = str(self.task_config.get('FHRLST', ''))
+        if fhrlst:
+            forecast_hours = [int(fhr) for fhr in re.findall(r'-?\d+', fhrlst)]
+        else:
+            forecast_hours = [int(self.task_config.FORECAST_HOUR)]
 
         # Extend task_config with localdict
         localdict = AttrDict(
             {'upp_run': self.task_config.UPP_RUN,
-             'forecast_hour': self.task_config.FORECAST_HOUR,
-             'valid_datetime': valid_datetime,
-             'atmos_filename': f"atm_{valid_datetime.strftime('%Y%m%d%H%M%S')}.nc",
-             'flux_filename': f"sfc_{valid_datetime.strftime('%Y%m%d%H%M%S')}.nc"
+             'forecast_hours': forecast_hours,
+             **self._forecast_hour_dict(self.task_config.current_cycle, forecast_hours[0])
              }
         )
         self.task_config = AttrDict(**self.task_config, **localdict)
@@ -69,6 +76,42 @@ class UPP(Task):
         self.task_config.upp_yaml = parse_j2yaml(self.task_config.UPP_CONFIG, self.task_config)
         logger.debug(f"upp_yaml:\n{pformat(self.task_config.upp_yaml)}")
 
+    @staticmethod
+    def _forecast_hour_dict(current_cycle, forecast_hour: int) -> Dict[str, Any]:
+        """Keys of the task configuration that depend on the forecast hour
+        """
+        valid_datetime = add_to_datetime(current_cycle, to_timedelta(f"{forecast_hour}H"))
+        return {'forecast_hour': forecast_hour,
+                'valid_datetime': valid_datetime,
+                'atmos_filename': f"atm_{valid_datetime.strftime('%Y%m%d%H%M%S')}.nc",
+                'flux_filename': f"sfc_{valid_datetime.strftime('%Y%m%d%H%M%S')}.nc"}
+
+    @logit(logger)
+    def hour_config(self, forecast_hour: int) -> Tuple[AttrDict, AttrDict]:
+        """Task configuration and upp.yaml of a forecast hour of a batch
+        Each forecast hour is processed in its own DATA/fXXX/ directory
+
+        Parameters
+        ----------
+        forecast_hour : int
+            forecast hour of the batch
+
+        Returns
+        -------
+        upp_dict : AttrDict
+            task configuration of the forecast hour
+        upp_yaml : AttrDict
+            upp.yaml resolved for the forecast hour
+        """
+        upp_dict = AttrDict(self.task_config)
+        upp_dict.update(self._forecast_hour_dict(self.task_config.current_cycle, forecast_hour))
+        upp_dict.DATA = os.path.join(self.task_config.DATA, f"f{forecast_hour:03d}")
+        upp_dict.pop('upp_yaml', None)
+
+        upp_yaml = parse_j2yaml(self.task_config.UPP_CONFIG, upp_dict)
+
+        return upp_dict, upp_yaml
+
     @staticmethod
     @logit(logger)
     def initialize(upp_yaml: Dict) -> None:
@@ -148,7 +191,7 @@ class UPP(Task):
 
     @classmethod
     @logit(logger)
-    def run(cls, workdir: Union[str, os.PathLike], aprun_cmd: str, exec_name: str = 'upp.x') -> None:
+    def run(cls, workdir: Union[str, os.PathLike], aprun_cmd: str, exec_name: str = 'upp.x', output: Any = None) -> None:
         """
         Run the UPP executable
 
@@ -160,6 +203,8 @@ class UPP(Task):
             Launcher command e.g. mpirun -np <ntasks> or srun, etc.
         exec_name : str
             Name of the UPP executable e.g. upp.x
+        output : file object (optional)
+            Where to send the output of the executable, instead of the job log
 
         Returns
         -------
@@ -170,13 +215,14 @@ class UPP(Task):
         exec_cmd = Executable(aprun_cmd)
         exec_cmd.add_default_arg(os.path.join(workdir, exec_name))
 
-        UPP._call_executable(exec_cmd)
+        UPP._call_executable(exec_cmd, output)
 
     @classmethod
     @logit(logger)
     def index(cls, workdir: Union[str, os.PathLike], forecast_hour: int) -> None:
         """
-        Index the grib2file
+        Index the grib2files with grb2index, or natively without starting a process
+        for each one (see pygfs.utils.grib2_utils)
 
         Parameters
         ----------
@@ -187,6 +233,9 @@ class UPP(Task):
 
         Environment Parameters
         ----------------------
+        UPP_NATIVE_INDEX : str (optional)
+            default: NO
+            YES to index the grib2files natively (not yet validated against grb2index)
         GRB2INDEX : str (optional)
             path to executable "grb2index"
             Typically set in the modulefile
@@ -195,37 +244,46 @@ class UPP(Task):
         -------
         None
         """
-        os.chdir(workdir)
         logger.info("Generate index file")
 
+        native = os.environ.get("UPP_NATIVE_INDEX", "NO").upper() in ["YES", "TRUE"]
         grb2index_cmd = os.environ.get("GRB2INDEX", None)
 
         template = f"GFS{{file_type}}.GrbF{forecast_hour:02d}"
 
+        grbfiles = []
         for ftype in ['PRS', 'FLX']:
-            grbfile = template.format(file_type=ftype)
-            grbfidx = f"{grbfile}.idx"
+            grbfile = os.path.join(workdir, template.format(file_type=ftype))
 
             if not os.path.exists(grbfile):
                 logger.info(f"No {grbfile} to process, skipping ...")
                 continue
 
             logger.info(f"Creating index file for {grbfile}")
+            grbfiles.append(grbfile)
+
+        if native:
+            index_grib2_files(grbfiles, [f"{grbfile}.idx" for grbfile in grbfiles], nprocs=len(grbfiles))
+            return
+
+        for grbfile in grbfiles:
             exec_cmd = which("grb2index") if grb2index_cmd is None else Executable(grb2index_cmd)
-            exec_cmd.add_default_arg(os.path.join(workdir, grbfile))
-            exec_cmd.add_default_arg(os.path.join(workdir, grbfidx))
+            exec_cmd.add_default_arg(grbfile)
+            exec_cmd.add_default_arg(f"{grbfile}.idx")
 
             UPP._call_executable(exec_cmd)
 
     @staticmethod
     @logit(logger)
-    def _call_executable(exec_cmd: Executable) -> None:
+    def _call_executable(exec_cmd: Executable, output: Any = None) -> None:
         """Internal method to call executable
 
         Parameters
         ----------
         exec_cmd : Executable
             Executable to run
+        output : file object (optional)
+            Where to send the output and errors of the executable
 
         Raises
         ------
@@ -237,7 +295,10 @@ class UPP(Task):
 
         logger.info(f"Executing {exec_cmd}")
         try:
-            exec_cmd()
+            if output is None:
+                exec_cmd()
+            else:
+                exec_cmd(output=output, error=output)
         except OSError:
             logger.exception(f"FATAL ERROR: Failed to execute {exec_cmd}")
             raise OSError(f"{exec_cmd}")
@@ -245,6 +306,150 @@ class UPP(Task):
             logger.exception(f"FATAL ERROR: Error occurred during execution of {exec_cmd}")
             raise WorkflowException(f"{exec_cmd}")
 
+    @logit(logger)
+    def execute_hours(self, aprun_cmd: str, nconcurrent: int = 1, log_prefix: Optional[str] = None) -> None:
+        """Run the UPP for each forecast hour of the batch
+
+        The static data were staged once in DATA/ by `initialize`.  The inputs
+        common to all the forecast hours (e.g. the CRTM coefficients of 'goes')
+        are copied once as well, and both are linked in the DATA/fXXX/ directory
+        of each forecast hour.  upp.x runs for `nconcurrent` forecast hours at a
+        time, each in its own process and with its share of the ranks of
+        `aprun_cmd`, while the output of the forecast hours already processed is
+        indexed and copied to COM/ in the background.
+
+        Parameters
+        ----------
+        aprun_cmd : str
+            launcher command for upp.x, for all the ranks of the job
+        nconcurrent : int
+            default: 1
+            number of forecast hours processed at the same time
+        log_prefix : str
+            default: None
+            when given, the output of upp.x of a forecast hour goes to <log_prefix>fXXX.log
+
+        Returns
+        -------
+        None
+        """
+
+        hour_configs = [self.hour_config(forecast_hour) for forecast_hour in self.task_config.forecast_hours]
+        self._stage_common_data(self.task_config.DATA, hour_configs)
+
+        aprun_cmd, nconcurrent = self._split_launcher(aprun_cmd, nconcurrent)
+        logger.info(f"Post-process {len(hour_configs)} forecast hours, {nconcurrent} at a time with '{aprun_cmd}'")
+
+        # The indexing and copy of an hour are queued as soon as its upp.x is done;
+        # the runs are shut down first, as they feed the queue
+        with ThreadPoolExecutor(max_workers=1) as finalize_executor, \
+                ProcessPoolExecutor(max_workers=nconcurrent) as run_executor:
+            runs = [run_executor.submit(UPP._run_hour, upp_dict, upp_yaml, aprun_cmd,
+                                        f"{log_prefix}f{upp_dict.forecast_hour:03d}.log" if log_prefix else None)
+                    for upp_dict, upp_yaml in hour_configs]
+            finals = []
+            for run, (upp_dict, upp_yaml) in zip(runs, hour_configs):
+                if run.exception() is not None:
+                    for pending in runs:
+                        pending.cancel()
+                    break
+                finals.append(finalize_executor.submit(UPP._finalize_hour, upp_dict, upp_yaml))
+
+        # Re-raise the first failure, if any
+        for run in runs:
+            run.result()
+        for final in finals:
+            final.result()
+
+    @staticmethod
+    @logit(logger)
+    def _stage_common_data(workdir: Union[str, os.PathLike], hour_configs: List[Tuple[AttrDict, AttrDict]]) -> None:
+        """Copy the inputs common to all the forecast hours to the work directory,
+        and link the files of the work directory in the directory of each forecast hour
+
+        Parameters
+        ----------
+        workdir : str | os.PathLike
+            work directory with the static data
+        hour_configs : List[Tuple[AttrDict, AttrDict]]
+            task configuration and upp.yaml of each forecast hour (see hour_config);
+            the common inputs are removed from their 'upp_run' data_in
+        """
+
+        def _destination(src, dest):
+            return os.path.join(dest, os.path.basename(src)) if dest.endswith('/') else dest
+
+        copies = [upp_yaml[upp_dict.upp_run].data_in.get('copy', []) for upp_dict, upp_yaml in hour_configs]
+        common = set.intersection(*[{src for src, _ in copy_list} for copy_list in copies]) if len(copies) > 1 else set()
+
+        copy_list = []
+        for (upp_dict, upp_yaml), hour_copies in zip(hour_configs, copies):
+            for src, dest in hour_copies:
+                if src in common:
+                    dest = os.path.join(workdir, os.path.relpath(_destination(src, dest), upp_dict.DATA))
+                    if [src, dest] not in copy_list:
+                        copy_list.append([src, dest])
+            upp_yaml[upp_dict.upp_run].data_in['copy'] = [[src, dest] for src, dest in hour_copies if src not in common]
+        if copy_list:
+            logger.info(f"Copy {len(copy_list)} inputs common to all the forecast hours to run directory")
+            FileHandler({'copy': copy_list}).sync()
+
+        static_files = [entry.name for entry in os.scandir(workdir) if entry.is_file()]
+        for upp_dict, _ in hour_configs:
+            os.makedirs(upp_dict.DATA, exist_ok=True)
+            for name in static_files:
+                link = os.path.join(upp_dict.DATA, name)
+                if not os.path.lexists(link):
+                    os.symlink(os.path.join(workdir, name), link)
+
+    @staticmethod
+    def _split_launcher(aprun_cmd: str, nconcurrent: int) -> Tuple[str, int]:
+        """Launcher command for a share of the ranks of `aprun_cmd`, and the number of shares
+
+        Only srun places concurrent launches on distinct resources of the allocation
+        (each job step gets its own cores); the other launchers (e.g. mpiexec) would
+        start all the shares on the first nodes, so the forecast hours are then
+        processed one at a time whatever `nconcurrent` is.
+        """
+        nconcurrent = max(1, int(nconcurrent))
+        if nconcurrent == 1:
+            return aprun_cmd, 1
+
+        if os.path.basename(aprun_cmd.split()[0]) != 'srun':
+            logger.warning(f"WARNING: Concurrent forecast hours require srun, not '{aprun_cmd}', "
+                           "forecast hours are processed one at a time")
+            return aprun_cmd, 1
+
+        match = re.search(r'(-n|-np|--ntasks)(\s+|=)(\d+)', aprun_cmd)
+        if match is None:
+            logger.warning(f"WARNING: Number of ranks not found in '{aprun_cmd}', forecast hours are processed one at a time")
+            return aprun_cmd, 1
+
+        ntasks = int(match.group(3))
+        nconcurrent = min(nconcurrent, ntasks)
+        return (aprun_cmd[:match.start(3)] + str(ntasks // nconcurrent) + aprun_cmd[match.end(3):]), nconcurrent
+
+    @staticmethod
+    @logit(logger)
+    def _run_hour(upp_dict: Dict, upp_yaml: Dict, aprun_cmd: str, log_file: Optional[str] = None) -> None:
+        """Configure the directory of a forecast hour and run upp.x in it
+        (in a process of its own: it changes into the directory)
+        """
+        UPP.configure(upp_dict, upp_yaml)
+        if log_file is None:
+            UPP.run(upp_dict.DATA, aprun_cmd)
+        else:
+            with open(log_file, 'w') as output:
+                UPP.run(upp_dict.DATA, aprun_cmd, output=output)
+
+    @staticmethod
+    @logit(logger)
+    def _finalize_hour(upp_dict: Dict, upp_yaml: Dict) -> None:
+        """Index the output of a forecast hour and copy it to COM/
+        """
+        UPP.index(upp_dict.DATA, upp_dict.forecast_hour)
+        UPP.finalize(upp_dict.upp_run, upp_yaml)
+
     @staticmethod
     @logit(logger)
     def finalize(upp_run: Dict, upp_yaml: Dict) -> None:
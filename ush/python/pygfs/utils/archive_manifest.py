@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from typing import Any, Callable, Dict, List, Optional
+
+from wxflow import AttrDict, logit, mkdir_p
+
+from pygfs.utils.archive_utils import member_digest
+
+logger = getLogger(__name__.split('.')[-1])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tarballs (
+    id INTEGER PRIMARY KEY,
+    cycle TEXT NOT NULL,
+    dataset TEXT NOT NULL,
+    target TEXT NOT NULL,
+    created REAL NOT NULL,
+    UNIQUE (cycle, target)
+);
+CREATE TABLE IF NOT EXISTS members (
+    tarball_id INTEGER NOT NULL REFERENCES tarballs(id),
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    hash TEXT NOT NULL,
+    stored_in TEXT NOT NULL,
+    stored_as TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS members_path ON members (path);
+CREATE INDEX IF NOT EXISTS members_hash ON members (hash, size);
+CREATE INDEX IF NOT EXISTS members_tarball ON members (tarball_id);
+"""
+
+
+class ArchiveManifest:
+    """SQLite index of every member written to the backup tarballs.
+
+    For each archived member the path (relative to ROTDIR), size, mtime and a
+    blake2b hash of its contents are recorded along with the tarball that
+    physically holds those contents.  The index is used to avoid re-archiving
+    content that is already held in an earlier tarball and to locate the
+    tarball holding a given file for a given cycle.
+
+    In record mode the files are not hashed beforehand: local tarballs hash
+    their members as they are written (see `create_tarball`) and the members
+    of HPSS tarballs are recorded without a hash (an empty string), so they
+    are never matched by the skip and delta modes.
+
+    Only local tarballs are reused, since the manifest must be able to check
+    that they still exist: the skip and delta modes fall back to record for
+    HPSS, and `prune` forgets the members held by local tarballs that were
+    removed (e.g. purged) before the datasets are planned.
+
+    Valid modes are:
+    record: archive every member and only record the tarball contents
+    skip: do not create a tarball if all of its contents are already archived
+    delta: only archive members whose contents are not already archived
+    """
+
+    VALID_MODES = ['record', 'skip', 'delta']
+    HASH_BUFSIZE = 8 * 1024 * 1024
+
+    def __init__(self, path: str, mode: str = "record", nthreads: int = 4, local: bool = True) -> None:
+        """Open (or create) the manifest database
+
+        Parameters
+        ----------
+        path : str
+            Path of the SQLite manifest database
+        mode : str
+            Incremental archiving mode, one of VALID_MODES
+        nthreads : int
+            Number of threads used to hash files
+        local : bool
+            Whether the tarballs are local files (or on HPSS)
+        """
+
+        if mode not in self.VALID_MODES:
+            raise NotImplementedError(f'{mode} is not a valid archive manifest mode.\n' +
+                                      'Valid ARCH_MANIFEST_MODE values are:\n' +
+                                      f'{", ".join(self.VALID_MODES)}')
+
+        if not local and mode != "record":
+            logger.warning(f"WARNING: ARCH_MANIFEST_MODE={mode} requires local tarballs, only recording the HPSS tarballs")
+            mode = "record"
+
+        self.path = path
+        self.mode = mode
+        self.local = local
+        self.nthreads = max(1, int(nthreads))
+
+        mkdir_p(os.path.dirname(os.path.realpath(path)))
+        # Tarballs may be recorded from several threads; access is serialized with a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=300, check_same_thread=False)
+        with self._conn:
+            self._conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        """Close the manifest database"""
+        with self._lock:
+            self._conn.close()
+
+    @logit(logger)
+    def prune(self) -> int:
+        """Forget the members stored in local tarballs that no longer exist, and the tarballs left empty.
+
+        Returns
+        -------
+        int
+            Number of members forgotten
+        """
+
+        if not self.local:
+            return 0
+
+        # A skipped tarball was never created, but its members are stored in other tarballs
+        with self._lock, self._conn:
+            stored_in = [row[0] for row in self._conn.execute("SELECT DISTINCT stored_in FROM members")]
+            gone = [target for target in stored_in if not os.path.exists(target)]
+            nmembers = 0
+            for target in gone:
+                nmembers += self._conn.execute("DELETE FROM members WHERE stored_in = ?", (target,)).rowcount
+            self._conn.execute("DELETE FROM tarballs WHERE id NOT IN (SELECT tarball_id FROM members)")
+
+        if gone:
+            logger.info(f"Forgot {len(gone)} removed tarballs and {nmembers} members from the manifest")
+        return nmembers
+
+    @staticmethod
+    def _hash_file(path: str, st: os.stat_result) -> str:
+        """Hash the contents of a regular file or the target of a symbolic link"""
+        digest = member_digest()
+        if stat.S_ISLNK(st.st_mode):
+            digest.update(b"symlink:" + os.fsencode(os.readlink(path)))
+        else:
+            with open(path, "rb") as fh:
+                while chunk := fh.read(ArchiveManifest.HASH_BUFSIZE):
+                    digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _expand(fileset: List[str], lstat: Callable) -> List[AttrDict]:
+        """Expand directories in a fileset into the files and links below them"""
+        entries = []
+        for name in fileset:
+            st = lstat(name)
+            if stat.S_ISDIR(st.st_mode):
+                for root, dirs, files in os.walk(name):
+                    dirs.sort()
+                    for filename in sorted(files):
+                        path = os.path.join(root, filename)
+                        entries.append(AttrDict(path=path, st=os.lstat(path)))
+            elif stat.S_ISREG(st.st_mode) or stat.S_ISLNK(st.st_mode):
+                entries.append(AttrDict(path=name, st=st))
+        return entries
+
+    @logit(logger)
+    def scan(self, fileset: List[str], lstat: Callable = os.lstat, hash_files: bool = True) -> List[AttrDict]:
+        """Describe the members of a fileset (path, size, mtime, hash).
+
+        Hashes already recorded for the same path, size and mtime are reused;
+        all other files are hashed concurrently (or their hash is left as None).
+
+        Parameters
+        ----------
+        fileset : List[str]
+            List of files and directories that would be archived
+        lstat : Callable
+            Function used to stat the files, e.g. `FilesetResolver.lstat` to reuse cached results
+        hash_files : bool
+            Hash the files whose hash is not recorded yet
+
+        Returns
+        -------
+        members : List[AttrDict]
+            Description of each file or link in the fileset
+        """
+
+        members = []
+        to_hash = []
+        with self._lock:
+            for entry in self._expand(fileset, lstat):
+                member = AttrDict(path=os.path.normpath(entry.path), size=entry.st.st_size, mtime=entry.st.st_mtime, hash=None)
+                row = self._conn.execute("SELECT hash FROM members WHERE path = ? AND size = ? AND mtime = ? AND hash != '' LIMIT 1",
+                                         (member.path, member.size, member.mtime)).fetchone()
+                if row is not None:
+                    member.hash = row[0]
+                else:
+                    to_hash.append((member, entry.st))
+                members.append(member)
+
+        if to_hash and hash_files:
+            with ThreadPoolExecutor(max_workers=self.nthreads) as executor:
+                hashes = executor.map(lambda item: self._hash_file(item[0].path, item[1]), to_hash)
+                for (member, _), digest in zip(to_hash, hashes):
+                    member.hash = digest
+
+        logger.debug(f"Hashed {len(to_hash) if hash_files else 0} of {len(members)} members")
+        return members
+
+    @logit(logger)
+    def plan(self, dataset: Dict[str, Any], cycle: str, lstat: Callable = os.lstat) -> None:
+        """Decide what needs to be written for a dataset.
+
+        Sets `members` (the scanned members, each with the tarball and path that
+        will hold its contents) and `skip` on the dataset and, in delta mode,
+        reduces `fileset` to the members that are not already archived.
+
+        Parameters
+        ----------
+        dataset : Dict[str, Any]
+            Archive dataset with (at least) `target` and `fileset`
+        cycle : str
+            Cycle being archived (YYYYMMDDHH)
+        lstat : Callable
+            Function used to stat the files
+        """
+
+        # In record mode, the members are hashed (if at all) while they are archived
+        dataset["members"] = self.scan(dataset.fileset, lstat, hash_files=self.mode != "record")
+        dataset["skip"] = False
+
+        if self.mode == "record":
+            for member in dataset.members:
+                member.stored_in, member.stored_as = dataset.target, member.path
+            return
+
+        new_members = []
+        with self._lock:
+            for member in dataset.members:
+                # Ignore anything recorded for this tarball itself, it is about to be replaced,
+                # and the tarballs removed since the manifest was pruned
+                rows = self._conn.execute("SELECT m.stored_in, m.stored_as FROM members m "
+                                          "JOIN tarballs t ON t.id = m.tarball_id "
+                                          "WHERE m.hash = ? AND m.size = ? AND NOT (t.cycle = ? AND t.target = ?) "
+                                          "AND m.stored_in != ?",
+                                          (member.hash, member.size, cycle, dataset.target, dataset.target))
+                row = next((row for row in rows if os.path.exists(row[0])), None)
+                if row is None:
+                    member.stored_in, member.stored_as = dataset.target, member.path
+                    new_members.append(member)
+                else:
+                    member.stored_in, member.stored_as = row
+
+        nold = len(dataset.members) - len(new_members)
+        if len(new_members) == 0:
+            logger.info(f"All {nold} members of {dataset.target} are already archived, skipping")
+            dataset["skip"] = True
+        elif self.mode == "skip" or nold == 0:
+            # Something changed, archive the whole dataset
+            for member in dataset.members:
+                member.stored_in, member.stored_as = dataset.target, member.path
+        else:
+            logger.info(f"{nold} of {len(dataset.members)} members of {dataset.target} are already archived, "
+                        f"creating a delta tarball")
+            dataset["fileset"] = [member.path for member in new_members]
+
+    @logit(logger)
+    def record(self, dataset: Dict[str, Any], cycle: str, digests: Optional[Dict[str, str]] = None) -> None:
+        """Record the members of a dataset that has been archived (or skipped).
+
+        Parameters
+        ----------
+        dataset : Dict[str, Any]
+            Archive dataset planned with `plan`
+        cycle : str
+            Cycle being archived (YYYYMMDDHH)
+        digests : Dict[str, str]
+            Hashes of the members computed while the tarball was written (optional)
+        """
+
+        for member in dataset.members:
+            if digests and member.path in digests:
+                member.hash = digests[member.path]
+            elif member.hash is None:
+                member.hash = ""
+
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM members WHERE tarball_id IN "
+                               "(SELECT id FROM tarballs WHERE cycle = ? AND target = ?)", (cycle, dataset.target))
+            self._conn.execute("DELETE FROM tarballs WHERE cycle = ? AND target = ?", (cycle, dataset.target))
+            cursor = self._conn.execute("INSERT INTO tarballs (cycle, dataset, target, created) VALUES (?, ?, ?, ?)",
+                                        (cycle, dataset.get("name", ""), dataset.target, time.time()))
+            self._conn.executemany("INSERT INTO members (tarball_id, path, size, mtime, hash, stored_in, stored_as) "
+                                   "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                   [(cursor.lastrowid, member.path, member.size, member.mtime, member.hash,
+                                     member.stored_in, member.stored_as) for member in dataset.members])
+
+    def locate(self, path: str, cycle: Optional[str] = None) -> List[AttrDict]:
+        """Find the tarball(s) holding a file.
+
+        Parameters
+        ----------
+        path : str
+            Path of the file, relative to ROTDIR as it was archived
+        cycle : str, optional
+            Only return matches archived for this cycle (YYYYMMDDHH)
+
+        Returns
+        -------
+        locations : List[AttrDict]
+            cycle, dataset and target the file was archived under, and the
+            tarball (stored_in) and member name (stored_as) holding its contents
+        """
+
+        query = ("SELECT t.cycle, t.dataset, t.target, m.stored_in, m.stored_as FROM members m "
+                 "JOIN tarballs t ON t.id = m.tarball_id WHERE m.path = ?")
+        args = [os.path.normpath(path)]
+        if cycle is not None:
+            query += " AND t.cycle = ?"
+            args.append(str(cycle))
+        query += " ORDER BY t.cycle"
+
+        with self._lock:
+            rows = self._conn.execute(query, args).fetchall()
+
+        return [AttrDict(zip(['cycle', 'dataset', 'target', 'stored_in', 'stored_as'], row)) for row in rows]
@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+
+import fnmatch
+import glob
+import gzip
+import hashlib
+import os
+import stat
+import tarfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from typing import Any, Callable, Dict, List, Optional
+
+from wxflow import AttrDict, logit, mkdir_p
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = getLogger(__name__.split('.')[-1])
+
+# Size of the read and write buffers used when streaming members into a tarball.
+# This is a multiple of the tar record size so that every write is record aligned.
+TAR_BUFSIZE = 1024 * tarfile.RECORDSIZE
+
+# Supported tarball compression codecs and the suffix added to the tarball name
+COMPRESS_SUFFIX = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+# Size of the uncompressed blocks that are compressed independently
+COMPRESS_BLOCKSIZE = 16 * 1024 * 1024
+# Maximum number of blocks held in memory by all the tarballs compressed at the same time
+COMPRESS_MAX_BLOCKS = 64
+_compress_slots = threading.BoundedSemaphore(COMPRESS_MAX_BLOCKS)
+
+
+def member_digest() -> Any:
+    """New hash of the contents of a tarball member (as recorded in the archive manifest)"""
+    return hashlib.blake2b(digest_size=16)
+
+
+class FilesetResolver:
+    """Expand file globs by listing each parent directory once.
+
+    Patterns are grouped by their parent directory, each directory is listed a
+    single time with `os.scandir` and all patterns are matched against that
+    listing.  The `os.DirEntry` objects are kept so that later `stat`/`lstat`
+    calls on matched files are answered from the cached results instead of the
+    filesystem.  Matching follows the rules of `glob.glob` (non-recursive,
+    hidden files only matched by patterns starting with '.').
+    """
+
+    def __init__(self, nthreads: int = 4) -> None:
+        """
+        Parameters
+        ----------
+        nthreads : int
+            Number of threads used to list directories
+        """
+        self.nthreads = max(1, int(nthreads))
+        self._listings = {}
+
+    def _list(self, dirname: str) -> Dict[str, os.DirEntry]:
+        """Return the (cached) listing of a directory, keyed by name"""
+        if dirname not in self._listings:
+            try:
+                with os.scandir(dirname or os.curdir) as it:
+                    self._listings[dirname] = {entry.name: entry for entry in it}
+            except OSError:
+                # Missing or unreadable directories match nothing, as with glob
+                self._listings[dirname] = {}
+        return self._listings[dirname]
+
+    @staticmethod
+    def _split(pattern: str) -> Optional[tuple]:
+        """Split a pattern into (dirname, basename), or None if it must be handled by glob"""
+        dirname, basename = os.path.split(pattern)
+        if basename in ("", os.curdir, os.pardir) or glob.has_magic(dirname):
+            return None
+        return dirname, basename
+
+    def expand(self, patterns: List[str]) -> List[List[str]]:
+        """Expand a list of glob patterns.
+
+        Parameters
+        ----------
+        patterns : List[str]
+            File names or glob patterns
+
+        Returns
+        -------
+        matches : List[List[str]]
+            Matching paths for each pattern, in the order of `patterns`
+        """
+
+        # List all the parent directories not seen yet at once
+        dirnames = {split[0] for split in map(self._split, patterns) if split is not None}
+        new_dirnames = [dirname for dirname in dirnames if dirname not in self._listings]
+        if len(new_dirnames) > 1 and self.nthreads > 1:
+            with ThreadPoolExecutor(max_workers=self.nthreads) as executor:
+                list(executor.map(self._list, new_dirnames))
+
+        matches = []
+        for pattern in patterns:
+            split = self._split(pattern)
+            if split is None:
+                matches.append(glob.glob(pattern))
+                continue
+
+            dirname, basename = split
+            listing = self._list(dirname)
+            if not glob.has_magic(basename):
+                names = [basename] if basename in listing else []
+            else:
+                names = fnmatch.filter(listing.keys(), basename)
+                if not basename.startswith("."):
+                    names = [name for name in names if not name.startswith(".")]
+            matches.append([os.path.join(dirname, name) for name in names])
+
+        return matches
+
+    def _entry(self, path: str) -> Optional[os.DirEntry]:
+        dirname, basename = os.path.split(path)
+        listing = self._listings.get(dirname)
+        return None if listing is None else listing.get(basename)
+
+    def stat(self, path: str) -> os.stat_result:
+        """`os.stat` answered from the cached directory listings where possible"""
+        entry = self._entry(path)
+        return os.stat(path) if entry is None else entry.stat()
+
+    def lstat(self, path: str) -> os.stat_result:
+        """`os.lstat` answered from the cached directory listings where possible"""
+        entry = self._entry(path)
+        return os.lstat(path) if entry is None else entry.stat(follow_symlinks=False)
+
+
+class _AlignedWriter:
+    """Minimal write-only file object that hands data to the operating system
+    only in full blocks of `bufsize` bytes.  The last, partial block is written
+    when the writer is closed.
+    """
+
+    def __init__(self, path: str, bufsize: int = TAR_BUFSIZE) -> None:
+        self.name = path
+        self.mode = "wb"
+        self._bufsize = bufsize
+        self._buffer = bytearray()
+        self._offset = 0
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+
+    def write(self, data: Any) -> int:
+        self._buffer += data
+        nbytes = len(data)
+        self._offset += nbytes
+        if len(self._buffer) >= self._bufsize:
+            nfull = len(self._buffer) - len(self._buffer) % self._bufsize
+            with memoryview(self._buffer) as view:
+                self._write_all(view[:nfull])
+            del self._buffer[:nfull]
+        return nbytes
+
+    def tell(self) -> int:
+        return self._offset
+
+    def close(self) -> None:
+        if self._fd is None:
+            return
+        try:
+            with memoryview(self._buffer) as view:
+                self._write_all(view)
+            self._buffer.clear()
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def _write_all(self, view: memoryview) -> None:
+        while len(view) > 0:
+            nwritten = os.write(self._fd, view)
+            view = view[nwritten:]
+
+
+def available_cores() -> int:
+    """Number of cores available to this process"""
+    return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+
+
+def check_codec(codec: str) -> None:
+    """Raise if a tarball compression codec is unknown or unavailable"""
+    if codec not in COMPRESS_SUFFIX:
+        raise NotImplementedError(f'{codec} is not a valid compression codec.\n' +
+                                  'Valid codecs are:\n' +
+                                  f'{", ".join(COMPRESS_SUFFIX.keys())}')
+    if codec == "zstd" and zstandard is None:
+        raise ModuleNotFoundError("FATAL ERROR: zstd compression requires the zstandard python package")
+
+
+class _ParallelCompressor:
+    """Write-only file object compressing fixed-size blocks concurrently.
+
+    Every block is compressed into a complete, independent gzip member or zstd
+    frame.  The concatenation of these is a valid gzip/zstd stream that can be
+    read by the standard tools (gzip -d, zstd -d, tar -xzf, ...).  Both zlib and
+    zstandard release the GIL while compressing, so the blocks are compressed by
+    a pool of threads; compressed blocks are written out in order.
+
+    Each compressor holds at most 2 blocks per thread and all the compressors
+    of the process at most COMPRESS_MAX_BLOCKS blocks; a compressor waiting
+    for room writes out its own compressed blocks first.
+    """
+
+    def __init__(self, fileobj: Any, codec: str, level: int,
+                 nworkers: int, blocksize: int = COMPRESS_BLOCKSIZE) -> None:
+        check_codec(codec)
+        if codec == "gzip":
+            self._compress = lambda block: gzip.compress(block, compresslevel=level, mtime=0)
+        else:
+            self._compress = lambda block: zstandard.ZstdCompressor(level=level).compress(block)
+
+        self.name = fileobj.name
+        self.mode = "wb"
+        self._fileobj = fileobj
+        self._blocksize = blocksize
+        self._buffer = bytearray()
+        self._offset = 0
+        self._nworkers = max(1, int(nworkers))
+        self._executor = ThreadPoolExecutor(max_workers=self._nworkers)
+        self._inflight = deque()
+
+    def write(self, data: Any) -> int:
+        self._buffer += data
+        nbytes = len(data)
+        self._offset += nbytes
+        while len(self._buffer) >= self._blocksize:
+            self._submit(bytes(self._buffer[:self._blocksize]))
+            del self._buffer[:self._blocksize]
+        return nbytes
+
+    def tell(self) -> int:
+        return self._offset
+
+    def close(self) -> None:
+        if self._executor is None:
+            return
+        try:
+            if len(self._buffer) > 0:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            while self._inflight:
+                self._write_next()
+        finally:
+            self.abort()
+
+    def abort(self) -> None:
+        """Stop the compression threads, discarding any pending blocks"""
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+        while self._inflight:
+            self._inflight.popleft()
+            _compress_slots.release()
+
+    def _submit(self, block: bytes) -> None:
+        # Bound the number of blocks held in memory, by this compressor and by all of them
+        while len(self._inflight) >= 2 * self._nworkers:
+            self._write_next()
+        while not _compress_slots.acquire(blocking=not self._inflight):
+            self._write_next()
+        self._inflight.append(self._executor.submit(self._compress, block))
+
+    def _write_next(self) -> None:
+        """Write out the oldest compressed block"""
+        future = self._inflight.popleft()
+        try:
+            self._fileobj.write(future.result())
+        finally:
+            _compress_slots.release()
+
+
+class _MemberReader:
+    """File object returning the pre-read head of a member followed by the
+    remainder of the open file, optionally hashing the data it returns.
+    """
+
+    def __init__(self, head: bytes, fileobj: Any, digest: Any = None) -> None:
+        self._head = memoryview(head)
+        self._fileobj = fileobj
+        self._digest = digest
+
+    def read(self, size: int) -> bytes:
+        if len(self._head) == 0:
+            chunk = self._fileobj.read(size)
+        else:
+            chunk, self._head = self._head[:size], self._head[size:]
+            if len(chunk) < size:
+                chunk = bytes(chunk) + self._fileobj.read(size - len(chunk))
+        if self._digest is not None:
+            self._digest.update(chunk)
+        return chunk
+
+
+def _prepare_member(name: str, bufsize: int, lstat: Callable) -> AttrDict:
+    """Stat a tarball member and, for regular files, open it and read its first block.
+    Directories are listed so their contents can be queued behind them.
+    This is the part of adding a member that is run concurrently.
+    """
+
+    member = AttrDict(name=name, fileobj=None, head=b"", children=[])
+    st = lstat(name)
+    if stat.S_ISREG(st.st_mode):
+        member.fileobj = open(name, "rb")
+        try:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(member.fileobj.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            member.head = member.fileobj.read(min(st.st_size, bufsize))
+        except Exception:
+            member.fileobj.close()
+            raise
+    elif stat.S_ISDIR(st.st_mode):
+        member.children = sorted(os.path.join(name, entry) for entry in os.listdir(name))
+
+    return member
+
+
+def _close_member(member: AttrDict) -> None:
+    if member.fileobj is not None:
+        member.fileobj.close()
+        member.fileobj = None
+
+
+@logit(logger)
+def create_tarball(target: str, fileset: List[str],
+                   nthreads: int = 4, bufsize: int = TAR_BUFSIZE,
+                   lstat: Callable = os.lstat,
+                   codec: str = "none", level: int = 1,
+                   ncompress: Optional[int] = None,
+                   digests: Optional[Dict[str, str]] = None) -> AttrDict:
+    """Create a tarball from a list of files and directories.
+
+    Files are stat'ed, opened and their first `bufsize` bytes read by a pool of
+    `nthreads` threads, running ahead of a single writer that streams the members
+    into the archive in order with large, record aligned writes.  Directories are
+    added recursively, as with `tarfile.TarFile.add`.
+
+    If a compression `codec` is given, the tar stream is cut into blocks that are
+    compressed concurrently by `ncompress` threads (see `_ParallelCompressor`).
+
+    If `digests` is given, the contents of the members are hashed (see
+    `member_digest`) as they are written, so they are only read once.
+
+    Parameters
+    ----------
+    target : str
+        Tarball to create
+    fileset : List[str]
+        List of files and directories to add to the archive
+    nthreads : int
+        Number of threads used to read ahead of the writer
+    bufsize : int
+        Size of the read and write buffers; must be a multiple of 512 bytes
+    lstat : Callable
+        Function used to stat the members, e.g. `FilesetResolver.lstat` to reuse cached results
+    codec : str
+        Compression codec, one of COMPRESS_SUFFIX ("none", "gzip" or "zstd")
+    level : int
+        Compression level
+    ncompress : int
+        Number of compression threads (default: the number of cores available to this process)
+    digests : Dict[str, str]
+        Filled with the hash of each file and symbolic link, keyed by normalized path (optional)
+
+    Returns
+    -------
+    stats : AttrDict
+        Statistics of the tarball (target, members, size and uncompressed size in bytes,
+        elapsed seconds, rate in uncompressed bytes/s)
+    """
+
+    if bufsize % tarfile.BLOCKSIZE != 0:
+        raise ValueError(f"FATAL ERROR: bufsize ({bufsize}) must be a multiple of {tarfile.BLOCKSIZE}")
+    codec = codec or "none"
+    check_codec(codec)
+
+    # Attempt to create the parent directory if it does not exist
+    mkdir_p(os.path.dirname(os.path.realpath(target)))
+
+    nthreads = max(1, int(nthreads))
+    window = 2 * nthreads
+    pending = deque(fileset)
+    inflight = deque()
+    nmembers = 0
+
+    start = time.perf_counter()
+    writer = _AlignedWriter(target, bufsize)
+    stream = writer
+    try:
+        if codec != "none":
+            if ncompress is None:
+                ncompress = available_cores()
+            stream = _ParallelCompressor(writer, codec, level, ncompress)
+
+        with ThreadPoolExecutor(max_workers=nthreads) as executor, \
+                tarfile.open(fileobj=stream, mode="w", format=tarfile.GNU_FORMAT) as tarball:
+            tarball.copybufsize = bufsize
+            try:
+                while pending or inflight:
+                    while pending and len(inflight) < window:
+                        inflight.append(executor.submit(_prepare_member, pending.popleft(), bufsize, lstat))
+
+                    member = inflight.popleft().result()
+                    try:
+                        tarinfo = tarball.gettarinfo(member.name, fileobj=member.fileobj)
+                        if tarinfo is None:
+                            logger.warning(f"WARNING: skipping unsupported file type {member.name}")
+                            continue
+                        digest = member_digest() if digests is not None else None
+                        reader = _MemberReader(member.head, member.fileobj, digest) if tarinfo.isreg() else None
+                        tarball.addfile(tarinfo, reader)
+                        if digest is not None and (tarinfo.isreg() or tarinfo.issym()):
+                            if tarinfo.issym():
+                                digest.update(b"symlink:" + os.fsencode(tarinfo.linkname))
+                            digests[os.path.normpath(member.name)] = digest.hexdigest()
+                        nmembers += 1
+                    finally:
+                        _close_member(member)
+
+                    # Queue the contents of a directory right behind the members in flight
+                    pending.extendleft(reversed(member.children))
+            finally:
+                # Release any files still held open by the read-ahead threads
+                for future in inflight:
+                    future.cancel()
+                for future in inflight:
+                    if not future.cancelled() and future.exception() is None:
+                        _close_member(future.result())
+        if stream is not writer:
+            stream.close()
+    finally:
+        if stream is not writer:
+            stream.abort()
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    stats = AttrDict(target=target, members=nmembers, size=writer.tell(), raw_size=stream.tell(),
+                     elapsed=elapsed, rate=stream.tell() / elapsed if elapsed > 0 else 0.)
+    logger.info(f"Created {target}: {stats.members} members, {stats.size / 2**20:.1f} MiB "
+                f"({stats.raw_size / 2**20:.1f} MiB uncompressed) "
+                f"in {stats.elapsed:.1f} s ({stats.rate / 2**20:.1f} MiB/s)")
+
+    return stats
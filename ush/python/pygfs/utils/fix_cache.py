@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+from logging import getLogger
+from typing import Any, Dict, List, Optional
+
+logger = getLogger(__name__.split('.')[-1])
+
+'''
+    MODULE:
+        fix_cache.py
+
+    ABOUT:
+        Content-addressed cache of the fix files staged by the tasks.
+
+        The fix files (CRTM coefficients, JEDI and SOCA fix files, B error
+        statistics, ...) do not change between cycles.  With FIX_CACHE_DIR
+        set (e.g. to a node-local SSD or a scratch file system), the copies
+        of the files under FIX_CACHE_ROOTS are staged from the cache:
+
+            ${FIX_CACHE_DIR}/objects/<sha[:2]>/<sha>   file content, read-only
+            ${FIX_CACHE_DIR}/index/<key[:2]>/<key>     sha of the content of a
+                                                       source (path, size, mtime)
+
+        A file found in the cache is reflinked (copy-on-write clone) into DATA
+        when the file system supports it, hardlinked otherwise, or copied if
+        DATA is on another file system.  A source not in the cache is read
+        once, to copy it into the cache and hash it.  The cache is capped
+        at FIX_CACHE_MAXSIZE GB, the least recently used files are evicted
+        first (the use of a file is not recorded for the users who do not
+        own it in a shared cache).
+
+        Since the hardlinked files are shared with the cache, they are
+        read-only: the StagingPlan registers them as read-only inputs, and
+        the files staged as 'mutable' are never hardlinked.
+'''
+
+__all__ = ['FixCache', 'reflink']
+
+# ioctl to clone a file (Linux, btrfs and xfs)
+FICLONE = 0x40049409
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def reflink(src: str, dest: str) -> bool:
+    """
+    Clone a file (copy-on-write, no data is copied) if the file system supports it
+
+    Returns
+    -------
+    bool
+        Whether the file was cloned
+    """
+    try:
+        with open(src, 'rb') as src_fh, open(dest, 'wb') as dest_fh:
+            fcntl.ioctl(dest_fh.fileno(), FICLONE, src_fh.fileno())
+        return True
+    except OSError:
+        if os.path.lexists(dest):
+            os.unlink(dest)
+        return False
+
+
+class FixCache:
+    """
+    Node-local or shared cache of fix files, addressed by content
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory of the cache
+    max_size : int
+        Maximum size of the cache in bytes
+    roots : List[str]
+        Directories of the files that are cached
+    """
+
+    def __init__(self, cache_dir: str, max_size: int, roots: List[str]) -> None:
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = int(max_size)
+        self.roots = [os.path.join(os.path.abspath(root), '') for root in roots if root]
+        self.stats = {'hits': 0, 'misses': 0, 'bytes_hit': 0, 'bytes_miss': 0,
+                      'reflinks': 0, 'hardlinks': 0, 'copies': 0, 'evicted': 0, 'bytes_evicted': 0}
+        self._lock = threading.Lock()
+        for subdir in ['objects', 'index', 'tmp']:
+            os.makedirs(os.path.join(self.cache_dir, subdir), exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> Optional['FixCache']:
+        """
+        Fix file cache of a task, or None if FIX_CACHE_DIR is not set
+
+        Parameters
+        ----------
+        config : Dict[str, Any]
+            Task configuration, with
+            FIX_CACHE_DIR : directory of the cache (no cache if empty)
+            FIX_CACHE_MAXSIZE : maximum size of the cache in GB (default: 100)
+            FIX_CACHE_ROOTS : ':' separated directories of the files to cache
+                              (default: FIXgfs, HOMEgdas and CRTM_FIX)
+        """
+        cache_dir = config.get('FIX_CACHE_DIR', '')
+        if not cache_dir:
+            return None
+
+        if config.get('FIX_CACHE_ROOTS'):
+            roots = str(config['FIX_CACHE_ROOTS']).split(':')
+        else:
+            homegdas = config.get('HOMEgdas', os.path.join(config.get('HOMEgfs', ''), 'sorc', 'gdas.cd'))
+            roots = [config.get('FIXgfs'), homegdas, config.get('CRTM_FIX')]
+
+        try:
+            return cls(cache_dir, float(config.get('FIX_CACHE_MAXSIZE', 100)) * 1024 ** 3, roots)
+        except OSError as ee:
+            logger.warning(f"WARNING: unable to use the fix file cache {cache_dir} ({ee}), staging without it")
+            return None
+
+    def cacheable(self, src: str) -> bool:
+        """Whether a file is staged through the cache"""
+        path = os.path.abspath(src)
+        return any(path.startswith(root) for root in self.roots) and os.path.isfile(path)
+
+    def stage(self, src: str, dest: str, hardlink: bool = True) -> str:
+        """
+        Stage a file from the cache, adding it to the cache first if needed
+
+        Parameters
+        ----------
+        src : str
+            Source file (under one of the roots)
+        dest : str
+            Destination file or directory
+        hardlink : bool
+            Whether the file may be hardlinked to the cache (it is then read-only)
+
+        Returns
+        -------
+        str
+            How the file was staged: 'reflinks', 'hardlinks' or 'copies'
+        """
+        if os.path.isdir(dest):
+            dest = os.path.join(dest, os.path.basename(src))
+
+        source = os.path.realpath(src)
+        src_stat = os.stat(source)
+        key = hashlib.sha256(f"{source}\0{src_stat.st_size}\0{src_stat.st_mtime_ns}".encode()).hexdigest()
+        index_path = os.path.join(self.cache_dir, 'index', key[:2], key)
+
+        obj = self._lookup(index_path)
+        hit = obj is not None
+        if hit:
+            # The modification time of an object is the time it was last used
+            try:
+                os.utime(obj)
+            except PermissionError:
+                # Object of another user of a shared cache
+                pass
+        else:
+            obj = self._add(source, index_path)
+
+        method = self._place(obj, dest, source, hardlink)
+        with self._lock:
+            self.stats['hits' if hit else 'misses'] += 1
+            self.stats['bytes_hit' if hit else 'bytes_miss'] += src_stat.st_size
+            self.stats[method] += 1
+        logger.info(f"Staged {src} to {dest} from the fix cache ({'hit' if hit else 'miss'}, {method[:-1]})")
+        return method
+
+    def _lookup(self, index_path: str) -> Optional[str]:
+        """Object of an index entry, if both exist"""
+        try:
+            with open(index_path) as fh:
+                digest = fh.read().strip()
+        except FileNotFoundError:
+            return None
+        obj = os.path.join(self.cache_dir, 'objects', digest[:2], digest)
+        return obj if os.path.isfile(obj) else None
+
+    def _add(self, source: str, index_path: str) -> str:
+        """Copy a file into the cache while hashing it; returns the object"""
+        sha = hashlib.sha256()
+        tmp_dir = os.path.join(self.cache_dir, 'tmp')
+        with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as tmp, open(source, 'rb') as fh:
+            try:
+                for chunk in iter(lambda: fh.read(CHUNK_SIZE), b''):
+                    sha.update(chunk)
+                    tmp.write(chunk)
+            except BaseException:
+                os.unlink(tmp.name)
+                raise
+        digest = sha.hexdigest()
+        os.chmod(tmp.name, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+
+        # Concurrent jobs adding the same file write the same object and index entry
+        obj = os.path.join(self.cache_dir, 'objects', digest[:2], digest)
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        os.replace(tmp.name, obj)
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=tmp_dir, delete=False) as tmp:
+            tmp.write(digest)
+        os.replace(tmp.name, index_path)
+        return obj
+
+    @staticmethod
+    def _place(obj: str, dest: str, source: str, hardlink: bool = True) -> str:
+        """Reflink, hardlink or copy an object to its destination; returns the method used"""
+        if os.path.lexists(dest):
+            os.unlink(dest)
+
+        if reflink(obj, dest):
+            shutil.copystat(source, dest)
+            return 'reflinks'
+
+        if hardlink:
+            try:
+                os.link(obj, dest)
+                return 'hardlinks'
+            except OSError as ee:
+                if ee.errno not in [errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP]:
+                    raise
+
+        shutil.copyfile(obj, dest)
+        shutil.copystat(source, dest)
+        return 'copies'
+
+    def evict(self) -> int:
+        """
+        Remove the least recently used objects until the cache fits in its maximum size
+
+        Returns
+        -------
+        int
+            Bytes evicted
+        """
+        objects = []
+        for dirpath, _, filenames in os.walk(os.path.join(self.cache_dir, 'objects')):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    obj_stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                objects.append((obj_stat.st_mtime, obj_stat.st_size, path))
+
+        size = sum(obj_size for _, obj_size, _ in objects)
+        evicted = 0
+        for _, obj_size, path in sorted(objects):
+            if size - evicted <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                continue
+            evicted += obj_size
+            with self._lock:
+                self.stats['evicted'] += 1
+                self.stats['bytes_evicted'] += obj_size
+
+        if evicted:
+            logger.info(f"Evicted {evicted / 1.e6:.1f} MB from the fix cache {self.cache_dir}")
+            self._prune_index()
+        return evicted
+
+    def _prune_index(self) -> None:
+        """Remove the index entries of the evicted objects, and stale temporary files"""
+        for dirpath, _, filenames in os.walk(os.path.join(self.cache_dir, 'index')):
+            for filename in filenames:
+                index_path = os.path.join(dirpath, filename)
+                if self._lookup(index_path) is None:
+                    try:
+                        os.unlink(index_path)
+                    except FileNotFoundError:
+                        pass
+        tmp_dir = os.path.join(self.cache_dir, 'tmp')
+        for filename in os.listdir(tmp_dir):
+            path = os.path.join(tmp_dir, filename)
+            try:
+                if time.time() - os.path.getmtime(path) > 86400:
+                    os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def summary(self) -> str:
+        with self._lock:
+            stats = dict(self.stats)
+        nfiles = stats['hits'] + stats['misses']
+        ratio = 100. * stats['hits'] / nfiles if nfiles else 0.
+        return (f"fix cache {self.cache_dir}: {stats['hits']} hits ({stats['bytes_hit'] / 1.e6:.1f} MB), "
+                f"{stats['misses']} misses ({stats['bytes_miss'] / 1.e6:.1f} MB), {ratio:.0f}% hit rate; "
+                f"{stats['reflinks']} reflinked, {stats['hardlinks']} hardlinked, {stats['copies']} copied; "
+                f"{stats['evicted']} evicted ({stats['bytes_evicted'] / 1.e6:.1f} MB)")
@@ -0,0 +1,188 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from logging import getLogger
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+from netCDF4 import Dataset, Variable, default_fillvals
+
+from wxflow import logit
+
+from pygfs.utils.staging_utils import check_mutable
+
+logger = getLogger(__name__.split('.')[-1])
+
+# Target size of the background/increment chunks read at a time
+CHUNK_BYTES = 256 * 1024 * 1024
+
+
+def _is_nan(value: Any) -> bool:
+    try:
+        return bool(np.isnan(value))
+    except TypeError:
+        return False
+
+
+def _fill_values(var: Variable) -> List:
+    """Values netCDF4 would mask when reading `var` (missing_value, _FillValue or the default fill value)"""
+    attrs = var.ncattrs()
+    dtype = var.dtype.str[1:]
+    fills = []
+    if 'missing_value' in attrs:
+        fills.extend(np.atleast_1d(var.getncattr('missing_value')))
+    if '_FillValue' in attrs:
+        fills.append(var.getncattr('_FillValue'))
+    elif dtype in default_fillvals and (dtype not in ('i1', 'u1') or var.get_fill_value() is not None):
+        fills.append(default_fillvals[dtype])
+    return fills
+
+
+def _valid_range(var: Variable) -> Tuple[Any, Any]:
+    """Valid minimum and maximum of `var` (None if not set); netCDF4 masks the values outside"""
+    attrs = var.ncattrs()
+    if 'valid_range' in attrs and np.size(var.getncattr('valid_range')) == 2:
+        return tuple(var.getncattr('valid_range'))
+    return var.getncattr('valid_min') if 'valid_min' in attrs else None, \
+        var.getncattr('valid_max') if 'valid_max' in attrs else None
+
+
+def _write_fill(var: Variable) -> Any:
+    """Value netCDF4 writes for the masked elements of `var`"""
+    attrs = var.ncattrs()
+    if 'missing_value' in attrs:
+        return np.atleast_1d(var.getncattr('missing_value'))[0]
+    if '_FillValue' in attrs:
+        return var.getncattr('_FillValue')
+    return default_fillvals[var.dtype.str[1:]]
+
+
+def _invalid_mask(data: np.ndarray, fills: List, valid_range: Tuple[Any, Any]) -> Optional[np.ndarray]:
+    """Mask of the elements of `data` netCDF4 would mask, None if there are none"""
+    valid_min, valid_max = valid_range
+    masks = [np.isnan(data) if _is_nan(fill) else data == fill for fill in fills]
+    if valid_min is not None:
+        masks.append(data < valid_min)
+    if valid_max is not None:
+        masks.append(data > valid_max)
+
+    mask = None
+    for invalid in masks:
+        if invalid.any():
+            mask = invalid if mask is None else mask | invalid
+    return mask
+
+
+def _chunks(shape: tuple, itemsize: int, chunk_bytes: int) -> List[tuple]:
+    """Slices splitting a (..., z, y, x) array into groups of vertical levels"""
+    if len(shape) < 3:
+        return [tuple(slice(None) for _ in shape)]
+    axis = len(shape) - 3
+    level_bytes = itemsize * int(np.prod(shape[axis + 1:]))
+    nlevs = max(1, chunk_bytes // level_bytes)
+    lead = tuple(slice(None) for _ in range(axis))
+    return [lead + (slice(k, min(k + nlevs, shape[axis])),) for k in range(0, shape[axis], nlevs)]
+
+
+def add_tile_increments(inc_path: str, bkg_path: str, incvars: List[str], chunk_bytes: int = CHUNK_BYTES) -> None:
+    """Add the increments of one cubed-sphere tile to its background, in place.
+
+    The variables are processed a group of vertical levels at a time and the sum
+    is computed into the background chunk, so no full-size temporaries are made.
+    The elements netCDF4 would mask in either file (fill and missing values,
+    values outside valid_min/valid_max or valid_range) are written as they
+    would be by adding and writing masked arrays: as the background fill value,
+    or left unchanged if the background values are all missing values; masking
+    is only done for chunks that actually contain such elements.  The last case
+    is decided for each chunk rather than for the whole variable.
+
+    Parameters
+    ----------
+    inc_path : str
+       FV3 increment file
+    bkg_path : str
+       FV3 background file, updated in place
+    incvars : List
+       List of increment variables to add to the background
+    chunk_bytes : int
+       Approximate size in bytes of each chunk of levels
+    """
+
+    check_mutable(bkg_path)
+    with Dataset(inc_path, mode='r') as incfile, Dataset(bkg_path, mode='a') as rstfile:
+        for vname in incvars:
+            incvar = incfile.variables[vname]
+            bkgvar = rstfile.variables[vname]
+            incvar.set_auto_mask(False)
+            bkgvar.set_auto_mask(False)
+            inc_fills, inc_range = _fill_values(incvar), _valid_range(incvar)
+            bkg_fills, bkg_range = _fill_values(bkgvar), _valid_range(bkgvar)
+            bkg_missing = bkgvar.getncattr('missing_value') if 'missing_value' in bkgvar.ncattrs() else None
+            fill = _write_fill(bkgvar)
+            for chunk in _chunks(bkgvar.shape, bkgvar.dtype.itemsize, chunk_bytes):
+                bkg = bkgvar[chunk]
+                increment = incvar[chunk]
+                mask = _invalid_mask(bkg, bkg_fills, bkg_range)
+                inc_mask = _invalid_mask(increment, inc_fills, inc_range)
+                if inc_mask is not None:
+                    mask = inc_mask if mask is None else mask | inc_mask
+                masked_bkg = bkg[mask] if mask is not None else None
+                np.add(bkg, increment, out=bkg, casting='same_kind')
+                if mask is not None:
+                    if bkg_missing is not None and np.isin(masked_bkg, bkg_missing).all():
+                        bkg[mask] = masked_bkg
+                    else:
+                        bkg[mask] = fill
+                bkgvar[chunk] = bkg
+            try:
+                bkgvar.delncattr('checksum')  # remove the checksum so fv3 does not complain
+            except (AttributeError, RuntimeError):
+                pass  # checksum is missing, move on
+
+
+@logit(logger)
+def add_fv3_increments(inc_file_tmpl: str, bkg_file_tmpl: str, incvars: List[str], ntiles: int = 6,
+                       nprocs: Optional[int] = None, chunk_bytes: int = CHUNK_BYTES) -> None:
+    """Add cubed-sphere increments to cubed-sphere backgrounds, one process per tile
+
+    Parameters
+    ----------
+    inc_file_tmpl : str
+       template of the FV3 increment file of the form: 'filetype.tile{tilenum}.nc'
+    bkg_file_tmpl : str
+       template of the FV3 background file of the form: 'filetype.tile{tilenum}.nc'
+    incvars : List
+       List of increment variables to add to the background
+    ntiles : int
+       Number of tiles
+    nprocs : int
+       Number of processes (default: the number of cores available, up to ntiles)
+    chunk_bytes : int
+       Approximate size in bytes of each chunk of levels
+    """
+
+    if nprocs is None:
+        nprocs = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    nprocs = max(1, min(nprocs, ntiles))
+
+    tiles = [(inc_file_tmpl.format(tilenum=itile), bkg_file_tmpl.format(tilenum=itile))
+             for itile in range(1, ntiles + 1)]
+
+    # The workers do not know the files staged read-only in this process
+    for _, bkg_path in tiles:
+        check_mutable(bkg_path)
+
+    if nprocs == 1:
+        for inc_path, bkg_path in tiles:
+            add_tile_increments(inc_path, bkg_path, incvars, chunk_bytes)
+        return
+
+    logger.info(f"Adding increments to {ntiles} tiles with {nprocs} processes")
+    # Start the workers from a clean process: forking a process holding open
+    # netCDF/HDF5 handles (and threads) is not safe
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    with ProcessPoolExecutor(max_workers=nprocs, mp_context=multiprocessing.get_context(method)) as executor:
+        futures = [executor.submit(add_tile_increments, inc_path, bkg_path, incvars, chunk_bytes)
+                   for inc_path, bkg_path in tiles]
+    for future in futures:
+        future.result()
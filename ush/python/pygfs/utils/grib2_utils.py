@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+
+import mmap
+import os
+import socket
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from logging import getLogger
+from typing import Dict, List, Optional, Tuple
+
+from wxflow import logit
+
+logger = getLogger(__name__.split('.')[-1])
+
+'''
+    MODULE:
+        grib2_utils.py
+
+    ABOUT:
+        Index GRIB2 files without decoding their data.
+
+        The file is memory-mapped and the sections 0-8 of each message are
+        walked using only their lengths and numbers.  Each field (a product
+        definition section and the data that follow it) is described by the
+        byte offsets of its sections and the copies of its identification,
+        grid, product and data representation sections, from which the two
+        usual indices are written:
+          - the binary index of grb2index (NCEPLIBS-g2 index version 1), read
+            by getgb2 and the other NCEPLIBS-g2 readers
+          - the inventory of `wgrib2 -s`, used with byte ranges to extract
+            messages (e.g. get_inv.pl / get_grib.pl, or extract_messages)
+
+        The short names of the inventory cover the usual fields of the GFS
+        products; others are written the way wgrib2 writes the fields that
+        are not in its tables ("var discipline=0 master_table=2 parmcat=...").
+'''
+
+__all__ = ['Grib2Field', 'scan_grib2', 'write_grb2index', 'write_inventory', 'index_grib2',
+           'index_grib2_files', 'extract_messages']
+
+# Size of the header records of a grb2index index file
+INDEX_HEADER_SIZE = 162
+# Number of bytes of the bit map section kept in the index
+INDEX_BMS_SIZE = 6
+
+# Short names of the parameters (discipline, category, number), as written by wgrib2
+PARAMETER_NAMES = {
+    (0, 0, 0): 'TMP', (0, 0, 1): 'VTMP', (0, 0, 2): 'POT', (0, 0, 3): 'EPOT', (0, 0, 4): 'TMAX',
+    (0, 0, 5): 'TMIN', (0, 0, 6): 'DPT', (0, 0, 7): 'DEPR', (0, 0, 8): 'LAPR', (0, 0, 10): 'LHTFL',
+    (0, 0, 11): 'SHTFL', (0, 0, 15): 'VPTMP', (0, 0, 17): 'SKINT', (0, 0, 21): 'APTMP', (0, 0, 192): 'SNOHF',
+    (0, 1, 0): 'SPFH', (0, 1, 1): 'RH', (0, 1, 2): 'MIXR', (0, 1, 3): 'PWAT', (0, 1, 7): 'PRATE',
+    (0, 1, 8): 'APCP', (0, 1, 9): 'NCPCP', (0, 1, 10): 'ACPCP', (0, 1, 11): 'SNOD', (0, 1, 13): 'WEASD',
+    (0, 1, 22): 'CLMR', (0, 1, 23): 'ICMR', (0, 1, 24): 'RWMR', (0, 1, 25): 'SNMR', (0, 1, 32): 'GRLE',
+    (0, 1, 39): 'CPOFP', (0, 1, 192): 'CRAIN', (0, 1, 193): 'CFRZR', (0, 1, 194): 'CICEP', (0, 1, 195): 'CSNOW',
+    (0, 1, 196): 'CPRAT', (0, 1, 197): 'MCONV',
+    (0, 2, 0): 'WDIR', (0, 2, 1): 'WIND', (0, 2, 2): 'UGRD', (0, 2, 3): 'VGRD', (0, 2, 8): 'VVEL',
+    (0, 2, 9): 'DZDT', (0, 2, 10): 'ABSV', (0, 2, 12): 'RELV', (0, 2, 15): 'VUCSH', (0, 2, 16): 'VVCSH',
+    (0, 2, 17): 'UFLX', (0, 2, 18): 'VFLX', (0, 2, 22): 'GUST', (0, 2, 192): 'VWSH', (0, 2, 194): 'USTM',
+    (0, 2, 195): 'VSTM', (0, 2, 220): 'MAXUVV', (0, 2, 221): 'MAXDVV', (0, 2, 222): 'MAXUW', (0, 2, 223): 'MAXVW',
+    (0, 3, 0): 'PRES', (0, 3, 1): 'PRMSL', (0, 3, 3): 'ICAHT', (0, 3, 4): 'GP', (0, 3, 5): 'HGT',
+    (0, 3, 6): 'DIST', (0, 3, 192): 'MSLET', (0, 3, 196): 'HPBL',
+    (0, 4, 7): 'DSWRF', (0, 4, 8): 'USWRF', (0, 4, 192): 'DSWRF', (0, 4, 193): 'USWRF',
+    (0, 5, 3): 'DLWRF', (0, 5, 4): 'ULWRF', (0, 5, 192): 'DLWRF', (0, 5, 193): 'ULWRF',
+    (0, 6, 1): 'TCDC', (0, 6, 3): 'LCDC', (0, 6, 4): 'MCDC', (0, 6, 5): 'HCDC', (0, 6, 6): 'CWAT',
+    (0, 7, 6): 'CAPE', (0, 7, 7): 'CIN', (0, 7, 8): 'HLCY', (0, 7, 192): 'LFTX', (0, 7, 193): '4LFTX',
+    (0, 14, 0): 'TOZNE', (0, 14, 192): 'O3MR',
+    (0, 16, 195): 'REFD', (0, 16, 196): 'REFC',
+    (0, 19, 0): 'VIS', (0, 19, 1): 'ALBDO',
+    (2, 0, 0): 'LAND', (2, 0, 1): 'SFCR', (2, 0, 192): 'SOILW',
+    (10, 0, 3): 'HTSGW', (10, 2, 0): 'ICEC', (10, 2, 1): 'ICETK', (10, 3, 0): 'WTMP',
+}
+
+# Fixed surfaces (code table 4.5): description of a level, with %g for its value
+LEVEL_NAMES = {
+    1: 'surface', 2: 'cloud base', 3: 'cloud top', 4: '0C isotherm', 6: 'max wind', 7: 'tropopause',
+    8: 'top of atmosphere', 10: 'entire atmosphere', 20: '%g K level', 100: '%g mb', 101: 'mean sea level',
+    102: '%g m above mean sea level', 103: '%g m above ground', 104: '%g sigma level', 105: '%g hybrid level',
+    106: '%g m below ground', 107: '%g K isentropic level', 108: '%g mb above ground', 109: 'PV=%g (Km^2/kg/s) surface',
+    111: '%g eta level', 160: '%g m below sea level',
+    200: 'entire atmosphere (considered as a single layer)', 204: 'highest tropospheric freezing level',
+    211: 'boundary layer cloud layer', 212: 'low cloud bottom level', 213: 'low cloud top level',
+    214: 'low cloud layer', 215: 'cloud ceiling', 220: 'planetary boundary layer',
+    222: 'middle cloud bottom level', 223: 'middle cloud top level', 224: 'middle cloud layer',
+    232: 'high cloud bottom level', 233: 'high cloud top level', 234: 'high cloud layer',
+    242: 'convective cloud bottom level', 243: 'convective cloud top level', 244: 'convective cloud layer',
+}
+# Layers between two surfaces of the same type
+LAYER_NAMES = {100: '%g-%g mb', 103: '%g-%g m above ground', 104: '%g-%g sigma layer',
+               106: '%g-%g m below ground', 108: '%g-%g mb above ground'}
+# Surfaces whose value is given in a unit other than that of the description
+LEVEL_FACTORS = {100: 0.01, 108: 0.01}
+
+# Units of time ranges (code table 4.4): (name, hours)
+TIME_UNITS = {0: ('min', 1. / 60.), 1: ('hour', 1.), 2: ('day', 24.), 10: ('hour', 3.), 11: ('hour', 6.),
+              12: ('hour', 12.), 13: ('sec', 1. / 3600.)}
+# Statistical processes (code table 4.10)
+STATISTICS = {0: 'ave', 1: 'acc', 2: 'max', 3: 'min'}
+# Derived ensemble forecasts (code table 4.7)
+ENSEMBLE_DERIVED = {0: 'ens mean', 1: 'wt ens mean', 2: 'ens std dev', 3: 'ens std dev normalized', 4: 'ens spread'}
+
+# Octet (0-based) of the statistical processing of the product definition templates
+# with a time range, and of their ensemble information
+STATISTICAL_PDT = {8: 46, 11: 49, 12: 48}
+ENSEMBLE_PDT = {1: 'member', 11: 'member', 2: 'derived', 12: 'derived'}
+
+
+def _signed(value: int, nbytes: int) -> int:
+    """Value of a GRIB2 sign-magnitude integer (the sign is the most significant bit)"""
+    sign_bit = 1 << (8 * nbytes - 1)
+    return -(value & (sign_bit - 1)) if value & sign_bit else value
+
+
+def _uint(data: bytes, offset: int, nbytes: int) -> int:
+    return int.from_bytes(data[offset:offset + nbytes], 'big')
+
+
+class Grib2Field:
+    """
+    A field of a GRIB2 message: the byte offsets of its sections and copies of the
+    sections that describe it (identification, grid, product definition, data
+    representation and the first bytes of the bit map)
+
+    Attributes
+    ----------
+    number : int
+        Number of the message in the file (from 1)
+    field : int
+        Number of the field in the message (from 1)
+    offset : int
+        Bytes to skip in the file before the message
+    length : int
+        Total length of the message
+    discipline : int
+        Discipline of the message
+    offsets : Dict[int, int]
+        Bytes to skip in the message before each of the sections 2 to 7 (0 if absent)
+    sections : Dict[int, bytes]
+        Sections 1, 3, 4, 5 and the first bytes of section 6
+    nfields : int
+        Number of fields of the message
+    """
+
+    def __init__(self, number: int, field: int, offset: int, length: int, discipline: int,
+                 offsets: Dict[int, int], sections: Dict[int, bytes]) -> None:
+        self.number = number
+        self.field = field
+        self.nfields = 1
+        self.offset = offset
+        self.length = length
+        self.discipline = discipline
+        self.offsets = offsets
+        self.sections = sections
+
+    @property
+    def reference_time(self) -> datetime:
+        ids = self.sections[1]
+        return datetime(_uint(ids, 12, 2), ids[14], ids[15], ids[16], ids[17], ids[18])
+
+    @property
+    def pdt(self) -> int:
+        """Product definition template number"""
+        return _uint(self.sections[4], 7, 2)
+
+    @property
+    def parameter(self) -> Tuple[int, int, int]:
+        """Discipline, category and number of the parameter"""
+        pds = self.sections[4]
+        return self.discipline, pds[9], pds[10]
+
+    @property
+    def name(self) -> str:
+        """Short name of the parameter, as written by wgrib2"""
+        if self.parameter in PARAMETER_NAMES:
+            return PARAMETER_NAMES[self.parameter]
+        discipline, category, number = self.parameter
+        return f'var discipline={discipline} master_table={self.sections[1][9]} parmcat={category} parm={number}'
+
+    def _surface(self, octet: int) -> Tuple[int, Optional[float]]:
+        """Type and value of a fixed surface, from the octet (0-based) of its type"""
+        pds = self.sections[4]
+        surface = pds[octet]
+        scale, value = pds[octet + 1], _uint(pds, octet + 2, 4)
+        if surface == 255 or scale == 255 or value == 0xffffffff:
+            return surface, None
+        value = _signed(value, 4) * 10.**(-_signed(scale, 1)) * LEVEL_FACTORS.get(surface, 1.)
+        return surface, round(value, 9)
+
+    @property
+    def level(self) -> str:
+        """Description of the level or layer, as written by wgrib2"""
+        (surface1, value1), (surface2, value2) = self._surface(22), self._surface(28)
+
+        def describe(surface, value):
+            name = LEVEL_NAMES.get(surface, f'level type {surface}')
+            return name % value if '%g' in name and value is not None else name.replace('%g ', '')
+
+        if surface2 == 255:
+            return describe(surface1, value1)
+        if surface1 == surface2 and surface1 in LAYER_NAMES and None not in (value1, value2):
+            return LAYER_NAMES[surface1] % (value1, value2)
+        return f'{describe(surface1, value1)} - {describe(surface2, value2)}'
+
+    @property
+    def forecast_time(self) -> str:
+        """Forecast time (or statistical time range), as written by wgrib2"""
+        pds = self.sections[4]
+        unit = TIME_UNITS.get(pds[17], ('hour', 1.))
+        start = _signed(_uint(pds, 18, 4), 4)
+
+        if self.pdt in STATISTICAL_PDT:
+            octet = STATISTICAL_PDT[self.pdt]
+            statistic = STATISTICS.get(pds[octet], f'stat{pds[octet]}')
+            length_unit = TIME_UNITS.get(pds[octet + 2], unit)
+            length = _uint(pds, octet + 3, 4)
+            end = start + round(length * length_unit[1] / unit[1])
+            return f'{start}-{end} {unit[0]} {statistic} fcst'
+
+        if start == 0:
+            return 'anl'
+        return f'{start} {unit[0]} fcst'
+
+    @property
+    def ensemble(self) -> str:
+        """Ensemble member or derived forecast, as written by wgrib2 ('' if none)"""
+        pds = self.sections[4]
+        kind = ENSEMBLE_PDT.get(self.pdt)
+        if kind == 'member':
+            ens_type, perturbation = pds[34], pds[35]
+            return {0: 'ENS=hi-res ctl', 1: 'ENS=low-res ctl', 2: f'ENS=-{perturbation}',
+                    3: f'ENS=+{perturbation}'}.get(ens_type, f'ENS={perturbation}')
+        if kind == 'derived':
+            return ENSEMBLE_DERIVED.get(pds[34], f'ens derived type {pds[34]}')
+        return ''
+
+    @property
+    def inventory(self) -> str:
+        """Line of the field in the inventory of `wgrib2 -s`"""
+        number = f'{self.number}' if self.nfields == 1 else f'{self.number}.{self.field}'
+        return (f'{number}:{self.offset}:d={self.reference_time:%Y%m%d%H}:{self.name}:{self.level}:'
+                f'{self.forecast_time}:{self.ensemble}')
+
+    def index_record(self) -> bytes:
+        """Record of the field in a grb2index index (NCEPLIBS-g2 index version 1)"""
+        if self.offset >= 2**32:
+            raise ValueError(f'FATAL ERROR: message {self.number} starts beyond 4 GiB, '
+                             'it can not be written in a version 1 index')
+        body = (struct.pack('>7I', self.offset, *[self.offsets[section] for section in (2, 3, 4, 5, 6, 7)]) +
+                struct.pack('>QBBH', self.length, 2, self.discipline, self.field) +
+                b''.join(self.sections[section] for section in (1, 3, 4, 5)) + self.sections[6][:INDEX_BMS_SIZE])
+        return struct.pack('>I', 4 + len(body)) + body
+
+
+def scan_grib2(path: str) -> List[Grib2Field]:
+    """
+    Walk the sections of the GRIB2 messages of a file, without decoding their data
+
+    Parameters
+    ----------
+    path : str
+        GRIB2 file
+
+    Returns
+    -------
+    List[Grib2Field]
+        The fields of the messages, in the order of the file
+    """
+
+    fields = []
+    if os.path.getsize(path) == 0:
+        return fields
+
+    with open(path, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        size = len(data)
+        start = data.find(b'GRIB')
+        number = 0
+        while 0 <= start and start + 16 <= size:
+            edition = data[start + 7]
+            if edition != 2:
+                # Skip other editions (GRIB1 gives its length in octets 5-7)
+                length = _uint(data, start + 4, 3) if edition == 1 else 4
+                start = data.find(b'GRIB', start + max(length, 4))
+                continue
+
+            discipline = data[start + 6]
+            length = _uint(data, start + 8, 8)
+            if start + length > size or data[start + length - 4:start + length] != b'7777':
+                raise ValueError(f'FATAL ERROR: truncated or corrupt GRIB2 message at byte {start} of {path}')
+
+            number += 1
+            message_fields = []
+            offsets = {section: 0 for section in range(2, 8)}
+            sections = {}
+            position = start + 16
+            while position < start + length - 4:
+                section_length = _uint(data, position, 4)
+                section = data[position + 4]
+                if section_length < 5 or section not in range(1, 8):
+                    raise ValueError(f'FATAL ERROR: bad section {section} at byte {position} of {path}')
+                if section in (1, 3, 4, 5):
+                    sections[section] = data[position:position + section_length]
+                if section == 6:
+                    # A bit map "previously defined" (254) keeps the offset of the last one
+                    if data[position + 5] != 254 or not offsets[6]:
+                        offsets[6] = position - start
+                    sections[6] = data[position:position + INDEX_BMS_SIZE]
+                elif section in offsets:
+                    offsets[section] = position - start
+                if section == 7:
+                    message_fields.append(Grib2Field(number, len(message_fields) + 1, start, length, discipline,
+                                                     dict(offsets), dict(sections)))
+                position += section_length
+
+            for field in message_fields:
+                field.nfields = len(message_fields)
+            fields.extend(message_fields)
+            start = data.find(b'GRIB', start + length)
+
+    return fields
+
+
+def write_grb2index(path: str, fields: List[Grib2Field], index_path: str) -> None:
+    """
+    Write the grb2index index of a GRIB2 file
+
+    Parameters
+    ----------
+    path : str
+        GRIB2 file (its name is written in the header)
+    fields : List[Grib2Field]
+        Fields of the file, from scan_grib2
+    index_path : str
+        Index file to write
+    """
+
+    records = b''.join(field.index_record() for field in fields)
+    now = datetime.now()
+
+    header1 = bytearray(b' ' * 81)
+    header1[0:7] = b'!GFHDR!'
+    header1[8:10] = b' 1'
+    header1[11:14] = b'  1'
+    header1[15:20] = f'{INDEX_HEADER_SIZE:5d}'.encode()
+    header1[21:31] = now.strftime('%Y-%m-%d').encode()
+    header1[32:40] = now.strftime('%H:%M:%S').encode()
+    header1[41:47] = b'GB2IX1'
+    header1[55:70] = socket.gethostname()[:15].ljust(15).encode()
+    header1[71:80] = b'grb2index'
+    header1[80:81] = b'\n'
+
+    header2 = bytearray(b' ' * 81)
+    header2[0:8] = b'IX1FORM:'
+    header2[8:38] = f'{INDEX_HEADER_SIZE:10d}{len(records):10d}{len(fields):10d}'.encode()
+    header2[40:80] = os.path.basename(path)[:40].ljust(40).encode()
+    header2[80:81] = b'\n'
+
+    with open(index_path, 'wb') as fh:
+        fh.write(bytes(header1) + bytes(header2) + records)
+
+
+def write_inventory(fields: List[Grib2Field], inventory_path: str) -> None:
+    """
+    Write the inventory of a GRIB2 file, as `wgrib2 -s` does
+
+    Parameters
+    ----------
+    fields : List[Grib2Field]
+        Fields of the file, from scan_grib2
+    inventory_path : str
+        Inventory file to write
+    """
+
+    with open(inventory_path, 'w') as fh:
+        fh.writelines(f'{field.inventory}\n' for field in fields)
+
+
+def index_grib2(path: str, index_path: Optional[str] = None, inventory_path: Optional[str] = None) -> int:
+    """
+    Scan a GRIB2 file once and write its grb2index index and/or its wgrib2 inventory
+
+    Parameters
+    ----------
+    path : str
+        GRIB2 file
+    index_path : str
+        grb2index index to write (optional)
+    inventory_path : str
+        wgrib2 inventory to write (optional)
+
+    Returns
+    -------
+    int
+        Number of fields of the file
+    """
+
+    fields = scan_grib2(path)
+    if index_path is not None:
+        write_grb2index(path, fields, index_path)
+    if inventory_path is not None:
+        write_inventory(fields, inventory_path)
+
+    return len(fields)
+
+
+@logit(logger)
+def index_grib2_files(files: List[str], index_files: Optional[List[Optional[str]]] = None,
+                      inventory_files: Optional[List[Optional[str]]] = None, nprocs: int = 4) -> None:
+    """
+    Index GRIB2 files, `nprocs` files at a time, each in its own process
+
+    Parameters
+    ----------
+    files : List[str]
+        GRIB2 files
+    index_files : List[str]
+        grb2index index of each file (or None not to write it)
+    inventory_files : List[str]
+        wgrib2 inventory of each file (or None not to write it)
+    nprocs : int
+        Number of files indexed at the same time
+    """
+
+    index_files = index_files or [None] * len(files)
+    inventory_files = inventory_files or [None] * len(files)
+    if not (len(files) == len(index_files) == len(inventory_files)):
+        raise ValueError('FATAL ERROR: a list of GRIB2 files and its lists of indices differ in length')
+
+    nprocs = max(1, min(int(nprocs), len(files)))
+    if nprocs == 1:
+        for args in zip(files, index_files, inventory_files):
+            logger.info(f"Indexed {index_grib2(*args)} fields of {args[0]}")
+        return
+
+    with ProcessPoolExecutor(max_workers=nprocs) as executor:
+        futures = [executor.submit(index_grib2, *args) for args in zip(files, index_files, inventory_files)]
+
+    # Re-raise the first failure, if any, once all the files have been attempted
+    for path, future in zip(files, futures):
+        logger.info(f"Indexed {future.result()} fields of {path}")
+
+
+def extract_messages(path: str, fields: List[Grib2Field], output_path: str) -> int:
+    """
+    Copy the messages of some fields of a GRIB2 file to another file, by byte ranges
+
+    Parameters
+    ----------
+    path : str
+        GRIB2 file
+    fields : List[Grib2Field]
+        Fields to extract (e.g. those of scan_grib2 whose inventory line matches a pattern);
+        a message with several of them is copied once
+    output_path : str
+        GRIB2 file to write
+
+    Returns
+    -------
+    int
+        Number of bytes written
+    """
+
+    ranges = sorted({(field.offset, field.length) for field in fields})
+    nbytes = 0
+    with open(path, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data, \
+            open(output_path, 'wb') as out:
+        for offset, length in ranges:
+            nbytes += out.write(data[offset:offset + length])
+
+    return nbytes
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+
+import functools
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from typing import Any, Dict, List, Optional, Tuple
+
+from wxflow import FileHandler, mkdir
+
+from pygfs.utils.fix_cache import FixCache, reflink
+from pygfs.utils.trace_utils import span
+
+logger = getLogger(__name__.split('.')[-1])
+
+'''
+    MODULE:
+        staging_utils.py
+
+    ABOUT:
+        Staging of the input files of a task in one plan.
+
+        The FileHandler dictionaries (mkdir, copy, link, ...) a task stages
+        are merged into a StagingPlan, which:
+          - drops the duplicate entries (the last entry for a destination wins,
+            as it would with consecutive FileHandler syncs)
+          - creates all the directories first
+          - copies the files concurrently in a bounded pool of threads,
+            retrying the copies that fail; the fix files are staged from the
+            fix file cache when there is one (see pygfs.utils.fix_cache);
+            the files hardlinked to the cache are staged read-only
+          - then creates the links
+        and logs the number of files and bytes copied and the throughput.
+
+        Besides the FileHandler actions, a plan stages:
+          - 'mutable' files, copied (like 'copy'), which the task may modify
+          - 'readonly' files, which the task only reads.  They are cloned
+            (reflink) when the file system supports it, symlinked to their
+            source otherwise, so that they are not copied.  Opening one of
+            them for writing from python raises a PermissionError, and the
+            code modifying files in place with netCDF4 calls check_mutable
+            first.  The guard only holds in the process that staged them
+            (the workers of a process pool start with an empty registry),
+            and not for the executables (JEDI, Fortran, netCDF-C), which
+            write through the symlinks.
+'''
+
+__all__ = ['StagingPlan', 'COPY_ACTIONS', 'LINK_ACTIONS', 'check_mutable']
+
+# FileHandler actions (and the mutable and readonly staging), with whether their source must exist
+COPY_ACTIONS = {'copy': True, 'copy_req': True, 'copy_opt': False, 'copy_safe': True,
+                'mutable': True, 'readonly': True}
+LINK_ACTIONS = {'link': True, 'link_req': True, 'link_opt': False}
+
+# Files staged read-only in this process, with their source
+_readonly_inputs = dict()
+_readonly_lock = threading.Lock()
+_audit_installed = False
+_WRITE_FLAGS = os.O_WRONLY | os.O_RDWR | os.O_APPEND | os.O_CREAT | os.O_TRUNC
+
+
+def check_mutable(path: str) -> None:
+    """
+    Fail if a file was staged read-only (before modifying it in place)
+
+    Raises
+    ------
+    PermissionError
+        If the file was staged read-only
+    """
+    source = _readonly_inputs.get(os.path.abspath(path))
+    if source is not None:
+        raise PermissionError(f"FATAL ERROR: {path} is staged read-only from {source}, "
+                              "it must be staged as 'mutable' to be modified")
+
+
+def _readonly_audit(event: str, args: tuple) -> None:
+    """Audit hook failing the python opens of read-only files for writing"""
+    if event == 'open' and _readonly_inputs:
+        path, _, flags = args
+        if isinstance(path, (str, bytes, os.PathLike)) and flags and flags & _WRITE_FLAGS:
+            check_mutable(os.fsdecode(path))
+
+
+def _register_readonly(dest: str, src: str) -> None:
+    global _audit_installed
+    with _readonly_lock:
+        if not _audit_installed:
+            sys.addaudithook(_readonly_audit)
+            _audit_installed = True
+        _readonly_inputs[dest] = src
+
+
+class StagingPlan:
+    """
+    Merged, de-duplicated plan of the FileHandler dictionaries of a task
+
+    Parameters
+    ----------
+    nthreads : int
+        Number of files copied at the same time
+    retries : int
+        Number of times a copy that fails is retried
+    cache : FixCache
+        Cache the fix files are staged from (optional)
+    readonly : bool
+        Link the read-only files, or copy them like the mutable files
+    """
+
+    def __init__(self, nthreads: int = 8, retries: int = 2, cache: Optional[FixCache] = None,
+                 readonly: bool = True) -> None:
+        self.nthreads = max(1, int(nthreads))
+        self.retries = max(0, int(retries))
+        self.cache = cache
+        self.readonly = readonly
+        self.directories = dict()
+        self.copies = dict()
+        self.links = dict()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> 'StagingPlan':
+        """
+        Empty plan of a task, with STAGING_NTHREADS, STAGING_RETRIES, STAGING_READONLY and
+        the fix file cache (FIX_CACHE_DIR, see FixCache.from_config) of its configuration
+        """
+        return cls(nthreads=config.get('STAGING_NTHREADS', 8), retries=config.get('STAGING_RETRIES', 2),
+                   cache=FixCache.from_config(config),
+                   readonly=str(config.get('STAGING_READONLY', True)).upper() in ['TRUE', 'YES'])
+
+    def add(self, config: Optional[Dict[str, List]]) -> 'StagingPlan':
+        """
+        Add the entries of a FileHandler dictionary to the plan
+
+        Parameters
+        ----------
+        config : Dict[str, List]
+            FileHandler dictionary, e.g. {'mkdir': [dir], 'copy': [[src, dest]]}
+
+        Returns
+        -------
+        StagingPlan
+            The plan itself, so that the calls can be chained
+        """
+        for action, entries in (config or {}).items():
+            if action == 'mkdir':
+                for directory in entries or []:
+                    self.directories.setdefault(os.path.abspath(directory), directory)
+            elif action in COPY_ACTIONS:
+                for entry in entries or []:
+                    self._add_entry(self.copies, action, entry)
+            elif action in LINK_ACTIONS:
+                for entry in entries or []:
+                    self._add_entry(self.links, action, entry)
+            else:
+                raise NotImplementedError(f"FATAL ERROR: {action} is not a valid FileHandler action")
+        return self
+
+    def _add_entry(self, entries: Dict[str, List], action: str, entry: List[str]) -> None:
+        if len(entry) != 2:
+            raise IndexError(f"List must be of the form ['src', 'dest'], not {entry}")
+        src, dest = entry
+        key = self._destination(src, dest)
+        if key in entries and entries[key][1] != src:
+            logger.debug(f"{dest} is staged from {entries[key][1]} instead of {src}")
+        entries.pop(key, None)
+        entries[key] = [action, src, dest]
+
+    def _destination(self, src: str, dest: str) -> str:
+        """Path of the file a copy or link creates"""
+        dest_path = os.path.abspath(dest)
+        if dest.endswith(os.sep) or dest_path in self.directories or os.path.isdir(dest_path):
+            dest_path = os.path.join(dest_path, os.path.basename(src))
+        return dest_path
+
+    def __len__(self) -> int:
+        return len(self.directories) + len(self.copies) + len(self.links)
+
+    def execute(self) -> Dict[str, Any]:
+        """
+        Stage the files of the plan
+
+        Returns
+        -------
+        Dict[str, Any]
+            Summary of the staging: directories, files, links, bytes and seconds
+        """
+        with span('StagingPlan.execute', 'files', directories=len(self.directories),
+                  files=len(self.copies), links=len(self.links)) as summary:
+            t0 = time.perf_counter()
+
+            # Directories first, including those of the destinations of the copies and links
+            directories = set(self.directories.values())
+            directories.update(os.path.dirname(dest) for _, _, dest in list(self.copies.values()) + list(self.links.values())
+                               if os.path.dirname(dest))
+            for directory in sorted(directories):
+                mkdir(directory)
+            logger.info(f"Created {len(directories)} directories")
+
+            nbytes, nbytes_linked = 0, 0
+            if self.copies:
+                with ThreadPoolExecutor(max_workers=min(self.nthreads, len(self.copies))) as executor:
+                    futures = [executor.submit(self._copy, *entry) for entry in self.copies.values()]
+                errors = [future.exception() for future in futures if future.exception() is not None]
+                if errors:
+                    logger.error(f"FATAL ERROR: {len(errors)} of {len(futures)} files could not be staged")
+                    raise errors[0]
+                nbytes = sum(future.result()[0] for future in futures)
+                nbytes_linked = sum(future.result()[1] for future in futures)
+
+            for action, src, dest in self.links.values():
+                getattr(FileHandler, 'link_req' if LINK_ACTIONS[action] else 'link_opt')([[src, dest]])
+
+            seconds = time.perf_counter() - t0
+            summary.update(bytes=nbytes, bytes_readonly=nbytes_linked, seconds=round(seconds, 3))
+            logger.info(f"Staged {len(self.copies)} files ({nbytes / 1.e6:.1f} MB copied, {nbytes_linked / 1.e6:.1f} MB "
+                        f"read-only not copied) and {len(self.links)} links in {seconds:.1f} s "
+                        f"({nbytes / 1.e6 / max(seconds, 1.e-6):.1f} MB/s, {self.nthreads} threads)")
+
+            if self.cache is not None:
+                self.cache.evict()
+                summary.update(fix_cache=dict(self.cache.stats))
+                logger.info(f"Staged with the {self.cache.summary()}")
+            return dict(summary)
+
+    def _copy(self, action: str, src: str, dest: str) -> Tuple[int, int]:
+        """
+        Copy a file with the semantics of the FileHandler action, retrying on failure,
+        or link a read-only file; returns the bytes copied and linked
+        """
+        if not os.path.exists(src):
+            if COPY_ACTIONS[action]:
+                logger.exception(f"Source file '{src}' does not exist and is required, ABORT!")
+                raise FileNotFoundError(f"Source file '{src}' does not exist")
+            logger.warning(f"Source file '{src}' does not exist, skipping!")
+            return 0, 0
+
+        dest_path = self._destination(src, dest)
+        if action == 'readonly' and self.readonly:
+            return 0, self._stage_readonly(src, dest_path)
+        if dest_path in _readonly_inputs:
+            # A file staged read-only before is now staged as a copy
+            with _readonly_lock:
+                _readonly_inputs.pop(dest_path, None)
+            os.unlink(dest_path)
+
+        if self.cache is not None and action != 'copy_safe' and self.cache.cacheable(src):
+            copy = functools.partial(self._copy_from_cache, hardlink=action != 'mutable')
+        else:
+            copy = getattr(FileHandler, action if action in ['copy_opt', 'copy_safe'] else 'copy_req')
+        for attempt in range(self.retries + 1):
+            try:
+                copy([[src, dest]])
+                break
+            except OSError as ee:
+                if attempt == self.retries:
+                    raise ee
+                logger.warning(f"Copy of {src} to {dest} failed ({ee}), retry {attempt + 1} of {self.retries}")
+                time.sleep(2 ** attempt)
+        return (os.path.getsize(src) if os.path.isfile(src) else 0), 0
+
+    @staticmethod
+    def _stage_readonly(src: str, dest: str) -> int:
+        """Clone or symlink a read-only file; returns its size"""
+        if os.path.lexists(dest):
+            os.unlink(dest)
+        if reflink(src, dest):
+            shutil.copystat(src, dest)
+            method = 'Cloned'
+        else:
+            os.symlink(os.path.abspath(src), dest)
+            method = 'Linked'
+        _register_readonly(dest, src)
+        logger.info(f"{method} {src} to {dest} (read-only)")
+        return os.path.getsize(src)
+
+    def _copy_from_cache(self, filelist: List[List[str]], hardlink: bool = True) -> None:
+        """Stage files from the fix cache; the files hardlinked to the cache are read-only"""
+        for src, dest in filelist:
+            if self.cache.stage(src, dest, hardlink=hardlink) == 'hardlinks':
+                _register_readonly(self._destination(src, dest), src)
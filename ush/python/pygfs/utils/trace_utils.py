@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from logging import getLogger
+from typing import Any, Dict, List, Optional
+
+import wxflow
+
+logger = getLogger(__name__.split('.')[-1])
+
+'''
+    MODULE:
+        trace_utils.py
+
+    ABOUT:
+        Opt-in timing trace of the pygfs tasks.
+
+        When PYGFS_TRACE is YES (or CHROME), importing pygfs enables the
+        tracing, which records a span:
+          - for each phase (initialize, configure, execute, finalize, run) of
+            the subclasses of wxflow.Task defined afterwards
+          - for each FileHandler(...).sync(), with the number of files and
+            the bytes copied
+          - for each Executable launched, with its exit code
+          - for each YAML file rendered with parse_j2yaml
+        and for the blocks of code wrapped in `with span(...)`.
+
+        The spans are appended, as they end, as JSON lines to
+          ${PYGFS_TRACE_DIR:-${ROTDIR}/logs/${PDY}${cyc}/traces}/${RUN}_${jobid}.<pid>.jsonl
+        where <pid> is the process that enabled the tracing (the processes it
+        forks append to the same file, those started afresh write their own)
+        and ${job} replaces ${jobid} when it is not set.  With CHROME, they
+        are also written at the end of the job in the Chrome trace format, to
+        the same name with .json, which chrome://tracing and
+        https://ui.perfetto.dev open.
+'''
+
+__all__ = ['PHASES', 'Tracer', 'enable', 'span']
+
+# Methods of the tasks traced as phases
+PHASES = ['initialize', 'configure', 'execute', 'finalize', 'run']
+# FileHandler actions that copy files
+COPY_ACTIONS = ['copy', 'copy_req', 'copy_opt', 'copy_safe']
+
+_tracer = None
+
+
+class Tracer:
+    """
+    Writer of the spans of a job
+
+    Parameters
+    ----------
+    path : str
+        JSON lines file the spans are appended to
+    cycle : str
+        Cycle of the job (YYYYMMDDHH)
+    task : str
+        Name of the job
+    chrome : bool
+        Also write the spans in the Chrome trace format at exit
+    """
+
+    def __init__(self, path: str, cycle: str, task: str, chrome: bool = False) -> None:
+        self.path = path
+        self.cycle = cycle
+        self.task = task
+        self.chrome = chrome
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def record(self, name: str, category: str, start: float, duration: float, args: Dict[str, Any]) -> None:
+        """Append a span (start in seconds since the epoch, duration in seconds)"""
+        event = {'name': name, 'cat': category, 'start': round(start, 6), 'duration': round(duration, 6),
+                 'pid': os.getpid(), 'tid': threading.get_ident(), 'cycle': self.cycle, 'task': self.task,
+                 'args': args}
+        line = json.dumps(event, default=str) + '\n'
+        with self._lock, open(self.path, 'a') as fh:
+            fh.write(line)
+
+    @contextmanager
+    def span(self, name: str, category: str = 'span', **args):
+        """Record the time spent in a block; `args` may be updated in the block"""
+        start, t0 = time.time(), time.perf_counter()
+        try:
+            yield args
+        except BaseException as exc:
+            args['error'] = type(exc).__name__
+            raise
+        finally:
+            self.record(name, category, start, time.perf_counter() - t0, args)
+
+    def events(self) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as fh:
+            return [json.loads(line) for line in fh if line.strip()]
+
+    def write_chrome_trace(self, path: Optional[str] = None) -> str:
+        """Write the spans in the Chrome trace (Perfetto) format"""
+        path = path or f'{os.path.splitext(self.path)[0]}.json'
+        trace_events = [{'name': event['name'], 'cat': event['cat'], 'ph': 'X',
+                         'ts': round(event['start'] * 1.e6), 'dur': round(event['duration'] * 1.e6),
+                         'pid': event['pid'], 'tid': event['tid'], 'args': event['args']}
+                        for event in self.events()]
+        trace_events.append({'name': 'process_name', 'ph': 'M', 'pid': self.pid,
+                             'args': {'name': f'{self.task} {self.cycle}'}})
+        with open(path, 'w') as fh:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, fh, default=str)
+        return path
+
+    def _at_exit(self) -> None:
+        # Only the process that enabled the tracing writes the Chrome trace
+        if self.chrome and os.getpid() == self.pid:
+            self.write_chrome_trace()
+
+
+@contextmanager
+def span(name: str, category: str = 'span', **args):
+    """
+    Record the time spent in a block of code (nothing is done if the tracing is not enabled)
+
+    Example
+    -------
+    with span('render observers', 'yaml') as args:
+        ...
+        args['nobs'] = len(observers)
+    """
+    if _tracer is None:
+        yield args
+    else:
+        with _tracer.span(name, category, **args) as span_args:
+            yield span_args
+
+
+def _copied_bytes(files: List) -> int:
+    """Bytes of the destinations of a FileHandler copy list"""
+    nbytes = 0
+    for src, dest in files:
+        dest = os.path.join(dest, os.path.basename(src)) if os.path.isdir(dest) else dest
+        if os.path.isfile(dest):
+            nbytes += os.path.getsize(dest)
+    return nbytes
+
+
+def _trace_sync(sync):
+    @wraps(sync)
+    def traced_sync(self):
+        counts = {action: len(files or []) for action, files in self.config.items()}
+        with span('FileHandler.sync', 'files', files=sum(counts.values()), actions=counts) as args:
+            sync(self)
+            args['bytes'] = sum(_copied_bytes(self.config[action] or [])
+                                for action in COPY_ACTIONS if action in self.config)
+    return traced_sync
+
+
+def _trace_executable(call):
+    @wraps(call)
+    def traced_call(self, *args, **kwargs):
+        command = ' '.join(str(arg) for arg in self.exe + list(args))
+        with span(os.path.basename(self.exe[0]), 'executable', command=command) as span_args:
+            try:
+                return call(self, *args, **kwargs)
+            finally:
+                span_args['returncode'] = getattr(self, 'returncode', None)
+    return traced_call
+
+
+def _trace_yaml(parse):
+    @wraps(parse)
+    def traced_parse(path, *args, **kwargs):
+        with span(f'parse_j2yaml {os.path.basename(str(path))}', 'yaml', path=str(path)):
+            return parse(path, *args, **kwargs)
+    return traced_parse
+
+
+def _trace_phase(cls_name: str, name: str, method):
+    @wraps(method)
+    def traced_method(*args, **kwargs):
+        with span(f'{cls_name}.{name}', 'phase'):
+            return method(*args, **kwargs)
+    return traced_method
+
+
+def _trace_task_subclass(cls, **kwargs):
+    """Wrap the phases defined by a subclass of wxflow.Task"""
+    super(wxflow.Task, cls).__init_subclass__(**kwargs)
+    for name in PHASES:
+        attribute = cls.__dict__.get(name)
+        if isinstance(attribute, staticmethod):
+            setattr(cls, name, staticmethod(_trace_phase(cls.__name__, name, attribute.__func__)))
+        elif isinstance(attribute, classmethod):
+            setattr(cls, name, classmethod(_trace_phase(cls.__name__, name, attribute.__func__)))
+        elif callable(attribute):
+            setattr(cls, name, _trace_phase(cls.__name__, name, attribute))
+
+
+def enable(config: Optional[Dict[str, str]] = None) -> Tracer:
+    """
+    Enable the tracing of the tasks of the job
+
+    Parameters
+    ----------
+    config : Dict[str, str]
+        Job environment (default: os.environ), with
+        PYGFS_TRACE : YES, or CHROME to also write a Chrome trace
+        PYGFS_TRACE_DIR : directory of the traces (default: ${ROTDIR}/logs/${PDY}${cyc}/traces)
+        PDY, cyc, RUN, jobid : cycle and name of the job
+
+    Returns
+    -------
+    Tracer
+    """
+    global _tracer
+    if _tracer is not None:
+        return _tracer
+
+    config = os.environ if config is None else config
+    cycle = f"{config.get('PDY', '')}{config.get('cyc', '')}" or 'nocycle'
+    task = f"{config.get('RUN', '')}_{config.get('jobid', config.get('job', 'job'))}".lstrip('_')
+    if config.get('PYGFS_TRACE_DIR'):
+        trace_dir = config['PYGFS_TRACE_DIR']
+    elif config.get('ROTDIR'):
+        trace_dir = os.path.join(config['ROTDIR'], 'logs', cycle, 'traces')
+    else:
+        trace_dir = os.path.join(os.getcwd(), 'traces')
+    os.makedirs(trace_dir, exist_ok=True)
+
+    _tracer = Tracer(os.path.join(trace_dir, f'{task}.{os.getpid()}.jsonl'), cycle, task,
+                     chrome=str(config.get('PYGFS_TRACE', '')).upper() == 'CHROME')
+    logger.info(f"Tracing the tasks to {_tracer.path}")
+
+    wxflow.FileHandler.sync = _trace_sync(wxflow.FileHandler.sync)
+    wxflow.Executable.__call__ = _trace_executable(wxflow.Executable.__call__)
+    wxflow.parse_j2yaml = _trace_yaml(wxflow.parse_j2yaml)
+    wxflow.Task.__init_subclass__ = classmethod(_trace_task_subclass)
+    atexit.register(_tracer._at_exit)
+
+    return _tracer
@@ -6,6 +6,7 @@ from hosts import Host
 from pathlib import Path
 from wxflow import Configuration, to_timedelta
 from abc import ABC, ABCMeta, abstractmethod
+from applications.config_resolver import ConfigResolver
 
 __all__ = ['AppConfig']
 
@@ -35,8 +36,10 @@ class AppConfig(ABC, metaclass=AppConfigInit):
         # Save the configuration so we can source the config files when
         # determining task resources
         self.conf = conf
+        # Sources the config files concurrently and remembers them
+        self.config_resolver = ConfigResolver(conf)
 
-        _base = self.conf.parse_config('config.base')
+        _base = self.config_resolver.parse_config('config.base')
         # Define here so the child __init__ functions can use it; will
         # be overwritten later during _init_finalize().
         self._base = _base
@@ -152,9 +155,10 @@ class AppConfig(ABC, metaclass=AppConfigInit):
         configs = dict()
 
         # Return config.base as well
-        configs['base'] = self.conf.parse_config('config.base')
+        configs['base'] = self.config_resolver.parse_config('config.base')
 
         # Source the list of all config_files involved in the application
+        config_files = dict()
         for config in self.configs_names:
 
             # All must source config.base first
@@ -176,7 +180,10 @@ class AppConfig(ABC, metaclass=AppConfigInit):
                 files += [f'config.{config}']
 
             print(f'sourcing config.{config}') if log else 0
-            configs[config] = self.conf.parse_config(files, RUN=run)
+            config_files[config] = files
+
+        # config.base and the shared files are only sourced once, the rest concurrently
+        configs.update(self.config_resolver.parse_configs(config_files, RUN=run))
 
         return configs
 
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+import copy
+import hashlib
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple, Union
+
+from wxflow import Configuration, cast_strdict_as_dtypedict
+from wxflow.configuration import ShellScriptException
+
+__all__ = ['ConfigResolver']
+
+# Variables bash sets itself, which are not part of the state of the sourced files
+_SHELL_VARIABLES = {'BASH', 'BASHOPTS', 'BASHPID', 'BASH_ALIASES', 'BASH_ARGC', 'BASH_ARGV', 'BASH_ARGV0',
+                    'BASH_CMDS', 'BASH_COMMAND', 'BASH_EXECUTION_STRING', 'BASH_LINENO', 'BASH_SOURCE',
+                    'BASH_SUBSHELL', 'BASH_VERSINFO', 'BASH_VERSION', 'COLUMNS', 'COMP_WORDBREAKS', 'DIRSTACK',
+                    'EPOCHREALTIME', 'EPOCHSECONDS', 'EUID', 'FUNCNAME', 'GROUPS', 'HISTCMD', 'HOSTNAME',
+                    'HOSTTYPE', 'IFS', 'LINENO', 'LINES', 'MACHTYPE', 'OLDPWD', 'OPTERR', 'OPTIND', 'OSTYPE',
+                    'PIPESTATUS', 'PPID', 'PS4', 'PWD', 'RANDOM', 'SECONDS', 'SHELL', 'SHELLOPTS', 'SHLVL',
+                    'SRANDOM', 'UID', '_'}
+
+# Prints each variable declaration, the functions and the shell options, separated by NUL
+_DUMP_STATE = ('for __resolver_var in $(compgen -v); do '
+               '[[ ${__resolver_var} == __resolver_* ]] || { declare -p "${__resolver_var}"; printf "\\0"; }; '
+               'done; printf "\\0"; declare -f; printf "\\0"; shopt -p; set +o')
+
+
+class ConfigResolver:
+    """
+    Source many config files at once.
+
+    Each config is a list of files sourced in order, e.g. config.base,
+    config.anal, config.eobs.  The leading files shared by the configs
+    (config.base, config.base + config.anal, ...) are sourced once, by a
+    top-level bash, and the state of the shell (variables, functions and
+    options) is saved as a script.  Each config then sources this script and
+    its last file in a new top-level bash, as Configuration.parse_config does,
+    so the results are the same (in particular a top-level bash carries on
+    after an arithmetic error, where a forked subshell would exit).  Up to
+    `nprocs` configs are sourced at the same time.
+
+    The shell states and the dictionaries are memoized by the content of the
+    files and the environment variables, so sourcing the same configs again
+    (e.g. for the same RUN) is free.
+    """
+
+    def __init__(self, conf: Configuration, nprocs: int = None) -> None:
+        """
+        Parameters
+        ----------
+        conf : Configuration
+            Configuration of the experiment (the directory holding the config files)
+        nprocs : int
+            Maximum number of config files sourced at the same time (default: up to 8)
+        """
+
+        self.conf = conf
+        self.nprocs = max(1, nprocs if nprocs is not None else min(8, os.cpu_count() or 1))
+        self._cache = dict()
+        self._states = dict()
+        self._new_shells = dict()
+        self._default_env = None
+        self._lock = threading.Lock()
+        self._state_dir = tempfile.mkdtemp(prefix='config_resolver.')
+        weakref.finalize(self, shutil.rmtree, self._state_dir, ignore_errors=True)
+
+    def __deepcopy__(self, memo):
+        # The sourced configs are shared by the (deep) copies of an application
+        return self
+
+    @staticmethod
+    def _digest(path: str) -> Tuple[str, str]:
+        with open(path, 'rb') as fh:
+            return path, hashlib.blake2b(fh.read(), digest_size=16).hexdigest()
+
+    @staticmethod
+    def _env_key(envvars: Dict[str, Any]) -> tuple:
+        return tuple(sorted((key, str(value)) for key, value in envvars.items()))
+
+    def parse_config(self, files: Union[str, bytes, list], **envvars) -> Dict[str, Any]:
+        """
+        Same as Configuration.parse_config, memoized
+
+        Parameters
+        ----------
+        files : str or list
+            config file or list of config files, sourced in order
+        envvars : Any
+            environment variables to be set prior to sourcing config files
+
+        Returns
+        -------
+        Dict[str, Any]
+            Variables defined by the config files
+        """
+        return self.parse_configs({'config': files}, **envvars)['config']
+
+    def parse_configs(self, configs: Dict[str, Union[str, bytes, list]], **envvars) -> Dict[str, Dict[str, Any]]:
+        """
+        Source several configs concurrently
+
+        Parameters
+        ----------
+        configs : Dict[str, str or list]
+            config file or list of config files, sourced in order, for each config name
+        envvars : Any
+            environment variables to be set prior to sourcing config files
+
+        Returns
+        -------
+        Dict[str, Dict[str, Any]]
+            Variables defined by the config files for each config name
+        """
+
+        files_of = dict()
+        for name, files in configs.items():
+            if isinstance(files, (str, bytes)):
+                files = [files]
+            files_of[name] = tuple(self._digest(self.conf.find_config(file)) for file in files)
+
+        env_key = self._env_key(envvars)
+        missing = {(files, env_key) for files in files_of.values() if (files, env_key) not in self._cache}
+        if missing:
+            self._source(sorted(missing), envvars)
+
+        return {name: copy.deepcopy(self._cache[(files_of[name], env_key)]) for name in configs}
+
+    def _source(self, keys: List[tuple], envvars: Dict[str, Any]) -> None:
+        """Source the configs concurrently, after the shell states of their shared leading files"""
+
+        if self._default_env is None:
+            self._default_env = Configuration._get_shell_env([])
+
+        # The states of the leading files, shortest first since each one starts from its parent
+        prefixes = {files[:n] for files, _ in keys for n in range(1, len(files))}
+        with ThreadPoolExecutor(max_workers=min(self.nprocs, len(keys))) as executor:
+            for length in sorted({len(prefix) for prefix in prefixes}):
+                level = [prefix for prefix in prefixes if len(prefix) == length]
+                list(executor.map(lambda prefix: self._state(prefix, envvars), level))
+
+            futures = {key: executor.submit(self._source_config, key[0], envvars) for key in keys}
+
+        self._cache.update({key: future.result() for key, future in futures.items()})
+
+    def _source_config(self, files: tuple, envvars: Dict[str, Any]) -> Dict[str, Any]:
+        """Variables defined by the files, as Configuration.parse_config returns them"""
+
+        scripts = [self._state(files[:-1], envvars)] if len(files) > 1 else []
+        scripts.append(files[-1][0])
+        script_env = Configuration._get_shell_env(scripts, **envvars)
+
+        union_env = dict(self._default_env)
+        union_env.update(script_env)
+        return cast_strdict_as_dtypedict({var: union_env[var] for var in set(script_env) - set(self._default_env)})
+
+    def _state(self, files: tuple, envvars: Dict[str, Any]) -> str:
+        """Script restoring the shell state after sourcing the files (sourced once)"""
+
+        key = (files, self._env_key(envvars))
+        with self._lock:
+            if key in self._states:
+                return self._states[key]
+
+        # The state is complete (relative to a new shell), not relative to its parent
+        parent = [self._state(files[:-1], envvars)] if len(files) > 1 else []
+        before = self._new_shell(envvars)
+        after = self._dump(parent + [files[-1][0]], envvars)
+
+        lines = [after['options']]
+        for name, declaration in after['variables'].items():
+            if name not in _SHELL_VARIABLES and before['variables'].get(name) != declaration:
+                lines.append(declaration)
+        lines += [f'unset {name}' for name in before['variables']
+                  if name not in after['variables'] and name not in _SHELL_VARIABLES]
+        lines.append(after['functions'])
+
+        fd, path = tempfile.mkstemp(prefix=os.path.basename(files[-1][0]) + '.', suffix='.sh', dir=self._state_dir)
+        with os.fdopen(fd, 'w') as fh:
+            fh.write('\n'.join(lines) + '\n')
+
+        with self._lock:
+            self._states[key] = path
+        return path
+
+    def _new_shell(self, envvars: Dict[str, Any]) -> Dict[str, Any]:
+        """State of a new shell (memoized)"""
+
+        key = self._env_key(envvars)
+        with self._lock:
+            if key in self._new_shells:
+                return self._new_shells[key]
+        state = self._dump([], envvars)
+        with self._lock:
+            return self._new_shells.setdefault(key, state)
+
+    @staticmethod
+    def _dump(scripts: List[str], envvars: Dict[str, Any]) -> Dict[str, Any]:
+        """Variables (declarations), functions and options of a top-level bash after sourcing the scripts"""
+
+        runme = ''.join(f'export {key}={value}; ' for key, value in envvars.items())
+        runme += ''.join(f'source {script}; ' for script in scripts)
+        magic = f'--- STATE BEGIN {random.randint(0, 64**5)} ---'
+        runme += f'/bin/echo -n "{magic}"; {_DUMP_STATE}'
+        with open('/dev/null', 'w') as null:
+            out = subprocess.run(runme, shell=True, executable=shutil.which('bash'), stdin=null.fileno(),
+                                 stdout=subprocess.PIPE, check=True).stdout.decode()
+        begin = out.find(magic)
+        if begin < 0:
+            raise ShellScriptException(scripts, f'Cannot find magic string; at least one script failed: {out!r}')
+
+        records = out[begin + len(magic):].split('\0')
+        variables = dict()
+        for record in records[:-3]:
+            # declare -<attributes> NAME[=value]
+            name = record.split(' ', 2)[2].split('=', 1)[0]
+            variables[name] = record
+        return {'variables': variables, 'functions': records[-2], 'options': records[-1]}
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Recommend the layout (ntasks, tasks_per_node, threads_per_task) of the steps
+of config.resources from the run times measured in past experiments
+"""
+
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from datetime import timedelta
+
+from rocoto.accounting import ACCOUNTING_PROVIDERS, get_accounting
+from rocoto.critical_path import STATS
+from rocoto.resource_recommender import Experiment, collect_scaling, recommend
+
+
+def input_args(*argv):
+    """
+    Method to collect user arguments for `recommend_resources.py`
+    """
+
+    description = """
+        Collects the run times and queue waits of the jobs of the Rocoto
+        database of each experiment, fits the strong scaling of each step
+        of config.resources per RUN and resolution, and prints the layouts
+        that use the least node-hours within the target as a diff against
+        the config.resources of the first experiment.
+        """
+
+    parser = ArgumentParser(description=description,
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('expdirs', help='experiment directories; the config.resources of the first one is compared',
+                        type=str, nargs='+')
+    parser.add_argument('--stat', help='statistic of the past run times', choices=list(STATS),
+                        default='median', required=False)
+    parser.add_argument('--margin', help='fraction of the walltime the jobs must finish within', type=float,
+                        default=0.8, required=False)
+    parser.add_argument('--latency', help='seconds the jobs must finish within, queue wait included '
+                        '(instead of --margin)', type=float, default=None, required=False)
+    parser.add_argument('--max-scale', help='largest factor between the cpus proposed and those measured',
+                        type=float, default=2., required=False)
+    parser.add_argument('--scheduler', help='query the accounting of this scheduler for the jobs rocoto_viewer '
+                        'has no metrics of', choices=list(ACCOUNTING_PROVIDERS), default=None, required=False)
+    parser.add_argument('-v', '--verbose', help='also list the steps that are left alone', action='store_true',
+                        required=False)
+
+    return parser.parse_args(argv[0][0] if len(argv[0]) else None)
+
+
+def hms(seconds):
+    return str(timedelta(seconds=round(seconds)))
+
+
+def layout_line(sign, layout):
+    return (f'{sign}ntasks={layout["ntasks"]} tasks_per_node={layout["tasks_per_node"]} '
+            f'threads_per_task={layout["threads_per_task"]}'
+            f'    # {layout["nodes"]} nodes, {hms(layout["runtime"])}, {layout["node_hours"]:.2f} node-hours')
+
+
+def main(*argv):
+
+    user_inputs = input_args(argv)
+
+    experiments = [Experiment(expdir) for expdir in user_inputs.expdirs]
+    accounting = get_accounting(user_inputs.scheduler) if user_inputs.scheduler else None
+    scaling = collect_scaling(experiments, accounting)
+    recommendations = recommend(scaling, experiments[0], user_inputs.stat, user_inputs.margin,
+                                user_inputs.latency, user_inputs.max_scale)
+
+    target = f'{user_inputs.latency:.0f} s latency' if user_inputs.latency is not None else \
+        f'{100. * user_inputs.margin:.0f}% of the walltime'
+    print(f'--- {experiments[0].expdir}/config.resources')
+    print(f'+++ recommended ({user_inputs.stat} run times of {len(experiments)} experiments, within {target})')
+
+    before = after = 0.
+    for recommendation in recommendations:
+        if not (recommendation.changed or recommendation.missed or user_inputs.verbose):
+            continue
+        serial, parallel = recommendation.fit
+        print(f'@@ {recommendation.step} RUN={recommendation.run} CASE={recommendation.resolution}: '
+              f'{len(recommendation.scaling.samples)} jobs, t = {serial:.0f} + {parallel:.0f} / cpus s, '
+              f'target {hms(recommendation.target)} @@')
+        if recommendation.changed:
+            print(layout_line('-', recommendation.current))
+            print(layout_line('+', recommendation.proposed))
+            before += recommendation.current['node_hours']
+            after += recommendation.proposed['node_hours']
+        else:
+            print(layout_line(' ', recommendation.current))
+        if recommendation.note:
+            print(f'# {recommendation.note}')
+
+    print(f'# {sum(1 for recommendation in recommendations if recommendation.changed)} of '
+          f'{len(recommendations)} measured steps changed, {before:.2f} -> {after:.2f} node-hours per run of them')
+
+
+if __name__ == '__main__':
+
+    main()
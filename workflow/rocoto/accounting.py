@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import re
+import subprocess
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+'''
+    MODULE:
+        accounting.py
+
+    ABOUT:
+        Batched scheduler accounting (queue time, cpu time, run time, slots)
+        for the jobs of a Rocoto workflow.  Each provider fetches the metrics
+        of many jobs with a single call to the scheduler and caches them; jobs
+        that have finished are never queried again and the others only once
+        every `ttl` seconds.
+
+        Every provider returns, for each jobid it knows about, a dict with:
+            name, state, submit_time, start_time, end_time (seconds since the epoch or None),
+            qtime, runtime, cputime (seconds or None), slots (int or None),
+            finished (bool)
+'''
+
+__all__ = ['SchedulerAccounting', 'SlurmAccounting', 'PBSAccounting', 'LSFAccounting',
+           'FakeScheduler', 'get_accounting', 'ACCOUNTING_PROVIDERS']
+
+
+def run_command(cmd: List[str], env: Optional[Dict[str, str]] = None) -> Optional[str]:
+    """
+    Run a scheduler command and return its standard output, or None if the
+    command is not available or fails
+    """
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                encoding='utf-8', errors='replace', env=env, check=False)
+    except OSError:
+        return None
+    if result.returncode != 0 and not result.stdout:
+        return None
+    return result.stdout
+
+
+def _duration(value: str) -> Optional[float]:
+    """Seconds in a [DD-][HH:]MM:SS[.sss] duration, None if it can not be parsed"""
+    m = re.fullmatch(r'(?:(\d+)-)?(?:(\d+):)?(\d+):(\d+(?:\.\d*)?)', value.strip())
+    if m is None:
+        return None
+    days, hours, minutes, seconds = m.groups()
+    return int(days or 0) * 86400 + int(hours or 0) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def _number(value: str) -> Optional[float]:
+    """Leading number of a value like '12.5 second(s)', None if there is none"""
+    m = re.match(r'\s*(\d+(?:\.\d*)?)', value)
+    return float(m.group(1)) if m else None
+
+
+def _metrics(name=None, state=None, submit_time=None, start_time=None, end_time=None,
+             runtime=None, cputime=None, slots=None, finished=False, now=None) -> Dict[str, Any]:
+    """Assemble the metrics of a job, deriving the queue time and run time when needed"""
+    now = time.time() if now is None else now
+    qtime = None
+    if submit_time is not None:
+        qtime = max(0, (start_time if start_time is not None else now) - submit_time)
+    if runtime is None and start_time is not None:
+        runtime = max(0, (end_time if end_time is not None else now) - start_time)
+    return {'name': name, 'state': state, 'submit_time': submit_time, 'start_time': start_time,
+            'end_time': end_time, 'qtime': qtime, 'runtime': runtime, 'cputime': cputime,
+            'slots': slots, 'finished': finished}
+
+
+class SchedulerAccounting:
+    """
+    Base class of the scheduler accounting providers
+
+    Subclasses define `command`, which builds the command line that queries a
+    batch of jobs, and `parse`, which turns its output into metrics by jobid.
+    """
+
+    scheduler = None
+    # Maximum number of jobids given to one scheduler command
+    max_batch = 1000
+
+    def __init__(self, ttl: float = 60, runner: Callable = run_command) -> None:
+        """
+        Parameters
+        ----------
+        ttl : float
+            Seconds for which the metrics of unfinished jobs are reused
+        runner : Callable
+            Function running a command (list of strings) and returning its output,
+            e.g. a FakeScheduler for offline testing
+        """
+        self.ttl = ttl
+        self.runner = runner
+        self._cache = dict()
+
+    def command(self, jobids: List[str]) -> List[str]:
+        raise NotImplementedError
+
+    def parse(self, output: str) -> Dict[str, Dict[str, Any]]:
+        raise NotImplementedError
+
+    def env(self) -> Optional[Dict[str, str]]:
+        return None
+
+    @staticmethod
+    def _key(jobid: str) -> str:
+        """Numeric part of a jobid, e.g. '123' for '123.server' or '123_4'"""
+        return re.split(r'[._\[]', str(jobid), maxsplit=1)[0]
+
+    def fetch(self, jobids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Query the scheduler for a list of jobids, in as few calls as possible"""
+        metrics = dict()
+        for i in range(0, len(jobids), self.max_batch):
+            output = self.runner(self.command(jobids[i:i + self.max_batch]), env=self.env())
+            if output:
+                metrics.update(self.parse(output))
+        return metrics
+
+    def query(self, jobids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Metrics of the jobs in jobids that the scheduler knows about
+
+        Parameters
+        ----------
+        jobids : List[str]
+            Jobids as recorded by Rocoto
+
+        Returns
+        -------
+        metrics : Dict[str, Dict[str, Any]]
+            Metrics keyed by the jobids given
+        """
+        now = time.time()
+        jobids = [str(jobid) for jobid in jobids if jobid not in (None, '', '-')]
+        stale = []
+        for jobid in dict.fromkeys(jobids):
+            cached = self._cache.get(self._key(jobid))
+            if cached is None or (not cached[1]['finished'] and now - cached[0] > self.ttl):
+                stale.append(jobid)
+
+        if stale:
+            for jobid, values in self.fetch(stale).items():
+                self._cache[self._key(jobid)] = (now, values)
+
+        return {jobid: self._cache[self._key(jobid)][1] for jobid in jobids if self._key(jobid) in self._cache}
+
+
+class SlurmAccounting(SchedulerAccounting):
+    """
+    Slurm accounting from sacct --parsable2
+    """
+
+    scheduler = 'slurm'
+    fields = ['JobID', 'JobName', 'State', 'Submit', 'Start', 'End', 'ElapsedRaw', 'TotalCPU', 'AllocCPUS']
+
+    def command(self, jobids):
+        return ['sacct', '--parsable2', '--noheader', '--starttime', '1970-01-01',
+                f'--format={",".join(self.fields)}', '--jobs', ','.join(jobids)]
+
+    @staticmethod
+    def _time(value):
+        if value in ('', 'Unknown', 'None'):
+            return None
+        try:
+            return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S').timestamp()
+        except ValueError:
+            return None
+
+    def parse(self, output):
+        jobs = dict()
+        step_cpu = dict()
+        for line in output.splitlines():
+            values = line.split('|')
+            if len(values) != len(self.fields):
+                continue
+            record = dict(zip(self.fields, values))
+            jobid, _, step = record['JobID'].partition('.')
+            cputime = _duration(record['TotalCPU'])
+            if step:
+                # The CPU time of a job is accumulated by its steps
+                step_cpu[jobid] = step_cpu.get(jobid, 0) + (cputime or 0)
+                continue
+            state = record['State'].split()[0] if record['State'] else None
+            runtime = float(record['ElapsedRaw']) if record['ElapsedRaw'].isdigit() else None
+            slots = int(record['AllocCPUS']) if record['AllocCPUS'].isdigit() else None
+            jobs[jobid] = _metrics(name=record['JobName'], state=state,
+                                   submit_time=self._time(record['Submit']),
+                                   start_time=self._time(record['Start']),
+                                   end_time=self._time(record['End']),
+                                   runtime=runtime, cputime=cputime, slots=slots,
+                                   finished=state not in (None, 'PENDING', 'RUNNING', 'REQUEUED', 'RESIZING', 'SUSPENDED'))
+        for jobid, cputime in step_cpu.items():
+            if jobid in jobs and cputime > (jobs[jobid]['cputime'] or 0):
+                jobs[jobid]['cputime'] = cputime
+        return jobs
+
+
+class PBSAccounting(SchedulerAccounting):
+    """
+    PBS Pro accounting from qstat -f -F json (including finished jobs)
+    """
+
+    scheduler = 'pbspro'
+
+    def command(self, jobids):
+        return ['qstat', '-x', '-f', '-F', 'json'] + jobids
+
+    @staticmethod
+    def _time(value):
+        if value in (None, ''):
+            return None
+        if isinstance(value, (int, float)) or str(value).isdigit():
+            return float(value)
+        try:
+            return datetime.strptime(value, '%a %b %d %H:%M:%S %Y').timestamp()
+        except ValueError:
+            return None
+
+    def parse(self, output):
+        try:
+            # qstat does not escape control characters in the job variables
+            data = json.loads(output, strict=False)
+        except ValueError:
+            return dict()
+        jobs = dict()
+        for jobid, record in data.get('Jobs', dict()).items():
+            used = record.get('resources_used', dict())
+            requested = record.get('Resource_List', dict())
+            state = record.get('job_state')
+            walltime = used.get('walltime')
+            cput = used.get('cput')
+            ncpus = requested.get('ncpus', used.get('ncpus'))
+            jobs[jobid] = _metrics(name=record.get('Job_Name'), state=state,
+                                   submit_time=self._time(record.get('qtime', record.get('ctime'))),
+                                   start_time=self._time(record.get('stime')),
+                                   end_time=self._time(record.get('obittime')),
+                                   runtime=_duration(walltime) if walltime else None,
+                                   cputime=_duration(cput) if cput else None,
+                                   slots=int(ncpus) if ncpus is not None else None,
+                                   finished=state in ('F', 'X'))
+        return jobs
+
+
+class LSFAccounting(SchedulerAccounting):
+    """
+    LSF accounting from bjobs -o (with the year shown in the times)
+    """
+
+    scheduler = 'lsf'
+    fields = ['jobid', 'job_name', 'stat', 'slots', 'submit_time', 'start_time', 'finish_time', 'cpu_used', 'run_time']
+
+    def command(self, jobids):
+        return ['bjobs', '-a', '-noheader', '-o', f"{' '.join(self.fields)} delimiter=';'"] + jobids
+
+    def env(self):
+        return dict(os.environ, LSB_DISPLAY_YEAR='Y')
+
+    @staticmethod
+    def _time(value, now=None):
+        value = value.strip().rstrip(' LEFX')
+        if value in ('', '-'):
+            return None
+        for fmt in ('%b %d %H:%M:%S %Y', '%b %d %H:%M %Y'):
+            try:
+                return datetime.strptime(value, fmt).timestamp()
+            except ValueError:
+                pass
+        # Without LSB_DISPLAY_YEAR the year is omitted; take the latest one not in the future
+        now = datetime.now() if now is None else now
+        for fmt in ('%b %d %H:%M:%S', '%b %d %H:%M'):
+            try:
+                when = datetime.strptime(f'{now.year} {value}', f'%Y {fmt}')
+            except ValueError:
+                continue
+            if when > now:
+                when = when.replace(year=now.year - 1)
+            return when.timestamp()
+        return None
+
+    def parse(self, output):
+        jobs = dict()
+        for line in output.splitlines():
+            values = line.split(';')
+            if len(values) != len(self.fields):
+                continue
+            record = dict(zip(self.fields, values))
+            state = record['stat'].strip()
+            jobs[record['jobid'].strip()] = _metrics(name=record['job_name'].strip(), state=state,
+                                                     submit_time=self._time(record['submit_time']),
+                                                     start_time=self._time(record['start_time']),
+                                                     end_time=self._time(record['finish_time']),
+                                                     runtime=_number(record['run_time']),
+                                                     cputime=_number(record['cpu_used']),
+                                                     slots=int(_number(record['slots'])) if _number(record['slots']) is not None else None,
+                                                     finished=state in ('DONE', 'EXIT'))
+        return jobs
+
+
+class FakeScheduler:
+    """
+    Stand-in for the scheduler commands that answers with canned output
+
+    Used as the `runner` of a provider, e.g.
+        get_accounting('slurm', runner=FakeScheduler({'sacct': canned_output}))
+    The commands it was called with are kept in `calls`.
+    """
+
+    def __init__(self, outputs: Dict[str, str]) -> None:
+        self.outputs = outputs
+        self.calls = []
+
+    def __call__(self, cmd: List[str], env: Optional[Dict[str, str]] = None) -> Optional[str]:
+        self.calls.append(cmd)
+        return self.outputs.get(os.path.basename(cmd[0]))
+
+
+ACCOUNTING_PROVIDERS = {'slurm': SlurmAccounting,
+                        'pbspro': PBSAccounting,
+                        'pbs': PBSAccounting,
+                        'lsf': LSFAccounting,
+                        'lsfcray': LSFAccounting}
+
+
+def get_accounting(scheduler: str, ttl: float = 60, runner: Callable = run_command) -> SchedulerAccounting:
+    """
+    Accounting provider for a scheduler (as named in the Rocoto workflow or the host file)
+
+    Raises
+    ------
+    NotImplementedError
+        If there is no provider for the scheduler
+    """
+    try:
+        provider = ACCOUNTING_PROVIDERS[str(scheduler).lower()]
+    except KeyError:
+        raise NotImplementedError(f'No accounting provider for scheduler "{scheduler}".\n' +
+                                  f'Valid schedulers are: {", ".join(ACCOUNTING_PROVIDERS)}')
+    return provider(ttl=ttl, runner=runner)
@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sqlite3
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from rocoto.workflow_graph import WorkflowGraph
+
+'''
+    MODULE:
+        critical_path.py
+
+    ABOUT:
+        Critical path of the cycles of a Rocoto workflow, from the task graph
+        of its XML document weighted with the run times and queue waits of
+        past runs (the jobs table of Rocoto databases and the scheduler
+        metrics kept next to them by rocoto_viewer).
+
+        The cycles are scheduled in order: a cycle is activated when a cycle
+        throttle slot is free (or at its wall clock time for a realtime
+        workflow), each task starts when its dependency is satisfied and
+        waits its queue time, and the tasks of earlier cycles, including
+        those of the previous cycles referred to by cycle offsets, are
+        scheduled the same way.  Resource limits other than the cycle
+        throttle are not modelled: every job gets its nodes once it has
+        waited its queue time.
+
+        Data dependencies on files of the COM directories are attributed to
+        the task writing them (DATA_PRODUCERS) and satisfied when it ends;
+        other data dependencies, and the sh and string dependencies, are
+        satisfied as soon as the cycle is activated.
+
+        Times are in seconds.  A task whose dependency can never be
+        satisfied gets an infinite time.
+'''
+
+__all__ = ['STATS', 'DATA_PRODUCERS', 'TaskHistory', 'CriticalPath']
+
+INF = float('inf')
+
+# Statistics of the past durations, as percentiles
+STATS = {'median': 50, 'p90': 90}
+
+# Tasks writing the files of data dependencies: a regular expression on the
+# path and the names of the candidate tasks, the first one that runs at the
+# cycle of the file is used
+DATA_PRODUCERS = [(r'/(\w+)\.@Y@m@d/@H/+model_data/', [r'\1fcst']),
+                  (r'/(\w+)\.@Y@m@d/@H/+analysis/atmos/', [r'\1analcalc', r'\1atmanlfinal', r'\1anal'])]
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    """Percentile of sorted values, interpolated linearly"""
+    if len(values) == 1:
+        return values[0]
+    position = (len(values) - 1) * percent / 100.
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class TaskHistory:
+    """
+    Run times and queue waits of the tasks of past runs
+
+    Parameters
+    ----------
+    database_files : List[str]
+        Rocoto databases of past (or current) runs of the workflow
+    accounting : SchedulerAccounting
+        Scheduler accounting queried for the jobs rocoto_viewer has no metrics of (optional)
+
+    Attributes
+    ----------
+    runtimes, qtimes : Dict[str, List[float]]
+        Sorted run times and queue waits of each task
+    slots : Dict[str, List[int]]
+        Slots allocated by the scheduler (the cores requested if not known)
+    samples : Dict[str, List[Tuple[int, float]]]
+        Cores requested and run time of each job
+    """
+
+    def __init__(self, database_files: Optional[List[str]] = None, accounting: Optional[Any] = None) -> None:
+        self.accounting = accounting
+        self.runtimes = defaultdict(list)
+        self.qtimes = defaultdict(list)
+        self.slots = defaultdict(list)
+        self.samples = defaultdict(list)
+        for database_file in database_files or []:
+            self.add_database(database_file)
+
+    @staticmethod
+    def get_perfmetrics_path(database_file: str) -> str:
+        """Path of the scheduler metrics kept by rocoto_viewer for a Rocoto database"""
+        return f'{os.path.splitext(database_file)[0]}_perfmetrics.db'
+
+    def add_database(self, database_file: str) -> None:
+        """Add the jobs that succeeded in a Rocoto database"""
+
+        connection = sqlite3.connect(f'file:{database_file}?mode=ro', uri=True, timeout=30)
+        try:
+            jobs = connection.execute("SELECT jobid, taskname, duration, cores FROM jobs "
+                                      "WHERE state = 'SUCCEEDED'").fetchall()
+        finally:
+            connection.close()
+
+        metrics = dict()
+        perfmetrics_file = self.get_perfmetrics_path(database_file)
+        if os.path.exists(perfmetrics_file):
+            connection = sqlite3.connect(f'file:{perfmetrics_file}?mode=ro', uri=True, timeout=30)
+            try:
+                metrics = {row[0]: row[1:] for row in
+                           connection.execute('SELECT jobid, qtime, runtime, slots FROM metrics')}
+            finally:
+                connection.close()
+
+        missing = [str(jobid) for jobid, _, _, _ in jobs if str(jobid) not in metrics]
+        if self.accounting is not None and missing:
+            metrics.update({jobid: (values['qtime'], values['runtime'], values['slots'])
+                            for jobid, values in self.accounting.query(missing).items()})
+
+        for jobid, taskname, duration, cores in jobs:
+            qtime, runtime, slots = metrics.get(str(jobid), (None, None, None))
+            runtime = duration if duration else runtime
+            if runtime is not None:
+                self.runtimes[taskname].append(float(runtime))
+                if cores:
+                    self.samples[taskname].append((int(cores), float(runtime)))
+            if qtime is not None:
+                self.qtimes[taskname].append(float(qtime))
+            slots = slots if slots else cores
+            if slots:
+                self.slots[taskname].append(int(slots))
+
+        for values in list(self.runtimes.values()) + list(self.qtimes.values()):
+            values.sort()
+
+    def runtime(self, task: str, stat: str = 'median') -> Optional[float]:
+        """Run time of a task, None if it never ran"""
+        values = self.runtimes.get(task)
+        return _percentile(values, STATS[stat]) if values else None
+
+    def qtime(self, task: str, stat: str = 'median') -> Optional[float]:
+        """Queue wait of a task, None if it is not known"""
+        values = self.qtimes.get(task)
+        return _percentile(values, STATS[stat]) if values else None
+
+
+class CriticalPath:
+    """
+    Schedule the cycles of a workflow and find their critical path
+
+    Parameters
+    ----------
+    graph : WorkflowGraph
+    history : TaskHistory
+    stat : str
+        Statistic of the past durations used ('median' or 'p90')
+    producers : List[tuple]
+        Tasks writing the files of data dependencies (default: DATA_PRODUCERS)
+
+    Tasks that never ran are given their walltime and no queue wait.
+    """
+
+    def __init__(self, graph: WorkflowGraph, history: TaskHistory, stat: str = 'median',
+                 producers: Optional[List[tuple]] = None) -> None:
+        if stat not in STATS:
+            raise ValueError(f'FATAL ERROR: unknown statistic "{stat}", valid ones are: {", ".join(STATS)}')
+        self.graph = graph
+        self.history = history
+        self.stat = stat
+        self.producers = [(re.compile(pattern), names) for pattern, names in
+                          (DATA_PRODUCERS if producers is None else producers)]
+
+    def durations(self, task: str) -> Tuple[float, float]:
+        """Queue wait and run time of a task"""
+        runtime = self.history.runtime(task, self.stat)
+        if runtime is None:
+            walltime = self.graph.tasks[task].walltime
+            runtime = walltime.total_seconds() if walltime else 0.
+        qtime = self.history.qtime(task, self.stat)
+        return (qtime or 0.), runtime
+
+    def _producer(self, expression: tuple, cycle: datetime) -> Optional[tuple]:
+        """The (task, cycle) node writing the file of a data dependency, None if it is not known"""
+        target = cycle + expression[2]
+        for pattern, names in self.producers:
+            match = pattern.search(expression[1])
+            if match:
+                for name in names:
+                    name = match.expand(name)
+                    if self.graph.runs(name, target):
+                        return (name, target)
+        return None
+
+    def _dependency_nodes(self, expression: Optional[tuple], cycle: datetime) -> List[tuple]:
+        """The (task, cycle) nodes a dependency expression refers to, including the producers of data"""
+        if expression is None:
+            return []
+        kind = expression[0]
+        if kind == 'data':
+            producer = self._producer(expression, cycle)
+            return [producer] if producer else []
+        if kind in ['task', 'metatask']:
+            return self.graph.dependency_nodes(expression, cycle)
+        if kind in ['cycleexist', 'time', 'other']:
+            return []
+        return [node for child in expression[1] for node in self._dependency_nodes(child, cycle)]
+
+    def _evaluate(self, expression: tuple, cycle: datetime, timings: Dict, first_cycle: datetime,
+                  clock) -> Tuple[float, Optional[tuple]]:
+        """Time at which a dependency is satisfied and the node it waits for last"""
+
+        kind = expression[0]
+        if kind == 'task':
+            node = (expression[1], cycle + expression[2])
+            if node in timings:
+                return timings[node]['finish'], node
+            if node[1] < first_cycle and self.graph.runs(*node):
+                return -INF, None
+            return INF, None
+        if kind == 'metatask':
+            target = cycle + expression[2]
+            children = [('task', name, expression[2]) for name in self.graph.metatasks.get(expression[1], [])
+                        if self.graph.runs(name, target)]
+            if not children:
+                return INF, None
+            return self._evaluate(('and', children), cycle, timings, first_cycle, clock)
+        if kind == 'cycleexist':
+            return (-INF if self.graph.cycle_exists(cycle + expression[1]) else INF), None
+        if kind == 'time':
+            return (clock(cycle + expression[1]) if self.graph.realtime else -INF), None
+        if kind == 'data':
+            node = self._producer(expression, cycle)
+            if node in timings:
+                return timings[node]['finish'], node
+            if node is None or node[1] < first_cycle:
+                return -INF, None
+            return INF, None
+        if kind == 'other':
+            return -INF, None
+
+        results = [self._evaluate(child, cycle, timings, first_cycle, clock) for child in expression[1]]
+        if kind == 'and':
+            return max(results, key=lambda result: result[0], default=(-INF, None))
+        if kind in ['or', 'xor', 'some']:
+            return min(results, key=lambda result: result[0], default=(-INF, None))
+        if kind == 'nand':
+            satisfied = max([result[0] for result in results], default=-INF)
+        elif kind == 'nor':
+            satisfied = min([result[0] for result in results], default=-INF)
+        else:
+            satisfied = results[0][0]
+        # 'not': only the dependencies that are never or always satisfied are modelled
+        return (-INF if satisfied == INF else INF if satisfied == -INF else -INF), None
+
+    def _order(self, cycle: datetime, tasks: List[str]) -> List[str]:
+        """Tasks of a cycle in dependency order (document order otherwise)"""
+
+        names = set(tasks)
+        predecessors = {name: {node[0] for node in self._dependency_nodes(self.graph.tasks[name].dependency, cycle)
+                               if node[1] == cycle and node[0] in names and node[0] != name}
+                        for name in tasks}
+        ordered = []
+        done = set()
+        while len(ordered) < len(tasks):
+            ready = [name for name in tasks if name not in done and predecessors[name] <= done]
+            if not ready:
+                # Circular dependencies never start; keep them in document order
+                ready = [name for name in tasks if name not in done]
+            for name in ready:
+                ordered.append(name)
+                done.add(name)
+        return ordered
+
+    def schedule(self, cycles: List[datetime], start: float = 0., fixed: Optional[Dict[tuple, float]] = None,
+                 active: bool = False) -> Dict[tuple, Dict]:
+        """
+        Schedule the tasks of consecutive cycles
+
+        Parameters
+        ----------
+        cycles : List[datetime]
+            Cycles to schedule, in order; the tasks of earlier cycles are
+            assumed to be complete
+        start : float
+            Time at which the first cycle is activated
+        fixed : Dict[tuple, float]
+            Finish times of (task, cycle) nodes that are already known
+        active : bool
+            Whether all the cycles are already active (activated at `start`)
+
+        Returns
+        -------
+        Dict[tuple, Dict]
+            For each (task, cycle) node: its 'ready', 'start' and 'finish' times,
+            'binding', the node it waited for last (None if it waited for the
+            activation of its cycle), and 'order', its position in the schedule
+        """
+
+        fixed = fixed or dict()
+        cycles = sorted(cycles)
+        first_cycle = cycles[0]
+
+        def clock(cycle):
+            return start + (cycle - first_cycle).total_seconds()
+
+        timings = dict()
+        completions = []
+        for index, cycle in enumerate(cycles):
+            activation = start
+            if not active:
+                if self.graph.realtime:
+                    activation = max(activation, clock(cycle))
+                throttle = max(1, self.graph.cyclethrottle)
+                if index >= throttle:
+                    activation = max(activation, completions[index - throttle])
+
+            finish_times = []
+            for name in self._order(cycle, self.graph.tasks_at(cycle)):
+                node = (name, cycle)
+                if node in fixed:
+                    timings[node] = {'ready': None, 'start': None, 'finish': fixed[node],
+                                     'binding': None, 'order': len(timings)}
+                else:
+                    dependency = self.graph.tasks[name].dependency
+                    satisfied, binding = (-INF, None) if dependency is None else \
+                        self._evaluate(dependency, cycle, timings, first_cycle, clock)
+                    if satisfied <= activation:
+                        satisfied, binding = activation, None
+                    qtime, runtime = self.durations(name)
+                    timings[node] = {'ready': satisfied, 'start': satisfied + qtime,
+                                     'finish': satisfied + qtime + runtime, 'binding': binding, 'order': len(timings)}
+                if timings[node]['finish'] < INF:
+                    finish_times.append(timings[node]['finish'])
+            completions.append(max(finish_times, default=activation))
+
+        return timings
+
+    @staticmethod
+    def completion(timings: Dict[tuple, Dict], cycle: datetime) -> float:
+        """Time at which the last task of a cycle that can run finishes"""
+        return max([timing['finish'] for node, timing in timings.items() if node[1] == cycle and timing['finish'] < INF],
+                   default=-INF)
+
+    @staticmethod
+    def activation(timings: Dict[tuple, Dict], cycle: datetime) -> float:
+        """Time at which the first task of a cycle became ready"""
+        return min([timing['ready'] for node, timing in timings.items()
+                    if node[1] == cycle and timing['ready'] is not None], default=INF)
+
+    def critical_path(self, timings: Dict[tuple, Dict], cycle: datetime) -> List[tuple]:
+        """
+        The chain of (task, cycle) nodes that ends with the last task of a cycle
+
+        Each node is the one its successor waited for last; the chain follows
+        the cycle offsets into earlier cycles and ends at a node that only
+        waited for the activation of its cycle.
+        """
+        nodes = [node for node, timing in timings.items() if node[1] == cycle and timing['finish'] < INF]
+        if not nodes:
+            return []
+        node = max(nodes, key=lambda node: (timings[node]['finish'], timings[node]['order']))
+        path = [node]
+        while timings[node]['binding'] is not None and timings[node]['binding'] in timings:
+            node = timings[node]['binding']
+            path.append(node)
+        return path[::-1]
+
+    def _constraining(self, expression: tuple, cycle: datetime, timings: Dict) -> List[tuple]:
+        """Nodes whose finish delays a dependency ('or' only waits for its first child)"""
+        kind = expression[0]
+        if kind in ['task', 'metatask', 'data']:
+            return [node for node in self._dependency_nodes(expression, cycle) if node in timings]
+        if kind == 'and':
+            return [node for child in expression[1] for node in self._constraining(child, cycle, timings)]
+        if kind in ['or', 'xor', 'some'] and expression[1]:
+            first_cycle = min(node[1] for node in timings)
+            satisfied = [self._evaluate(child, cycle, timings, first_cycle, lambda cycle: -INF)[0]
+                         for child in expression[1]]
+            return self._constraining(expression[1][satisfied.index(min(satisfied))], cycle, timings)
+        return []
+
+    def slack(self, timings: Dict[tuple, Dict], cycle: datetime) -> Dict[str, float]:
+        """
+        Slack of the tasks of a cycle: how much each can be delayed without
+        delaying the completion of the cycle
+        """
+
+        nodes = [node for node, timing in timings.items() if node[1] == cycle and timing['finish'] < INF]
+        end = self.completion(timings, cycle)
+        latest = {node: end for node in nodes}
+        for node in sorted(nodes, key=lambda node: timings[node]['order'], reverse=True):
+            dependency = self.graph.tasks[node[0]].dependency
+            if dependency is None or timings[node]['ready'] is None:
+                continue
+            qtime, runtime = self.durations(node[0])
+            latest_ready = latest[node] - qtime - runtime
+            for predecessor in self._constraining(dependency, cycle, timings):
+                if predecessor in latest:
+                    latest[predecessor] = min(latest[predecessor], latest_ready)
+
+        return {node[0]: latest[node] - timings[node]['finish'] for node in nodes}
+
+    def estimate(self, database_file: str, now: Optional[float] = None) -> Dict[datetime, float]:
+        """
+        Estimated completion time (seconds since the epoch) of the active cycles of a run
+
+        The tasks that succeeded are complete, the running ones finish after
+        their run time (less the time they have run, if rocoto_viewer recorded
+        it), the queued ones after their queue wait and run time, and those
+        not submitted yet are scheduled from now.  A cycle with a DEAD task
+        never completes (infinite time).
+        """
+
+        now = time.time() if now is None else now
+
+        connection = sqlite3.connect(f'file:{database_file}?mode=ro', uri=True, timeout=30)
+        try:
+            connection.execute('BEGIN')
+            cycles = [row[0] for row in connection.execute('SELECT cycle FROM cycles WHERE done = 0 AND expired = 0')]
+            jobs = connection.execute('SELECT jobid, taskname, cycle, state FROM jobs WHERE cycle IN '
+                                      '(SELECT cycle FROM cycles WHERE done = 0 AND expired = 0)').fetchall()
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+        if not cycles:
+            return dict()
+
+        metrics = dict()
+        perfmetrics_file = TaskHistory.get_perfmetrics_path(database_file)
+        if os.path.exists(perfmetrics_file):
+            connection = sqlite3.connect(f'file:{perfmetrics_file}?mode=ro', uri=True, timeout=30)
+            try:
+                metrics = {row[0]: row[1:] for row in connection.execute('SELECT jobid, qtime, runtime FROM metrics')}
+            finally:
+                connection.close()
+
+        def to_datetime(seconds):
+            return datetime.fromtimestamp(seconds, tz=timezone.utc).replace(tzinfo=None)
+
+        fixed = dict()
+        for jobid, taskname, cycle, state in jobs:
+            if taskname not in self.graph.tasks:
+                continue
+            qtime, runtime = self.durations(taskname)
+            waited, elapsed = metrics.get(str(jobid), (None, None))
+            if state == 'SUCCEEDED':
+                finish = -INF
+            elif state == 'DEAD':
+                finish = INF
+            elif state == 'RUNNING':
+                finish = now + max(0., runtime - (elapsed or 0.))
+            elif state in ['QUEUED', 'SUBMITTING']:
+                finish = now + max(0., qtime - (waited or 0.)) + runtime
+            else:
+                # FAILED, LOST, UNKNOWN, ... will be resubmitted
+                finish = now + qtime + runtime
+            fixed[(taskname, to_datetime(cycle))] = finish
+
+        cycles = [to_datetime(cycle) for cycle in cycles]
+        timings = self.schedule(cycles, start=now, fixed=fixed, active=True)
+
+        dead = {(taskname, to_datetime(cycle)) for jobid, taskname, cycle, state in jobs if state == 'DEAD'}
+        estimates = dict()
+        for cycle in cycles:
+            if any(node[1] == cycle for node in dead):
+                estimates[cycle] = INF
+            else:
+                estimates[cycle] = max(now, self.completion(timings, cycle))
+        return estimates
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+import heapq
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Iterable, Iterator, Optional, Union
+
+'''
+    MODULE:
+        cycledef.py
+
+    ABOUT:
+        Rocoto <cycledef>s and time intervals, shared by the workflow graph,
+        the workflow state and rocoto_viewer.  The cycles of a cycledef are
+        computed from its start, end and increment: membership is checked
+        without enumerating them, and they are only enumerated when iterated
+        over.
+'''
+
+__all__ = ['rocoto_timedelta', 'CycleDef', 'CycleDefGroup']
+
+
+def rocoto_timedelta(string: str) -> timedelta:
+    """
+    Convert a Rocoto time interval ([-][[[dd:]hh:]mm:]ss) to a timedelta
+
+    Note this is not wxflow.to_timedelta: Rocoto reads "00:30" as 30 seconds
+    and "1:00:00:00" as a day.
+    """
+    string = string.strip()
+    sign = -1 if string.startswith('-') else 1
+    fields = [int(field) for field in string.lstrip('+-').split(':')]
+    units = [86400, 3600, 60, 1][-len(fields):]
+    return sign * timedelta(seconds=sum(field * unit for field, unit in zip(fields, units)))
+
+
+@lru_cache(maxsize=65536)
+def _to_datetime(cycle_string: str) -> datetime:
+    return datetime.strptime(cycle_string, '%Y%m%d%H%M')
+
+
+class CycleDef:
+    """
+    A <cycledef> running every increment from start to end
+
+    The increment is either a timedelta or a whole number of months (which
+    requires dateutil).  Cycles are datetimes; membership is also checked for
+    'YYYYmmddHHMM' cycle strings.
+    """
+
+    def __init__(self, start: datetime, end: datetime, increment: Union[timedelta, int]) -> None:
+        if increment <= (timedelta(0) if isinstance(increment, timedelta) else 0):
+            raise ValueError(f'FATAL ERROR: the increment of a cycledef must be positive, not {increment}')
+        self.start = start
+        self.end = end
+        self.increment = increment
+
+    @classmethod
+    def from_string(cls, text: str) -> 'CycleDef':
+        """CycleDef of the text of a <cycledef> of the form 'start end increment'"""
+        fields = (text or '').split()
+        if len(fields) != 3:
+            raise ValueError(f'FATAL ERROR: unsupported cycledef "{text}", only "start end increment" is')
+        start, end = [_to_datetime(field) for field in fields[:2]]
+        return cls(start, end, rocoto_timedelta(fields[2]))
+
+    def __repr__(self) -> str:
+        return f'CycleDef({self.start!r}, {self.end!r}, {self.increment!r})'
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, CycleDef) and \
+            (self.start, self.end, self.increment) == (other.start, other.end, other.increment)
+
+    def __hash__(self) -> int:
+        return hash((self.start, self.end, self.increment))
+
+    def _add_months(self, months: int) -> datetime:
+        try:
+            from dateutil.relativedelta import relativedelta
+        except ImportError:
+            raise ModuleNotFoundError('FATAL ERROR: cycle increments measured in months require dateutil, '
+                                      'install it with "pip install python-dateutil --user"')
+        return self.start + relativedelta(months=+months)
+
+    def __contains__(self, cycle: Union[datetime, str]) -> bool:
+        if not isinstance(cycle, datetime):
+            try:
+                cycle = _to_datetime(cycle)
+            except (TypeError, ValueError):
+                return False
+        if cycle < self.start or cycle > self.end:
+            return False
+        if isinstance(self.increment, timedelta):
+            return (cycle - self.start) % self.increment == timedelta(0)
+        months = (cycle.year - self.start.year) * 12 + cycle.month - self.start.month
+        return months % self.increment == 0 and self._add_months(months) == cycle
+
+    def __iter__(self) -> Iterator[datetime]:
+        cycle = self.start
+        months = 0
+        while cycle <= self.end:
+            yield cycle
+            if isinstance(self.increment, timedelta):
+                cycle = cycle + self.increment
+            else:
+                months += self.increment
+                cycle = self._add_months(months)
+
+
+class CycleDefGroup:
+    """
+    All the <cycledef>s of a cycledef group (or of a task)
+    """
+
+    def __init__(self, cycledefs: Optional[Iterable[CycleDef]] = None) -> None:
+        self.cycledefs = list(cycledefs or [])
+
+    def __repr__(self) -> str:
+        return f'CycleDefGroup({self.cycledefs!r})'
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, CycleDefGroup) and self.cycledefs == other.cycledefs
+
+    def __hash__(self) -> int:
+        return hash(tuple(self.cycledefs))
+
+    def append(self, cycledef: CycleDef) -> None:
+        self.cycledefs.append(cycledef)
+
+    def extend(self, cycledefs: Iterable[CycleDef]) -> None:
+        self.cycledefs.extend(cycledefs)
+
+    def __len__(self) -> int:
+        return len(self.cycledefs)
+
+    def __contains__(self, cycle: Union[datetime, str]) -> bool:
+        return any(cycle in cycledef for cycledef in self.cycledefs)
+
+    def __iter__(self) -> Iterator[datetime]:
+        """Cycles of all the cycledefs in order, without duplicates"""
+        previous = None
+        for cycle in heapq.merge(*[iter(cycledef) for cycledef in self.cycledefs]):
+            if cycle != previous:
+                yield cycle
+            previous = cycle
@@ -1023,28 +1023,37 @@ class GFSTasks(Tasks):
         if upp_run not in VALID_UPP_RUN:
             raise KeyError(f"{upp_run} is invalid; UPP_RUN options are: {('|').join(VALID_UPP_RUN)}")
 
+        fhrs = self._get_forecast_hours(self.run, self._configs['upp'])
+        fhr_meta = self._get_fhr_metatask(fhrs, self._configs['upp'].get('NFHRS_PER_GROUP', 1))
+
         postenvars = self.envars.copy()
-        postenvar_dict = {'FHR3': '#fhr#',
+        postenvar_dict = {**fhr_meta['envars'],
                           'UPP_RUN': upp_run}
+        if len(fhr_meta['fhrs']) > 1:
+            # Keep a log per forecast hour
+            postenvar_dict['FHR_LOG_PREFIX'] = f'{self.rotdir}/logs/<cyclestr>@Y@m@d@H</cyclestr>/{self.run}{task_id}_'
         for key, value in postenvar_dict.items():
             postenvars.append(rocoto.create_envar(name=key, value=str(value)))
 
         atm_hist_path = self._template_to_rocoto_cycstring(self._base["COM_ATMOS_HISTORY_TMPL"])
         deps = []
-        data = f'{atm_hist_path}/{self.run}.t@Hz.atmf#fhr#.nc'
-        dep_dict = {'type': 'data', 'data': data, 'age': 120}
-        deps.append(rocoto.add_dependency(dep_dict))
-        data = f'{atm_hist_path}/{self.run}.t@Hz.sfcf#fhr#.nc'
-        dep_dict = {'type': 'data', 'data': data, 'age': 120}
-        deps.append(rocoto.add_dependency(dep_dict))
-        data = f'{atm_hist_path}/{self.run}.t@Hz.atm.logf#fhr#.txt'
-        dep_dict = {'type': 'data', 'data': data, 'age': 60}
-        deps.append(rocoto.add_dependency(dep_dict))
+        for fhr in fhr_meta['fhrs']:
+            data = f'{atm_hist_path}/{self.run}.t@Hz.atmf{fhr}.nc'
+            dep_dict = {'type': 'data', 'data': data, 'age': 120}
+            deps.append(rocoto.add_dependency(dep_dict))
+            data = f'{atm_hist_path}/{self.run}.t@Hz.sfcf{fhr}.nc'
+            dep_dict = {'type': 'data', 'data': data, 'age': 120}
+            deps.append(rocoto.add_dependency(dep_dict))
+            data = f'{atm_hist_path}/{self.run}.t@Hz.atm.logf{fhr}.txt'
+            dep_dict = {'type': 'data', 'data': data, 'age': 60}
+            deps.append(rocoto.add_dependency(dep_dict))
         dependencies = rocoto.create_dependency(dep=deps, dep_condition='and')
         cycledef = 'gdas_half,gdas' if self.run in ['gdas'] else self.run
         resources = self.get_resource('upp')
+        if len(fhr_meta['fhrs']) > 1:
+            resources['walltime'] = self._scale_walltime(resources['walltime'], len(fhr_meta['fhrs']))
 
-        task_name = f'{self.run}{task_id}_f#fhr#'
+        task_name = f'{self.run}{task_id}_{fhr_meta["label"]}'
         task_dict = {'task_name': task_name,
                      'resources': resources,
                      'dependency': dependencies,
@@ -1056,12 +1065,9 @@ class GFSTasks(Tasks):
                      'maxtries': '&MAXTRIES;'
                      }
 
-        fhrs = self._get_forecast_hours(self.run, self._configs['upp'])
-        fhr_var_dict = {'fhr': ' '.join([f"{fhr:03d}" for fhr in fhrs])}
-
         metatask_dict = {'task_name': f'{self.run}{task_id}',
                          'task_dict': task_dict,
-                         'var_dict': fhr_var_dict
+                         'var_dict': fhr_meta['var_dict']
                          }
 
         task = rocoto.create_task(metatask_dict)
@@ -1094,28 +1100,44 @@ class GFSTasks(Tasks):
         history_path_tmpl = component_dict['history_path_tmpl']
         history_file_tmpl = component_dict['history_file_tmpl']
 
+        fhrs = self._get_forecast_hours(self.run, self._configs[config], component)
+
+        # ocean/ice components do not have fhr 0 as they are averaged output
+        if component in ['ocean', 'ice'] and 0 in fhrs:
+            fhrs.remove(0)
+
+        fhr_meta = self._get_fhr_metatask(fhrs, self._configs[config].get('NFHRS_PER_GROUP', 1))
+
         postenvars = self.envars.copy()
-        postenvar_dict = {'FHR3': '#fhr#', 'COMPONENT': component}
+        postenvar_dict = {**fhr_meta['envars'], 'COMPONENT': component}
+        if len(fhr_meta['fhrs']) > 1:
+            # Keep a log per forecast hour
+            postenvar_dict['FHR_LOG_PREFIX'] = f'{self.rotdir}/logs/<cyclestr>@Y@m@d@H</cyclestr>/{self.run}{component}_prod_'
         for key, value in postenvar_dict.items():
             postenvars.append(rocoto.create_envar(name=key, value=str(value)))
 
         history_path = self._template_to_rocoto_cycstring(self._base[history_path_tmpl])
         deps = []
-        data = f'{history_path}/{history_file_tmpl}'
-        dep_dict = {'type': 'data', 'data': data, 'age': 120}
-        deps.append(rocoto.add_dependency(dep_dict))
-        if component in ['ocean']:
-            command = f"{self.HOMEgfs}/ush/check_netcdf.sh {history_path}/{history_file_tmpl}"
-            dep_dict = {'type': 'sh', 'command': command}
+        for fhr in fhr_meta['fhrs']:
+            history_file = history_file_tmpl.replace('#fhr#', fhr)
+            data = f'{history_path}/{history_file}'
+            dep_dict = {'type': 'data', 'data': data, 'age': 120}
             deps.append(rocoto.add_dependency(dep_dict))
+            if component in ['ocean']:
+                command = f"{self.HOMEgfs}/ush/check_netcdf.sh {history_path}/{history_file}"
+                dep_dict = {'type': 'sh', 'command': command}
+                deps.append(rocoto.add_dependency(dep_dict))
+        if len(deps) > 1:
             dependencies = rocoto.create_dependency(dep=deps, dep_condition='and')
         else:
             dependencies = rocoto.create_dependency(dep=deps)
 
         cycledef = 'gdas_half,gdas' if self.run in ['gdas'] else self.run
         resources = self.get_resource(component_dict['config'])
+        if len(fhr_meta['fhrs']) > 1:
+            resources['walltime'] = self._scale_walltime(resources['walltime'], len(fhr_meta['fhrs']))
 
-        task_name = f'{self.run}{component}_prod_f#fhr#'
+        task_name = f'{self.run}{component}_prod_{fhr_meta["label"]}'
         task_dict = {'task_name': task_name,
                      'resources': resources,
                      'dependency': dependencies,
@@ -1127,16 +1149,9 @@ class GFSTasks(Tasks):
                      'maxtries': '&MAXTRIES;'
                      }
 
-        fhrs = self._get_forecast_hours(self.run, self._configs[config], component)
-
-        # ocean/ice components do not have fhr 0 as they are averaged output
-        if component in ['ocean', 'ice'] and 0 in fhrs:
-            fhrs.remove(0)
-
-        fhr_var_dict = {'fhr': ' '.join([f"{fhr:03d}" for fhr in fhrs])}
         metatask_dict = {'task_name': f'{self.run}{component}_prod',
                          'task_dict': task_dict,
-                         'var_dict': fhr_var_dict
+                         'var_dict': fhr_meta['var_dict']
                          }
 
         task = rocoto.create_task(metatask_dict)
@@ -1457,8 +1472,25 @@ class GFSTasks(Tasks):
 
     def gempak(self):
 
+        fhrs = self._get_forecast_hours(self.run, self._configs['gempak'])
+        fhr_var_dict = {'fhr': ' '.join([f"{fhr:03d}" for fhr in fhrs])}
+
+        # The atmos_prod task that makes the products of each forecast hour
+        prod_label = 'f#fhr#'
+        prod_group_size = int(self._configs['atmos_products'].get('NFHRS_PER_GROUP', 1))
+        if prod_group_size > 1:
+            prod_groups = self._get_fhr_groups(self._get_forecast_hours(self.run, self._configs['atmos_products']),
+                                               prod_group_size)
+            prod_group_of = {fhr: self._get_fhr_group_label(group) for group in prod_groups for fhr in group}
+            missing = [f'{fhr:03d}' for fhr in fhrs if fhr not in prod_group_of]
+            if missing:
+                raise ValueError(f'The gempak forecast hours {", ".join(missing)} are not processed by '
+                                 f'any {self.run}atmos_prod task')
+            fhr_var_dict['prodgrp'] = ' '.join([prod_group_of[fhr] for fhr in fhrs])
+            prod_label = '#prodgrp#'
+
         deps = []
-        dep_dict = {'type': 'task', 'name': f'{self.run}atmos_prod_f#fhr#'}
+        dep_dict = {'type': 'task', 'name': f'{self.run}atmos_prod_{prod_label}'}
         deps.append(rocoto.add_dependency(dep_dict))
         dependencies = rocoto.create_dependency(dep=deps)
 
@@ -1480,9 +1512,6 @@ class GFSTasks(Tasks):
                      'maxtries': '&MAXTRIES;'
                      }
 
-        fhrs = self._get_forecast_hours(self.run, self._configs['gempak'])
-        fhr_var_dict = {'fhr': ' '.join([f"{fhr:03d}" for fhr in fhrs])}
-
         fhr_metatask_dict = {'task_name': f'{self.run}gempak',
                              'task_dict': task_dict,
                              'var_dict': fhr_var_dict}
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+
+import math
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from applications.application_factory import app_config_factory
+from rocoto.critical_path import STATS, TaskHistory, _percentile
+from rocoto.simulator import fit_scaling
+from rocoto.cycledef import rocoto_timedelta
+from rocoto.workflow_graph import WorkflowGraph
+from wxflow import Configuration
+
+'''
+    MODULE:
+        resource_recommender.py
+
+    ABOUT:
+        Recommend the ntasks, tasks_per_node and threads_per_task of the
+        steps of config.resources from the run times measured in past
+        experiments.
+
+        The jobs of the Rocoto database of each experiment (with the metrics
+        rocoto_viewer kept, or that the scheduler accounting returns) are
+        attributed to the config.resources step, the RUN and the resolution
+        they ran with.  Their run times are fitted with Amdahl's law on the
+        number of cpus (ranks x threads), and the layout that uses the least
+        node-hours while finishing within a target (a fraction of the
+        walltime, or a latency including the queue wait) is proposed.
+
+        Layouts are only searched within `max_scale` of the number of cpus
+        the step was measured with, and with no more cores per node than the
+        current layout uses (tasks_per_node below the maximum is usually set
+        for memory).  The ntasks of the steps of FIXED_LAYOUT follow the
+        decomposition of the model or of the data and are not changed.
+'''
+
+__all__ = ['FIXED_LAYOUT', 'Experiment', 'TaskScaling', 'Recommendation', 'collect_scaling', 'recommend']
+
+# Steps whose ntasks follow the decomposition of the model (layouts, write
+# groups) or of the data (analcalc: one rank per level)
+FIXED_LAYOUT = ['fcst', 'efcs', 'analcalc']
+
+# config.resources steps of the tasks not named <RUN><step>[_f###|_f###-f###|_mem###|###]
+RESOURCE_STEPS = {'atmos_prod': 'atmos_products',
+                  'ocean_prod': 'oceanice_products',
+                  'ice_prod': 'oceanice_products',
+                  'atmupp': 'upp',
+                  'goesupp': 'upp',
+                  'atmanlupp': 'upp'}
+ENKF_RESOURCE_STEPS = {'fcst': 'efcs'}
+
+
+class Experiment:
+    """
+    Configs of an experiment directory, and the paths of its workflow and database
+
+    Parameters
+    ----------
+    expdir : str
+        Experiment directory
+    """
+
+    _suffix = re.compile(r'(_f\d+(-f\d+)?|_mem\d+|\d+)$')
+
+    def __init__(self, expdir: str) -> None:
+
+        self.expdir = expdir
+        cfg = Configuration(expdir)
+        base = cfg.parse_config('config.base')
+        self.app_config = app_config_factory.create(f'{base["NET"]}_{base["MODE"]}', cfg)
+        self.configs = {run: self.app_config.source_configs(run=run, log=False)
+                        for run in self.app_config.task_names}
+        self.workflow_file = os.path.join(expdir, f'{base["PSLOT"]}.xml')
+        self.database_file = os.path.join(expdir, f'{base["PSLOT"]}.db')
+
+    def step_of(self, task: str) -> Optional[Tuple[str, str]]:
+        """RUN and config.resources step of a Rocoto task, None if it is not known"""
+        for run in sorted(self.configs, key=len, reverse=True):
+            if task.startswith(run):
+                name = self._suffix.sub('', task[len(run):])
+                step = (ENKF_RESOURCE_STEPS if run.startswith('enkf') else dict()).get(name, name)
+                step = RESOURCE_STEPS.get(step, step)
+                if step in self.configs[run]:
+                    return run, step
+        return None
+
+    def resolution(self, run: str, step: str) -> str:
+        config = self.configs[run][step]
+        return str(config['CASE_ENS'] if run.startswith('enkf') else config['CASE'])
+
+    def layout(self, run: str, step: str) -> Dict[str, Any]:
+        """ntasks, tasks_per_node, threads_per_task, max_tasks_per_node and walltime (seconds) of a step"""
+        config = self.configs[run][step]
+        return {'ntasks': int(config['ntasks']),
+                'tasks_per_node': int(config.get('tasks_per_node', config['ntasks'])),
+                'threads_per_task': int(config.get('threads_per_task', 1)),
+                'max_tasks_per_node': int(config['max_tasks_per_node']),
+                'walltime': rocoto_timedelta(str(config['walltime'])).total_seconds()}
+
+
+class TaskScaling:
+    """
+    Run times of a config.resources step of a RUN at a resolution
+
+    Attributes
+    ----------
+    samples : List[Tuple[int, int, float]]
+        Ranks, threads per rank and run time of each job
+    qtimes : List[float]
+        Queue waits of the jobs
+    tasks, experiments : set
+        Rocoto tasks and experiment directories the jobs come from
+    """
+
+    def __init__(self, run: str, step: str, resolution: str) -> None:
+        self.run = run
+        self.step = step
+        self.resolution = resolution
+        self.samples = []
+        self.qtimes = []
+        self.tasks = set()
+        self.experiments = set()
+
+    def points(self, stat: str = 'median') -> List[Tuple[int, float]]:
+        """The `stat` run time at each number of cpus"""
+        runtimes = dict()
+        for ranks, threads, runtime in self.samples:
+            runtimes.setdefault(ranks * threads, []).append(runtime)
+        return [(cpus, _percentile(sorted(values), STATS[stat])) for cpus, values in sorted(runtimes.items())]
+
+    def fit(self, stat: str = 'median') -> Optional[Tuple[float, float]]:
+        """Serial and parallel parts of the run time, t = serial + parallel / cpus"""
+        return fit_scaling(self.points(stat))
+
+    def qtime(self, stat: str = 'median') -> float:
+        return _percentile(sorted(self.qtimes), STATS[stat]) if self.qtimes else 0.
+
+
+def collect_scaling(experiments: List[Experiment], accounting: Optional[Any] = None) -> Dict[tuple, TaskScaling]:
+    """
+    Gather the jobs of the experiments by (RUN, step, resolution)
+
+    The threads per rank of a task are read from the workflow document of its
+    experiment (the layout it ran with), or from its config if there is none.
+    The jobs that requested the nodes of the current layout are taken to have
+    run its ntasks ranks.
+
+    Parameters
+    ----------
+    experiments : List[Experiment]
+    accounting : SchedulerAccounting
+        Scheduler accounting queried for the jobs rocoto_viewer has no metrics of (optional)
+
+    Returns
+    -------
+    Dict[tuple, TaskScaling]
+    """
+
+    scaling = dict()
+    for experiment in experiments:
+        if not os.path.exists(experiment.database_file):
+            continue
+        history = TaskHistory([experiment.database_file], accounting)
+        graph = WorkflowGraph.from_file(experiment.workflow_file) if os.path.exists(experiment.workflow_file) else None
+
+        for task, samples in history.samples.items():
+            run_step = experiment.step_of(task)
+            if run_step is None:
+                continue
+            run, step = run_step
+            layout = experiment.layout(run, step)
+            requested = math.ceil(layout['ntasks'] / layout['tasks_per_node']) * layout['tasks_per_node']
+            if graph is not None and task in graph.tasks:
+                threads = graph.tasks[task].threads
+            else:
+                threads = layout['threads_per_task']
+            key = (run, step, experiment.resolution(run, step))
+            entry = scaling.setdefault(key, TaskScaling(*key))
+            # Rocoto records the cores of the nodes requested (nodes x ppn); the
+            # jobs that ran with the current layout launched its ntasks ranks
+            entry.samples.extend((min(cores, layout['ntasks']) if cores == requested else cores, threads, runtime)
+                                 for cores, runtime in samples)
+            entry.qtimes.extend(history.qtimes.get(task, []))
+            entry.tasks.add(task)
+            entry.experiments.add(experiment.expdir)
+
+    return scaling
+
+
+class Recommendation:
+    """
+    Current and proposed layout of a step
+
+    Attributes
+    ----------
+    current, proposed : Dict[str, Any]
+        ntasks, tasks_per_node, threads_per_task, and the predicted nodes,
+        runtime (seconds) and node_hours; proposed is None if the step is left alone
+    target : float
+        Run time to finish within (seconds)
+    note : str
+        Why the step is left alone or the target can not be met
+    """
+
+    def __init__(self, scaling: TaskScaling, fit: Optional[Tuple[float, float]], current: Dict[str, Any],
+                 proposed: Optional[Dict[str, Any]], target: float, note: str = '') -> None:
+        self.run = scaling.run
+        self.step = scaling.step
+        self.resolution = scaling.resolution
+        self.scaling = scaling
+        self.fit = fit
+        self.current = current
+        self.proposed = proposed
+        self.target = target
+        self.note = note
+
+    @property
+    def missed(self) -> bool:
+        """Whether the layout kept or proposed does not finish within the target"""
+        return self.proposed is not None and self.proposed['runtime'] > self.target
+
+    @property
+    def changed(self) -> bool:
+        keys = ['ntasks', 'tasks_per_node', 'threads_per_task']
+        return self.proposed is not None and [self.current[key] for key in keys] != [self.proposed[key] for key in keys]
+
+
+def _layout(ntasks: int, tasks_per_node: int, threads: int, fit: Tuple[float, float]) -> Dict[str, Any]:
+    nodes = math.ceil(ntasks / tasks_per_node)
+    runtime = fit[0] + fit[1] / (ntasks * threads)
+    return {'ntasks': ntasks, 'tasks_per_node': tasks_per_node, 'threads_per_task': threads,
+            'nodes': nodes, 'runtime': runtime, 'node_hours': nodes * runtime / 3600.}
+
+
+def recommend(scaling: Dict[tuple, TaskScaling], experiment: Experiment, stat: str = 'median',
+              margin: float = 0.8, latency: Optional[float] = None, max_scale: float = 2.) -> List[Recommendation]:
+    """
+    Recommend a layout for the steps of an experiment that were measured at its resolution
+
+    Parameters
+    ----------
+    scaling : Dict[tuple, TaskScaling]
+        Measured run times, from collect_scaling
+    experiment : Experiment
+        Experiment whose config.resources is compared
+    stat : str
+        Statistic of the past run times ('median' or 'p90')
+    margin : float
+        Fraction of the walltime a job must finish within
+    latency : float
+        Seconds a job must finish within, queue wait included (instead of the walltime margin)
+    max_scale : float
+        Largest factor between the cpus proposed and the cpus measured
+
+    Returns
+    -------
+    List[Recommendation]
+    """
+
+    if stat not in STATS:
+        raise ValueError(f'FATAL ERROR: unknown statistic "{stat}", valid ones are: {", ".join(STATS)}')
+
+    recommendations = []
+    for (run, step, resolution), entry in sorted(scaling.items()):
+        if run not in experiment.configs or step not in experiment.configs[run] or \
+                experiment.resolution(run, step) != resolution:
+            continue
+
+        layout = experiment.layout(run, step)
+        fit = entry.fit(stat)
+        current = _layout(layout['ntasks'], layout['tasks_per_node'], layout['threads_per_task'], fit)
+        target = latency - entry.qtime(stat) if latency is not None else margin * layout['walltime']
+
+        if step in FIXED_LAYOUT:
+            recommendations.append(Recommendation(entry, fit, current, None, target,
+                                                  'ntasks follow the decomposition of the model or the data'))
+            continue
+        if layout['ntasks'] * layout['threads_per_task'] == 1:
+            recommendations.append(Recommendation(entry, fit, current, None, target, 'serial'))
+            continue
+
+        cpus = [cpus for cpus, _ in entry.points(stat)]
+        low, high = min(cpus) / max_scale, max(cpus) * max_scale
+        cores_per_node = min(layout['max_tasks_per_node'], layout['tasks_per_node'] * layout['threads_per_task'])
+        threads_options = {layout['threads_per_task']} | {threads for _, threads, _ in entry.samples}
+
+        candidates = []
+        for threads in sorted(threads_options):
+            tasks_per_node = cores_per_node // threads
+            if tasks_per_node < 1:
+                continue
+            nodes = max(1, math.ceil(low / (tasks_per_node * threads)))
+            while nodes * tasks_per_node * threads <= high:
+                candidates.append(_layout(nodes * tasks_per_node, tasks_per_node, threads, fit))
+                nodes += 1
+
+        feasible = [candidate for candidate in candidates if candidate['runtime'] <= target]
+        note = ''
+        if feasible:
+            proposed = min(feasible, key=lambda candidate: (round(candidate['node_hours'], 6), candidate['nodes']))
+        else:
+            # Not worth more nodes: keep the current layout
+            proposed = dict(current)
+            note = 'the target can not be met within the measured scaling range'
+
+        if current['runtime'] <= target and proposed is not None and \
+                proposed['node_hours'] >= current['node_hours'] - 1e-9:
+            # The current layout is already as cheap
+            proposed = dict(current)
+        recommendations.append(Recommendation(entry, fit, current, proposed, target, note))
+
+    return recommendations
@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+
+import heapq
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from rocoto.critical_path import INF, STATS, CriticalPath, TaskHistory, _percentile
+from rocoto.workflow_graph import WorkflowGraph
+
+'''
+    MODULE:
+        simulator.py
+
+    ABOUT:
+        Discrete-event simulation of a cycled workflow on a cluster of a given
+        number of nodes, to predict its throughput before running it.
+
+        Rocoto is modelled as in rocotorun: every `poll` seconds it activates
+        the cycles allowed by the cycle throttle (and, for a realtime workflow,
+        by the wall clock) and submits the tasks whose dependencies are
+        satisfied, up to the task throttle.  The batch scheduler starts the
+        queued jobs as soon as enough nodes are free, following a queue policy:
+
+            fifo        jobs start in submission order; the first job that
+                        does not fit blocks the ones behind it
+            backfill    fifo, but a later job may start first if it does not
+                        delay the start of the first job (EASY backfilling,
+                        with the walltimes as the scheduler's estimates)
+            firstfit    any job that fits starts, in submission order
+
+        The run time of a job comes from a DurationModel fitted to the jobs of
+        past Rocoto databases, at the number of cores of the task, so the
+        layout of the tasks can differ from the one of the past runs.  The
+        nodes of the cluster are only used by the workflow, unless the queue
+        waits of the past runs are added to model the load of other users.
+'''
+
+__all__ = ['POLICIES', 'fit_scaling', 'DurationModel', 'SimulationResult', 'WorkflowSimulator']
+
+POLICIES = ['fifo', 'backfill', 'firstfit']
+
+
+def fit_scaling(points: List[Tuple[int, float]]) -> Optional[Tuple[float, float]]:
+    """
+    Fit run times at several numbers of cores with Amdahl's law
+
+    Parameters
+    ----------
+    points : List[Tuple[int, float]]
+        Number of cores and run time
+
+    Returns
+    -------
+    Tuple[float, float]
+        Serial and parallel parts (t = serial + parallel / cores), both
+        non-negative; ideal scaling for a single number of cores; None
+        without points
+    """
+
+    if not points:
+        return None
+    if len({cores for cores, _ in points}) == 1:
+        return 0., sum(runtime for _, runtime in points) / len(points) * points[0][0]
+
+    # Least squares of t = a + b x, with x = 1 / cores
+    xs = [1. / cores for cores, _ in points]
+    ts = [runtime for _, runtime in points]
+    x_mean, t_mean = sum(xs) / len(xs), sum(ts) / len(ts)
+    b = sum((x - x_mean) * (t - t_mean) for x, t in zip(xs, ts)) / sum((x - x_mean) ** 2 for x in xs)
+    a = t_mean - b * x_mean
+    if b < 0:
+        # Slower with more cores: no parallel speedup
+        return t_mean, 0.
+    if a < 0:
+        return 0., sum(x * t for x, t in zip(xs, ts)) / sum(x * x for x in xs)
+    return a, b
+
+
+class DurationModel:
+    """
+    Run time of a task as a function of its number of cores
+
+    The run times of past jobs are fitted with Amdahl's law,
+    t = serial + parallel / cores, on the `stat` run time at each number of
+    cores.  When a task only ran with one number of cores, it is assumed to
+    scale ideally (no serial part).
+
+    Parameters
+    ----------
+    history : TaskHistory
+    stat : str
+        Statistic of the past run times ('median' or 'p90')
+    """
+
+    def __init__(self, history: TaskHistory, stat: str = 'median') -> None:
+        if stat not in STATS:
+            raise ValueError(f'FATAL ERROR: unknown statistic "{stat}", valid ones are: {", ".join(STATS)}')
+        self.history = history
+        self.stat = stat
+        self._fits = dict()
+
+    def points(self, task: str) -> List[Tuple[int, float]]:
+        """The `stat` run time of a task at each number of cores it ran with"""
+        runtimes = defaultdict(list)
+        for cores, runtime in self.history.samples.get(task, []):
+            runtimes[cores].append(runtime)
+        return [(cores, _percentile(sorted(values), STATS[self.stat])) for cores, values in sorted(runtimes.items())]
+
+    def fit(self, task: str) -> Optional[Tuple[float, float]]:
+        """Serial and parallel parts of the run time of a task, None if it never ran"""
+
+        if task in self._fits:
+            return self._fits[task]
+
+        fit = fit_scaling(self.points(task))
+        self._fits[task] = fit
+        return fit
+
+    def runtime(self, task: str, cores: int) -> Optional[float]:
+        """Run time of a task on a number of cores, None if it never ran"""
+        fit = self.fit(task)
+        if fit is None:
+            return None
+        return fit[0] + fit[1] / max(1, cores)
+
+
+class SimulationResult:
+    """
+    Jobs and cycles of a simulation
+
+    Attributes
+    ----------
+    nodes : int
+        Nodes of the cluster
+    policy : str
+    jobs : List[Dict]
+        For each job: its 'node' (task, cycle), 'nodes', 'cores', 'runtime',
+        and the 'submitted', 'eligible' (after the queue wait of other users),
+        'start' and 'finish' times
+    cycles : Dict[datetime, Dict[str, float]]
+        'activated' and 'completed' times of each cycle (INF if not completed)
+    """
+
+    def __init__(self, nodes: int, policy: str, jobs: List[Dict], cycles: Dict[datetime, Dict[str, float]]) -> None:
+        self.nodes = nodes
+        self.policy = policy
+        self.jobs = jobs
+        self.cycles = cycles
+
+    @property
+    def makespan(self) -> float:
+        return max([job['finish'] for job in self.jobs], default=0.)
+
+    @property
+    def completed(self) -> List[datetime]:
+        return [cycle for cycle, times in self.cycles.items() if times['completed'] < INF]
+
+    @property
+    def cycles_per_day(self) -> float:
+        """Cycles completed per day, in the steady state (between the first and the last completion)"""
+        completions = sorted(self.cycles[cycle]['completed'] for cycle in self.completed)
+        if len(completions) > 1 and completions[-1] > completions[0]:
+            return (len(completions) - 1) * 86400. / (completions[-1] - completions[0])
+        return len(completions) * 86400. / self.makespan if self.makespan > 0 else 0.
+
+    @property
+    def utilization(self) -> float:
+        """Fraction of the node-hours of the cluster used by the jobs"""
+        if self.makespan <= 0:
+            return 0.
+        return sum(job['nodes'] * job['runtime'] for job in self.jobs) / (self.nodes * self.makespan)
+
+    @staticmethod
+    def _peak(intervals: List[Tuple[float, float, int]]) -> int:
+        events = sorted([(begin, nodes) for begin, _, nodes in intervals] +
+                        [(end, -nodes) for _, end, nodes in intervals])
+        peak = current = 0
+        for _, nodes in events:
+            current += nodes
+            peak = max(peak, current)
+        return peak
+
+    @property
+    def peak_demand(self) -> int:
+        """Largest number of nodes requested at the same time by the jobs queued or running"""
+        return self._peak([(job['eligible'], job['finish'], job['nodes']) for job in self.jobs])
+
+    @property
+    def peak_usage(self) -> int:
+        """Largest number of nodes used at the same time"""
+        return self._peak([(job['start'], job['finish'], job['nodes']) for job in self.jobs])
+
+    @property
+    def mean_queue_wait(self) -> float:
+        """Mean time the jobs waited for free nodes"""
+        if not self.jobs:
+            return 0.
+        return sum(job['start'] - job['eligible'] for job in self.jobs) / len(self.jobs)
+
+    @property
+    def mean_latency(self) -> float:
+        """Mean time from the activation of a cycle to its completion"""
+        latencies = [self.cycles[cycle]['completed'] - self.cycles[cycle]['activated'] for cycle in self.completed]
+        return sum(latencies) / len(latencies) if latencies else INF
+
+    def summary(self) -> Dict[str, float]:
+        return {'nodes': self.nodes,
+                'cycles completed': len(self.completed),
+                'cycles/day': self.cycles_per_day,
+                'node utilization': self.utilization,
+                'peak node demand': self.peak_demand,
+                'peak nodes in use': self.peak_usage,
+                'mean queue wait': self.mean_queue_wait,
+                'mean cycle latency': self.mean_latency,
+                'makespan': self.makespan}
+
+
+class WorkflowSimulator(CriticalPath):
+    """
+    Simulate the cycles of a workflow on a cluster
+
+    Parameters
+    ----------
+    graph : WorkflowGraph
+    history : TaskHistory
+    nodes : int
+        Nodes of the cluster
+    policy : str
+        Queue policy of the batch scheduler, one of POLICIES
+    stat : str
+        Statistic of the past durations used ('median' or 'p90')
+    poll : float
+        Seconds between two runs of rocotorun (0 to react to every event)
+    queue_wait : bool
+        Whether the jobs also wait the queue time of the past runs (the load of other users)
+
+    Tasks that never ran are given their walltime.
+    """
+
+    def __init__(self, graph: WorkflowGraph, history: TaskHistory, nodes: int, policy: str = 'backfill',
+                 stat: str = 'median', poll: float = 300., queue_wait: bool = False,
+                 producers: Optional[List[tuple]] = None) -> None:
+
+        super().__init__(graph, history, stat, producers)
+
+        if policy not in POLICIES:
+            raise ValueError(f'FATAL ERROR: unknown queue policy "{policy}", valid ones are: {", ".join(POLICIES)}')
+        too_large = [f'{task.name} ({task.nodes})' for task in graph.tasks.values() if task.nodes > nodes]
+        if too_large:
+            raise ValueError(f'FATAL ERROR: tasks need more than the {nodes} nodes of the cluster: {", ".join(too_large)}')
+
+        self.nodes = nodes
+        self.policy = policy
+        self.poll = max(0., poll)
+        self.queue_wait = queue_wait
+        self.model = DurationModel(history, stat)
+
+    def durations(self, task: str) -> Tuple[float, float]:
+        """Queue wait (of other users) and run time of a task with its cores"""
+        runtime = self.model.runtime(task, self.graph.tasks[task].cores)
+        if runtime is None:
+            walltime = self.graph.tasks[task].walltime
+            runtime = walltime.total_seconds() if walltime else 0.
+        qtime = self.history.qtime(task, self.stat) if self.queue_wait else None
+        return (qtime or 0.), runtime
+
+    def _limit(self, task: str, runtime: float) -> float:
+        """Run time the scheduler expects: the walltime requested"""
+        walltime = self.graph.tasks[task].walltime
+        return walltime.total_seconds() if walltime else runtime
+
+    def _dispatch(self, now: float, queue: List[Dict], running: List[Dict], free: int) -> List[Dict]:
+        """Jobs of the queue the scheduler starts now"""
+
+        started = []
+        blocked = None
+        for job in queue:
+            if job['nodes'] <= free and (blocked is None or self.policy == 'firstfit'):
+                started.append(job)
+                free -= job['nodes']
+            elif blocked is None:
+                blocked = job
+                if self.policy == 'fifo':
+                    break
+        if blocked is None or self.policy != 'backfill':
+            return started
+
+        # EASY backfilling: reserve the nodes of the first blocked job at the
+        # earliest time the running jobs free them (by their walltimes)
+        ends = sorted([(job['start'] + job['limit'], job['nodes']) for job in running] +
+                      [(now + job['limit'], job['nodes']) for job in started])
+        available, shadow = free, INF
+        for end, nodes in ends:
+            available += nodes
+            if available >= blocked['nodes']:
+                shadow = end
+                break
+        extra = available - blocked['nodes']
+
+        for job in queue[queue.index(blocked) + 1:]:
+            if job['nodes'] > free:
+                continue
+            if now + job['limit'] <= shadow:
+                started.append(job)
+                free -= job['nodes']
+            elif job['nodes'] <= extra:
+                started.append(job)
+                free -= job['nodes']
+                extra -= job['nodes']
+        return started
+
+    def simulate(self, cycles: List[datetime]) -> SimulationResult:
+        """
+        Simulate consecutive cycles of the workflow, from the activation of the first one
+
+        The tasks whose dependencies can never be satisfied (e.g. on cycles
+        before the first one) are left out.
+        """
+
+        cycles = sorted(cycles)
+        first_cycle = cycles[0]
+
+        def clock(cycle):
+            return (cycle - first_cycle).total_seconds()
+
+        runnable = {node for node, timing in self.schedule(cycles).items() if timing['finish'] < INF}
+        tasks = {cycle: [name for name in self._order(cycle, self.graph.tasks_at(cycle)) if (name, cycle) in runnable]
+                 for cycle in cycles}
+        remaining = {cycle: len(tasks[cycle]) for cycle in cycles}
+        throttle = max(1, self.graph.cyclethrottle)
+        taskthrottle = self.graph.taskthrottle or INF
+
+        times = {cycle: {'activated': INF, 'completed': INF} for cycle in cycles}
+        done = dict()
+        submitted = set()
+        jobs, queue, running = [], [], []
+        active = []
+        wakeups = set()
+        next_cycle = pending = 0
+        free = self.nodes
+        events = [(0., 0, 'poll', None)]
+        sequence = 1
+
+        def push(time, kind, payload=None):
+            nonlocal sequence
+            heapq.heappush(events, (time, sequence, kind, payload))
+            sequence += 1
+
+        def rocotorun(now):
+            nonlocal next_cycle, pending
+            changed = True
+            while changed:
+                changed = False
+                for cycle in list(active):
+                    if remaining[cycle] == 0:
+                        times[cycle]['completed'] = max([done[(name, cycle)]['finish'] for name in tasks[cycle]],
+                                                        default=now)
+                        active.remove(cycle)
+                        changed = True
+                while next_cycle < len(cycles) and len(active) < throttle:
+                    cycle = cycles[next_cycle]
+                    if self.graph.realtime and clock(cycle) > now:
+                        if self.poll == 0. and cycle not in wakeups:
+                            wakeups.add(cycle)
+                            push(clock(cycle), 'poll')
+                        break
+                    times[cycle]['activated'] = now
+                    active.append(cycle)
+                    next_cycle += 1
+                    changed = True
+
+            in_flight = len(queue) + len(running) + pending
+            for cycle in active:
+                for name in tasks[cycle]:
+                    if in_flight >= taskthrottle:
+                        return
+                    node = (name, cycle)
+                    if node in submitted:
+                        continue
+                    dependency = self.graph.tasks[name].dependency
+                    if dependency is not None and \
+                            self._evaluate(dependency, cycle, done, first_cycle, clock)[0] > now:
+                        continue
+                    qtime, runtime = self.durations(name)
+                    job = {'node': node, 'nodes': self.graph.tasks[name].nodes, 'cores': self.graph.tasks[name].cores,
+                           'runtime': runtime, 'limit': self._limit(name, runtime),
+                           'submitted': now, 'eligible': now + qtime, 'start': INF, 'finish': INF}
+                    jobs.append(job)
+                    submitted.add(node)
+                    in_flight += 1
+                    if qtime > 0:
+                        pending += 1
+                        push(job['eligible'], 'eligible', job)
+                    else:
+                        queue.append(job)
+
+        while events:
+            now = events[0][0]
+            poll = False
+            while events and events[0][0] == now:
+                _, _, kind, job = heapq.heappop(events)
+                if kind == 'poll':
+                    poll = True
+                elif kind == 'eligible':
+                    pending -= 1
+                    queue.append(job)
+                elif kind == 'finish':
+                    running.remove(job)
+                    free += job['nodes']
+                    done[job['node']] = job
+                    remaining[job['node'][1]] -= 1
+
+            if poll or self.poll == 0.:
+                rocotorun(now)
+                if self.poll > 0. and (active or next_cycle < len(cycles)):
+                    push(now + self.poll, 'poll')
+
+            for job in self._dispatch(now, queue, running, free):
+                queue.remove(job)
+                running.append(job)
+                free -= job['nodes']
+                job['start'] = now
+                job['finish'] = now + job['runtime']
+                push(job['finish'], 'finish', job)
+
+        return SimulationResult(self.nodes, self.policy, jobs, times)
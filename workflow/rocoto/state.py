@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+import sqlite3
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from lxml import etree as ET
+except ImportError:
+    from xml.etree import ElementTree as ET
+
+from rocoto.cycledef import CycleDef
+
+'''
+    MODULE:
+        state.py
+
+    ABOUT:
+        State of a Rocoto workflow read directly from its XML document and its
+        SQLite database, without running rocotostat.  The job counts and the
+        cycles are read with a single read-only transaction, so a workflow of
+        any size is checked in milliseconds.
+'''
+
+__all__ = ['STATUS_CASES', 'WorkflowState', 'get_workflow_cycles', 'read_workflow_state',
+           'is_done', 'is_stalled', 'is_failed', 'get_rocoto_state']
+
+# Job states counted by rocotostat (the FAILED state of Rocoto is counted as FAIL)
+STATUS_CASES = ['SUCCEEDED', 'FAIL', 'DEAD', 'RUNNING', 'SUBMITTING', 'QUEUED']
+
+
+def _from_epoch(seconds: int) -> datetime:
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).replace(tzinfo=None)
+
+
+def get_workflow_cycles(workflow_file: str) -> List[datetime]:
+    """
+    All the cycles defined by the <cycledef>s of a workflow, in order
+
+    Only the 'start end increment' form of <cycledef> is supported (the one
+    written by setup_xml.py).
+
+    Parameters
+    ----------
+    workflow_file : str
+        Rocoto XML workflow document
+
+    Returns
+    -------
+    List[datetime]
+        Cycles of all the cycledef groups, without duplicates
+    """
+
+    cycles = set()
+    root = ET.parse(workflow_file).getroot()
+    for cycledef in root.iter('cycledef'):
+        cycles.update(CycleDef.from_string(cycledef.text))
+
+    return sorted(cycles)
+
+
+class WorkflowState:
+    """
+    Job counts and cycle states of a workflow
+
+    Attributes
+    ----------
+    counts : Counter
+        Number of jobs in each state
+    cycles : Dict[datetime, Dict[str, Any]]
+        For each cycle of the workflow: its state ('Done', 'Active', 'Expired'
+        or 'Inactive'), the activated/deactivated times and the number of jobs
+        in each state
+    """
+
+    def __init__(self, cycles: List[datetime], cycle_rows: List[tuple], job_rows: List[tuple]) -> None:
+
+        self.counts = Counter()
+        self.cycles = {cycle: {'state': 'Inactive', 'activated': None, 'deactivated': None, 'counts': Counter()}
+                       for cycle in cycles}
+
+        for cycle, activated, expired, done in cycle_rows:
+            entry = self.cycles.setdefault(_from_epoch(cycle), {'counts': Counter()})
+            if done:
+                entry.update(state='Done', deactivated=_from_epoch(done))
+            elif expired:
+                entry.update(state='Expired', deactivated=_from_epoch(expired))
+            else:
+                entry.update(state='Active', deactivated=None)
+            entry['activated'] = _from_epoch(activated) if activated else None
+
+        for cycle, state, count in job_rows:
+            state = 'FAIL' if state == 'FAILED' else state
+            self.counts[state] += count
+            self.cycles.setdefault(_from_epoch(cycle), {'state': 'Active', 'activated': None,
+                                                        'deactivated': None, 'counts': Counter()})['counts'][state] += count
+
+    @property
+    def status(self) -> Dict[str, int]:
+        """Job counts of STATUS_CASES and the number of cycles and of done cycles"""
+        rocoto_status = {case: self.counts[case] for case in STATUS_CASES}
+        rocoto_status['CYCLES_TOTAL'] = len(self.cycles)
+        rocoto_status['CYCLES_DONE'] = self.cycles_done
+        return rocoto_status
+
+    @property
+    def cycles_done(self) -> int:
+        return sum(1 for entry in self.cycles.values() if entry['state'] == 'Done')
+
+    def cycle_completion(self) -> Dict[datetime, float]:
+        """Fraction of the jobs of each activated cycle that have succeeded"""
+        completion = dict()
+        for cycle, entry in self.cycles.items():
+            if entry['state'] == 'Done':
+                completion[cycle] = 1.
+            elif entry['counts']:
+                completion[cycle] = entry['counts']['SUCCEEDED'] / sum(entry['counts'].values())
+        return completion
+
+
+def read_workflow_state(workflow_file: str, database_file: str,
+                        timeout: float = 30., cycles: Optional[List[datetime]] = None) -> WorkflowState:
+    """
+    Read the state of a workflow
+
+    The database is opened read-only and read in a single transaction; if it is
+    locked by rocotorun, the read waits up to `timeout` seconds.
+
+    Parameters
+    ----------
+    workflow_file : str
+        Rocoto XML workflow document
+    database_file : str
+        Rocoto SQLite database
+    timeout : float
+        Seconds to wait for a lock held by Rocoto
+    cycles : List[datetime]
+        Cycles of the workflow, if already known (default: read from the workflow document)
+
+    Returns
+    -------
+    WorkflowState
+    """
+
+    if cycles is None:
+        cycles = get_workflow_cycles(workflow_file)
+
+    connection = sqlite3.connect(f'file:{database_file}?mode=ro', uri=True, timeout=timeout)
+    try:
+        connection.execute('BEGIN')
+        tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        cycle_rows = job_rows = []
+        if 'cycles' in tables:
+            cycle_rows = connection.execute('SELECT cycle, activated, expired, done FROM cycles').fetchall()
+        if 'jobs' in tables:
+            job_rows = connection.execute('SELECT cycle, state, count(*) FROM jobs GROUP BY cycle, state').fetchall()
+        connection.execute('COMMIT')
+    finally:
+        connection.close()
+
+    return WorkflowState(cycles, cycle_rows, job_rows)
+
+
+def is_done(rocoto_status: Dict[str, int]) -> bool:
+    """True if all the cycles are done"""
+    return rocoto_status['CYCLES_TOTAL'] == rocoto_status['CYCLES_DONE']
+
+
+def is_stalled(rocoto_status: Dict[str, int]) -> bool:
+    """True if no job is RUNNING, SUBMITTING or QUEUED"""
+    return rocoto_status['RUNNING'] + rocoto_status['SUBMITTING'] + rocoto_status['QUEUED'] == 0
+
+
+def is_failed(rocoto_status: Dict[str, int]) -> bool:
+    """True if a job is DEAD (has failed its last try)"""
+    return rocoto_status['DEAD'] > 0
+
+
+def get_rocoto_state(rocoto_status: Dict[str, int]) -> Tuple[str, int]:
+    """
+    Determine the state of a workflow from its status
+
+    Assuming rocotorun has just been run, a workflow that is not done and has
+    no job RUNNING, SUBMITTING or QUEUED is stalled.
+
+    Parameters
+    ----------
+    rocoto_status : Dict[str, int]
+        WorkflowState.status
+
+    Returns
+    -------
+    Tuple[str, int]
+        DONE, FAIL, UNKNOWN, STALLED or RUNNING and the error code to exit with
+    """
+
+    if is_done(rocoto_status):
+        return 'DONE', 0
+    if is_failed(rocoto_status):
+        return 'FAIL', rocoto_status['FAIL'] + rocoto_status['DEAD']
+    if 'UNKNOWN' in rocoto_status:
+        return 'UNKNOWN', rocoto_status['UNKNOWN']
+    if is_stalled(rocoto_status):
+        return 'STALLED', 3
+    return 'RUNNING', 0
@@ -4,8 +4,8 @@ import copy
 import numpy as np
 from applications.applications import AppConfig
 import rocoto.rocoto as rocoto
-from wxflow import Template, TemplateConstants, to_timedelta
-from typing import List
+from wxflow import Template, TemplateConstants, to_timedelta, timedelta_to_HMS
+from typing import Any, Dict, List
 
 __all__ = ['Tasks']
 
@@ -165,6 +165,68 @@ class Tasks:
 
         return fhrs
 
+    @staticmethod
+    def _get_fhr_groups(fhrs: List[int], group_size: int = 1) -> List[List[int]]:
+        """
+        Split forecast hours in groups of `group_size` consecutive hours
+        """
+        group_size = max(1, int(group_size))
+        return [fhrs[ii:ii + group_size] for ii in range(0, len(fhrs), group_size)]
+
+    @staticmethod
+    def _get_fhr_group_label(group: List[int]) -> str:
+        """
+        Label of a group of forecast hours in task names, e.g. f000-f002 (f003 for a single hour)
+        """
+        return f'f{group[0]:03d}' if len(group) == 1 else f'f{group[0]:03d}-f{group[-1]:03d}'
+
+    def _get_fhr_metatask(self, fhrs: List[int], group_size: int = 1) -> Dict[str, Any]:
+        """
+        Variables of a metatask over forecast hours, with one task per hour or per group of hours
+
+        Parameters
+        ----------
+        fhrs: List[int]
+            forecast hours
+        group_size: int
+            number of consecutive forecast hours processed by a task
+
+        Returns
+        -------
+        Dict: with the keys
+            var_dict: the variables of the metatask
+            label: the label of a task in its name (f#fhr#, or #fhrgrp# e.g. f000-f002)
+            fhrs: the forecast hours of a task (#fhr#, or #fhr0#, #fhr1#, ...; the last
+                  hour is repeated in a group shorter than the others)
+            envars: the forecast hours of a task for the job (FHR3=#fhr#, or
+                    FHRLST=#fhrlst# e.g. f000_f001_f002)
+        """
+
+        if max(1, int(group_size)) == 1:
+            return {'var_dict': {'fhr': ' '.join([f'{fhr:03d}' for fhr in fhrs])},
+                    'label': 'f#fhr#',
+                    'fhrs': ['#fhr#'],
+                    'envars': {'FHR3': '#fhr#'}}
+
+        groups = self._get_fhr_groups(fhrs, group_size)
+        size = max(len(group) for group in groups)
+        var_dict = {'fhrgrp': ' '.join([self._get_fhr_group_label(group) for group in groups]),
+                    'fhrlst': ' '.join(['_'.join([f'f{fhr:03d}' for fhr in group]) for group in groups])}
+        for ii in range(size):
+            var_dict[f'fhr{ii}'] = ' '.join([f'{group[min(ii, len(group) - 1)]:03d}' for group in groups])
+
+        return {'var_dict': var_dict,
+                'label': '#fhrgrp#',
+                'fhrs': [f'#fhr{ii}#' for ii in range(size)],
+                'envars': {'FHRLST': '#fhrlst#'}}
+
+    @staticmethod
+    def _scale_walltime(walltime: str, factor: int) -> str:
+        """
+        Walltime (HH:MM:SS) of a job doing the work of `factor` jobs
+        """
+        return timedelta_to_HMS(to_timedelta(walltime) * factor)
+
     def get_resource(self, task_name):
         """
         Given a task name (task_name) and its configuration (task_names),
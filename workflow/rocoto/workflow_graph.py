@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+import re
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    from lxml import etree as ET
+except ImportError:
+    from xml.etree import ElementTree as ET
+
+from rocoto.cycledef import CycleDef, rocoto_timedelta
+
+'''
+    MODULE:
+        workflow_graph.py
+
+    ABOUT:
+        Task graph of a Rocoto workflow read back from its XML document:
+        the cycledefs, the tasks (with the metatasks expanded) and their
+        dependencies, with the cross-cycle offsets resolved to cycles.
+
+        A dependency is kept as a tuple expression:
+            ('and' | 'or' | 'nand' | 'nor' | 'xor' | 'some', [expression, ...])
+            ('not', [expression])
+            ('task', name, offset)         offset is a timedelta
+            ('metatask', name, offset)
+            ('cycleexist', offset)
+            ('time', offset)               wall clock time of the cycle + offset
+            ('data', path, offset)         path with the @ cyclestr flags of the cycle + offset
+            ('other', tag)                 sh, streq, ... (not modelled)
+'''
+
+__all__ = ['Task', 'WorkflowGraph']
+
+
+class Task:
+    """
+    A task of the workflow (metatasks are expanded into their tasks)
+
+    Attributes
+    ----------
+    name : str
+    cycledefs : List[str]
+        Names of the cycledef groups the task runs in (None for all of them)
+    dependency : tuple
+        Dependency expression, None if the task has no dependency
+    walltime : timedelta
+    nodes : int
+        Number of nodes requested (sum of the node groups of <nodes>)
+    cores : int
+        Number of tasks (MPI ranks) requested, <cores> or nodes x ppn
+    threads : int
+        Threads per task (tpp) of the first node group
+    metatasks : List[str]
+        Names of the metatasks the task belongs to, outermost first
+    """
+
+    def __init__(self, name: str, cycledefs: Optional[List[str]], dependency: Optional[tuple] = None,
+                 walltime: Optional[timedelta] = None, nodes: int = 1, cores: int = 1, threads: int = 1,
+                 maxtries: Optional[int] = None, metatasks: Optional[List[str]] = None) -> None:
+        self.name = name
+        self.cycledefs = cycledefs
+        self.dependency = dependency
+        self.walltime = walltime
+        self.nodes = nodes
+        self.cores = cores
+        self.threads = threads
+        self.maxtries = maxtries
+        self.metatasks = metatasks or []
+
+    def __repr__(self) -> str:
+        return f'Task({self.name!r}, {self.cycledefs!r})'
+
+
+class WorkflowGraph:
+    """
+    Tasks, dependencies and cycles of a Rocoto workflow
+
+    Attributes
+    ----------
+    cycledefs : Dict[str, List[CycleDef]]
+        CycleDefs of each cycledef group
+    tasks : Dict[str, Task]
+        Tasks in the order of the workflow document
+    metatasks : Dict[str, List[str]]
+        Names of the tasks of each metatask (including those of nested metatasks)
+    realtime : bool
+    cyclethrottle : int
+        Maximum number of cycles active at the same time
+    taskthrottle : int
+        Maximum number of jobs submitted at the same time (None if unlimited)
+    scheduler : str
+    """
+
+    _var = re.compile(r'#([^#\s]+)#')
+
+    def __init__(self, root: Any) -> None:
+
+        self.cycledefs = dict()
+        self.tasks = dict()
+        self.metatasks = dict()
+        self.realtime = root.get('realtime', 'F').upper() in ['T', 'TRUE']
+        self.cyclethrottle = int(root.get('cyclethrottle', 1))
+        self.taskthrottle = int(root.get('taskthrottle')) if root.get('taskthrottle') else None
+        self.scheduler = root.get('scheduler')
+
+        for child in root:
+            if child.tag == 'cycledef':
+                group = child.get('group', 'default_cycle')
+                self.cycledefs.setdefault(group, []).append(CycleDef.from_string(child.text))
+            elif child.tag in ['task', 'metatask']:
+                self._add(child, dict(), [])
+
+        self._cycles = sorted({cycle for cycledefs in self.cycledefs.values()
+                               for cycledef in cycledefs for cycle in cycledef})
+        self._cycle_set = set(self._cycles)
+
+    @classmethod
+    def from_file(cls, workflow_file: str) -> 'WorkflowGraph':
+        return cls(ET.parse(workflow_file).getroot())
+
+    @classmethod
+    def from_string(cls, xml: str) -> 'WorkflowGraph':
+        """Graph of a workflow document, e.g. RocotoXML.xml"""
+        return cls(ET.fromstring(xml.encode()))
+
+    def _substitute(self, text: Optional[str], variables: Dict[str, str]) -> Optional[str]:
+        if text is None or '#' not in text:
+            return text
+        return self._var.sub(lambda match: variables.get(match.group(1), match.group(0)), text)
+
+    def _add(self, element: Any, variables: Dict[str, str], metatasks: List[str]) -> List[str]:
+        """Add a task, or the tasks of a metatask; return the names of the tasks added"""
+
+        if element.tag == 'task':
+            return [self._add_task(element, variables, metatasks)]
+
+        name = self._substitute(element.get('name'), variables)
+        values = {var.get('name'): var.text.split() for var in element.findall('var')}
+        size = min([len(value) for value in values.values()], default=1)
+        names = []
+        for index in range(size):
+            inner = dict(variables)
+            inner.update({var: value[index] for var, value in values.items()})
+            for child in element:
+                if child.tag in ['task', 'metatask']:
+                    names.extend(self._add(child, inner, metatasks + ([name] if name else [])))
+        if name:
+            self.metatasks.setdefault(name, []).extend(names)
+        return names
+
+    def _add_task(self, element: Any, variables: Dict[str, str], metatasks: List[str]) -> str:
+
+        name = self._substitute(element.get('name'), variables)
+        cycledefs = element.get('cycledefs').split(',') if element.get('cycledefs') else None
+
+        walltime = self._substitute(element.findtext('walltime'), variables)
+        walltime = rocoto_timedelta(walltime) if walltime else None
+
+        nodes, cores, threads = 1, self._substitute(element.findtext('cores'), variables), 1
+        nodes_text = self._substitute(element.findtext('nodes'), variables)
+        if nodes_text:
+            nodes = ranks = 0
+            for index, group in enumerate(nodes_text.strip().split('+')):
+                fields = group.split(':')
+                count = int(fields[0])
+                options = dict(field.split('=', 1) for field in fields[1:] if '=' in field)
+                nodes += count
+                ranks += count * int(options.get('ppn', 1))
+                if index == 0:
+                    threads = int(options.get('tpp', 1))
+            cores = ranks if cores is None else cores
+        cores = int(cores) if cores is not None else 1
+
+        maxtries = element.get('maxtries')
+        maxtries = int(maxtries) if maxtries and maxtries.isdigit() else None
+
+        dependency = element.find('dependency')
+        if dependency is not None:
+            children = [child for child in dependency if isinstance(child.tag, str)]
+            dependency = self._parse_dependency(children[0], variables) if children else None
+
+        self.tasks[name] = Task(name, cycledefs, dependency, walltime, nodes, cores, threads, maxtries, metatasks)
+        return name
+
+    def _parse_dependency(self, element: Any, variables: Dict[str, str]) -> tuple:
+
+        tag = element.tag
+        offset = element.get('cycle_offset')
+        offset = rocoto_timedelta(offset) if offset else timedelta(0)
+
+        if tag in ['and', 'or', 'not', 'nand', 'nor', 'xor', 'some']:
+            return (tag, [self._parse_dependency(child, variables) for child in element if isinstance(child.tag, str)])
+        if tag == 'taskdep':
+            return ('task', self._substitute(element.get('task'), variables), offset)
+        if tag == 'metataskdep':
+            return ('metatask', self._substitute(element.get('metatask'), variables), offset)
+        if tag == 'cycleexistdep':
+            return ('cycleexist', offset)
+        if tag in ['timedep', 'datadep']:
+            cyclestr = element.find('cyclestr')
+            if cyclestr is not None:
+                offset = cyclestr.get('offset')
+                offset = rocoto_timedelta(offset) if offset else timedelta(0)
+            if tag == 'datadep':
+                text = ''.join(element.itertext()).strip()
+                return ('data', self._substitute(text, variables), offset)
+            if cyclestr is not None:
+                return ('time', offset)
+        return ('other', tag)
+
+    def cycles(self) -> List[datetime]:
+        """All the cycles of the workflow, in order"""
+        return list(self._cycles)
+
+    def cycle_exists(self, cycle: datetime) -> bool:
+        return cycle in self._cycle_set
+
+    def runs(self, task: str, cycle: datetime) -> bool:
+        """Whether a task runs at a cycle"""
+        if task not in self.tasks:
+            return False
+        groups = self.tasks[task].cycledefs
+        if groups is None:
+            return self.cycle_exists(cycle)
+        return any(cycle in cycledef for group in groups for cycledef in self.cycledefs.get(group, []))
+
+    def tasks_at(self, cycle: datetime) -> List[str]:
+        """Names of the tasks that run at a cycle"""
+        return [name for name in self.tasks if self.runs(name, cycle)]
+
+    def dependency_nodes(self, expression: Optional[tuple], cycle: datetime) -> List[Tuple[str, datetime]]:
+        """The (task, cycle) nodes of the task and metatask dependencies of an expression evaluated at a cycle"""
+        if expression is None:
+            return []
+        kind = expression[0]
+        if kind in ['task', 'metatask']:
+            names = [expression[1]] if kind == 'task' else self.metatasks.get(expression[1], [])
+            return [(name, cycle + expression[2]) for name in names]
+        if kind in ['cycleexist', 'time', 'data', 'other']:
+            return []
+        return [node for child in expression[1] for node in self.dependency_nodes(child, cycle)]
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Critical path, slack and completion time of the cycles of a Rocoto workflow,
+estimated from the durations of past runs
+"""
+
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from datetime import datetime, timedelta, timezone
+
+from rocoto.critical_path import INF, STATS, CriticalPath, TaskHistory
+from rocoto.workflow_graph import WorkflowGraph
+
+
+def input_args(*argv):
+    """
+    Method to collect user arguments for `rocoto_critical_path.py`
+    """
+
+    description = """
+        Builds the task graph of the workflow, weights the tasks with the
+        run times and queue waits of the jobs in the Rocoto databases and
+        reports the critical path of a cycle, the slack of its tasks and
+        the estimated completion time of the cycles in flight.
+        """
+
+    parser = ArgumentParser(description=description,
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('-w', dest='workflow_file', help='Rocoto XML workflow document', type=str, required=True)
+    parser.add_argument('-d', dest='database_files', help='Rocoto database with the durations of past jobs '
+                        '(may be repeated, e.g. for several experiments)', type=str, action='append', default=[])
+    parser.add_argument('--cycle', help='cycle to analyse, YYYYmmddHHMM (default: the last of the first --ncycles cycles)',
+                        type=str, default=None, required=False)
+    parser.add_argument('--ncycles', help='number of cycles scheduled up to the analysed cycle', type=int,
+                        default=5, required=False)
+    parser.add_argument('--stat', help='statistic of the past durations', choices=list(STATS),
+                        default='median', required=False)
+    parser.add_argument('--estimate', help='estimate the completion time of the active cycles of the first database',
+                        action='store_true', required=False)
+
+    return parser.parse_args(argv[0][0] if len(argv[0]) else None)
+
+
+def hms(seconds):
+    if seconds in [INF, -INF]:
+        return 'never' if seconds == INF else '-'
+    # Tasks of the earlier cycles start before the activation of the analysed one
+    return ('-' if seconds < 0 else '') + str(timedelta(seconds=round(abs(seconds))))
+
+
+def main(*argv):
+
+    user_inputs = input_args(argv)
+
+    graph = WorkflowGraph.from_file(user_inputs.workflow_file)
+    history = TaskHistory(user_inputs.database_files)
+    model = CriticalPath(graph, history, user_inputs.stat)
+
+    cycles = graph.cycles()
+    if user_inputs.cycle is not None:
+        cycle = datetime.strptime(user_inputs.cycle, '%Y%m%d%H%M')
+        if cycle not in cycles:
+            raise ValueError(f'FATAL ERROR: {user_inputs.cycle} is not a cycle of the workflow')
+        index = cycles.index(cycle)
+    else:
+        index = min(len(cycles), max(1, user_inputs.ncycles)) - 1
+        cycle = cycles[index]
+    window = cycles[max(0, index - user_inputs.ncycles + 1):index + 1]
+
+    no_history = [name for name in graph.tasks_at(cycle) if history.runtime(name) is None]
+    if no_history:
+        print(f'WARNING: {len(no_history)} tasks never ran, their walltime is used: {", ".join(no_history)}\n')
+
+    timings = model.schedule(window)
+    path = model.critical_path(timings, cycle)
+    activation = model.activation(timings, cycle)
+    completion = model.completion(timings, cycle)
+
+    print(f'Critical path of cycle {cycle:%Y%m%d%H%M} ({user_inputs.stat} durations, '
+          f'{len(window)} cycles scheduled from {window[0]:%Y%m%d%H%M})')
+    print(f'  {"cycle":<14}{"task":<32}{"queue":>10}{"run":>10}{"start":>12}{"finish":>12}')
+    for name, task_cycle in path:
+        timing = timings[(name, task_cycle)]
+        qtime, runtime = model.durations(name)
+        print(f'  {task_cycle:%Y%m%d%H%M}  {name:<32}{hms(qtime):>10}{hms(runtime):>10}'
+              f'{hms(timing["start"] - activation):>12}{hms(timing["finish"] - activation):>12}')
+    print(f'Cycle latency: {hms(completion - activation)} from the activation of the cycle')
+    for stat in STATS:
+        if stat != user_inputs.stat:
+            other = CriticalPath(graph, history, stat)
+            other_timings = other.schedule(window)
+            print(f'  with {stat} durations: '
+                  f'{hms(other.completion(other_timings, cycle) - other.activation(other_timings, cycle))}')
+
+    print('\nSlack of the tasks of the cycle (tasks on the critical path have none)')
+    slack = model.slack(timings, cycle)
+    for name in sorted(slack, key=lambda name: (slack[name], name)):
+        print(f'  {name:<32}{hms(slack[name]):>12}')
+
+    blocked = [name for (name, task_cycle), timing in timings.items() if task_cycle == cycle and timing['finish'] == INF]
+    if blocked:
+        print(f'\nTasks whose dependencies are never satisfied: {", ".join(blocked)}')
+
+    if user_inputs.estimate:
+        if not user_inputs.database_files:
+            raise ValueError('FATAL ERROR: a database (-d) is required to estimate the completion of the active cycles')
+        print(f'\nEstimated completion of the active cycles of {user_inputs.database_files[0]}')
+        for active_cycle, finish in sorted(model.estimate(user_inputs.database_files[0]).items()):
+            finish = 'never (a task is DEAD)' if finish == INF else \
+                f'{datetime.fromtimestamp(finish, tz=timezone.utc):%Y-%m-%d %H:%M:%S} UTC'
+            print(f'  {active_cycle:%Y%m%d%H%M}  {finish}')
+
+
+if __name__ == '__main__':
+
+    main()
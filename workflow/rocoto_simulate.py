@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Simulate the cycles of a workflow on a cluster to predict its throughput
+and compare resource configurations, without running it
+"""
+
+import os
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from datetime import timedelta
+
+from rocoto.critical_path import INF, STATS, TaskHistory
+from rocoto.simulator import POLICIES, WorkflowSimulator
+from rocoto.workflow_graph import WorkflowGraph
+
+
+def input_args(*argv):
+    """
+    Method to collect user arguments for `rocoto_simulate.py`
+    """
+
+    description = """
+        Generates the task graph of each experiment (as setup_xml.py would),
+        with the nodes its config.resources gives each task, and simulates
+        its cycles on a cluster of --nodes nodes.  The run times of the tasks
+        are fitted to the jobs of the Rocoto databases as a function of their
+        number of cores.  Reports the cycles per day, the node utilization and
+        the peak node demand of each experiment, side by side.
+        """
+
+    parser = ArgumentParser(description=description,
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('workflows', help='experiment directories (or Rocoto XML workflow documents) to compare',
+                        type=str, nargs='+')
+    parser.add_argument('-d', dest='database_files', help='Rocoto database with the durations of past jobs '
+                        '(may be repeated)', type=str, action='append', default=[])
+    parser.add_argument('--nodes', help='number of nodes of the cluster', type=int, required=True)
+    parser.add_argument('--policy', help='queue policy of the batch scheduler', choices=POLICIES,
+                        default='backfill', required=False)
+    parser.add_argument('--ncycles', help='number of cycles simulated (default: all the cycles of the workflow)',
+                        type=int, default=None, required=False)
+    parser.add_argument('--stat', help='statistic of the past durations', choices=list(STATS),
+                        default='median', required=False)
+    parser.add_argument('--poll', help='seconds between two runs of rocotorun', type=float,
+                        default=300., required=False)
+    parser.add_argument('--queue-wait', help='add the queue waits of the past jobs (the load of other users)',
+                        action='store_true', required=False)
+    parser.add_argument('--cyclethrottle', help='maximum number of concurrent cycles', type=int,
+                        default=3, required=False)
+    parser.add_argument('--taskthrottle', help='maximum number of concurrent tasks', type=int,
+                        default=25, required=False)
+
+    return parser.parse_args(argv[0][0] if len(argv[0]) else None)
+
+
+def get_graph(workflow, rocoto_param_dict):
+    """Task graph of a Rocoto XML document, or of the one generated for an experiment directory"""
+
+    if os.path.isfile(workflow):
+        return WorkflowGraph.from_file(workflow)
+
+    # Imported here: they are only needed (and only work) with an experiment directory
+    from applications.application_factory import app_config_factory
+    from rocoto.rocoto_xml_factory import rocoto_xml_factory
+    from wxflow import Configuration
+
+    cfg = Configuration(workflow)
+    base = cfg.parse_config('config.base')
+    app_config = app_config_factory.create(f'{base["NET"]}_{base["MODE"]}', cfg)
+    xml = rocoto_xml_factory.create(f'{base["NET"]}_{base["MODE"]}', app_config, rocoto_param_dict)
+
+    return WorkflowGraph.from_string(xml.xml)
+
+
+def hms(seconds):
+    if seconds == INF:
+        return 'never'
+    return str(timedelta(seconds=round(seconds)))
+
+
+def main(*argv):
+
+    user_inputs = input_args(argv)
+    rocoto_param_dict = {'maxtries': 2,
+                         'cyclethrottle': user_inputs.cyclethrottle,
+                         'taskthrottle': user_inputs.taskthrottle,
+                         'verbosity': 10}
+
+    history = TaskHistory(user_inputs.database_files)
+
+    graphs, results = [], []
+    for workflow in user_inputs.workflows:
+        graph = get_graph(workflow, rocoto_param_dict)
+        cycles = graph.cycles()[:user_inputs.ncycles]
+        simulator = WorkflowSimulator(graph, history, user_inputs.nodes, user_inputs.policy, user_inputs.stat,
+                                      user_inputs.poll, user_inputs.queue_wait)
+        graphs.append(graph)
+        results.append(simulator.simulate(cycles).summary())
+
+    formats = {'cycles/day': '{:.2f}'.format,
+               'node utilization': lambda value: f'{100. * value:.1f}%',
+               'mean queue wait': hms,
+               'mean cycle latency': hms,
+               'makespan': hms}
+    width = max(16, max(len(os.path.basename(workflow.rstrip('/'))) for workflow in user_inputs.workflows) + 2)
+
+    print(f'Simulation of {user_inputs.ncycles or "all the"} cycles on {user_inputs.nodes} nodes '
+          f'({user_inputs.policy} queue policy, {user_inputs.stat} durations)')
+    print(f'  {"":<20}' + ''.join(f'{os.path.basename(workflow.rstrip("/")):>{width}}'
+                                  for workflow in user_inputs.workflows))
+    for key in results[0]:
+        print(f'  {key:<20}' + ''.join(f'{formats.get(key, str)(result[key]):>{width}}' for result in results))
+
+    # Tasks laid out differently than in the first workflow
+    for workflow, graph in zip(user_inputs.workflows[1:], graphs[1:]):
+        changed = [name for name, task in graph.tasks.items() if name in graphs[0].tasks and
+                   (task.nodes, task.cores, task.threads) != (graphs[0].tasks[name].nodes, graphs[0].tasks[name].cores,
+                                                              graphs[0].tasks[name].threads)]
+        if changed:
+            print(f'\nTasks with a different layout in {workflow} (nodes/ranks/threads)')
+            for name in changed:
+                before, after = graphs[0].tasks[name], graph.tasks[name]
+                print(f'  {name:<32}{before.nodes}/{before.cores}/{before.threads} -> '
+                      f'{after.nodes}/{after.cores}/{after.threads}')
+
+    no_history = sorted({name for graph in graphs for name in graph.tasks if history.runtime(name) is None})
+    if no_history:
+        print(f'\nWARNING: {len(no_history)} tasks never ran, their walltime is used: {", ".join(no_history)}')
+
+
+if __name__ == '__main__':
+
+    main()
@@ -45,9 +45,13 @@ from datetime import datetime, timedelta
 import re
 import traceback
 import pickle
+import hashlib
+import tempfile
 
 import sqlite3
 import collections
+from rocoto.accounting import get_accounting
+from rocoto.cycledef import CycleDef, CycleDefGroup
 try:
     # The stock XML parser does not expand external entities, so
     # try to load lxml instead.
@@ -59,23 +63,14 @@ except ImportError:
     from xml.etree import ElementTree as ET
     using_lxml = False
 
-try:
-    # UGCS uses a timedelta of months, which requires the extended
-    # capabilities of relativedelta. The base timedelta only handles
-    # intervals measured in days.
-    from dateutil.relativedelta import relativedelta
-except ImportError:
-    # Don't raise the exception yet until relativedelta is actually needed.
-    pass
-
 # Global Variables
 database_file_agmented = None
 use_performance_metrics = False
 job_name_length_max = 50
 default_column_length_master = 125
 stat_read_time_delay = 3 * 60
+tasklist_cache_version = 1
 header_string = ''
-format_string = "jobid slots submit_time start_time cpu_used run_time delimiter=';'"
 
 ccs_html = '''
 <html>
@@ -338,25 +333,52 @@ Optional arguments:
     sys.exit(-1)
 
 
-def augment_SQLite3(filename):
-    connection = sqlite3.connect(filename)
-    c = connection.cursor()
-    # qinfo=q = c.execute("DROP TABLE IF EXISTS jobs_augment;")
-    c.execute("PRAGMA table_info(jobs_augment)").fetchall()
-    if any('qtime' in element for element in qinfo):
-        c.close()
-        return 'is_already_augmented'
-    else:
-        sql_create_augment_table = "CREATE TABLE jobs_augment AS SELECT * FROM jobs;"
-        c.execute(sql_create_augment_table)
-        c.execute("alter table jobs_augment add column qtime integer;")
-        c.execute("alter table jobs_augment add column cputime integer;")
-        c.execute("alter table jobs_augment add column runtime integer;")
-        c.execute("alter table jobs_augment add column slots integer;")
-        connection.commit()
+class PerfMetricsStore:
+    """
+    Scheduler metrics of the jobs kept in a sidecar database
 
-    c.close()
-    return 'now_augmented'
+    The Rocoto database is never written to: the metrics are stored by jobid
+    in their own database, which is attached and joined to the jobs table
+    when the job rows are read.
+    """
+
+    metrics = ('qtime', 'cputime', 'runtime', 'slots')
+
+    def __init__(self, path):
+        self.path = path
+        connection = sqlite3.connect(path, timeout=60)
+        with connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS metrics '
+                               '(jobid TEXT PRIMARY KEY, qtime, cputime, runtime, slots)')
+        connection.close()
+
+    @staticmethod
+    def get_path(database_file):
+        return f'{os.path.splitext(database_file)[0]}_perfmetrics.db'
+
+    def update(self, aug_perf):
+        """
+        Store the metrics of the jobs whose values changed since the last poll
+
+        Returns the jobids that were updated
+        """
+        if not aug_perf:
+            return []
+
+        connection = sqlite3.connect(self.path, timeout=60)
+        stored = {row[0]: tuple(row[1:]) for row in
+                  connection.execute(f'SELECT jobid, {", ".join(self.metrics)} FROM metrics')}
+        changed = []
+        for jobid, values in aug_perf.items():
+            values = tuple(values.get(metric) for metric in self.metrics)
+            if stored.get(str(jobid)) != values:
+                changed.append((str(jobid),) + values)
+        with connection:
+            connection.executemany(f'INSERT OR REPLACE INTO metrics (jobid, {", ".join(self.metrics)}) '
+                                   f'VALUES (?, {", ".join("?" * len(self.metrics))})', changed)
+        connection.close()
+
+        return [row[0] for row in changed]
 
 
 def isSQLite3(filename):
@@ -408,8 +430,8 @@ def get_arguments():
             database_file = v
         elif k in ('-f', '--checkfile'):
             save_checkfile_path = v
-        # elif k in ('--perfmetrics'):
-        #    perfmetrics_on = v
+        elif k in ('--perfmetrics'):
+            perfmetrics_on = v
         elif k in ('--listtasks'):
             global list_tasks
             list_tasks = True
@@ -431,8 +453,8 @@ def get_arguments():
 
     if perfmetrics_on is None:
         use_performance_metrics = False
-#    elif perfmetrics_on.lower() == 'true':
-#        use_performance_metrics = True
+    elif perfmetrics_on.lower() == 'true':
+        use_performance_metrics = True
     elif perfmetrics_on.lower() == 'false':
         use_performance_metrics = False
     elif perfmetrics_on is not None:
@@ -487,89 +509,20 @@ def get_entity_values(workflow_file):
     return entity_values
 
 
-def timedelta_total_seconds(timedelta):
-    return (
-        timedelta.microseconds + 0.0 + (timedelta.seconds + timedelta.days * 24 * 3600) * 10 ** 6) / 10 ** 6
+def get_workflow_scheduler(workflow_file):
+    with open(workflow_file, 'r') as f:
+        for line in f:
+            if '<workflow' in line:
+                m = re.search(r'scheduler\s*=\s*"([^"]+)"', line)
+                return m.group(1) if m else None
+    return None
 
 
-def get_aug_perf_values(username):
-    global html_ouput
-    global format_keys
-    try:
-        which_bjobs = syscall(['which', 'bjobs'])
-    except Exception:
-        return None
-    bjobs = collections.defaultdict(dict)
+def get_aug_perf_values(accounting, jobids):
     aug_perf = collections.defaultdict(dict)
-    bjobs_line = syscall([which_bjobs, '-a', '-o', format_string, '-u', username])
-    if 'No job found' in bjobs_line:
-        return None
-    bjobs_lines = bjobs_line.split('\n')
-    for line_number, line in enumerate(bjobs_lines):
-        split_line = line.split(';')
-        if line_number == 0:
-            format_keys = split_line
-            continue
-        for i, value in enumerate(split_line):
-            if i == 0:
-                key = value
-            else:
-                if format_keys[i] in ('RUN_TIME', 'CPU_USED'):
-                    value_list = value.split()
-                    if len(value_list) > 1:
-                        value = value_list[0]
-                bjobs[key][format_keys[i]] = value
-    sub_time_string = ''
-    year = str(datetime.now().year) + ' '
-    sub_time = None
-    bstart_time = None
-    for jobid, keys in bjobs.items():
-        # debug.write(jobid+'\n')
-        for key in keys:
-            # debug.write('   '+key+":"+bjobs[jobid][key]+'\n')
-            try:
-                int_key = int(bjobs[jobid][key].strip())
-                str_key = str(int_key)
-            except Exception:
-                str_key = bjobs[jobid][key].strip()
-
-            if key == 'SUBMIT_TIME':
-                sub_time_string = str_key
-                try:
-                    sub_time = datetime.strptime(year + sub_time_string, '%Y %b %d %H:%M')
-                except Exception:
-                    sub_time = None
-                continue
-            elif key == 'START_TIME':
-                bstart_time_string = str_key
-                try:
-                    bstart_time = datetime.strptime(year + bstart_time_string, '%Y %b %d %H:%M')
-                except Exception:
-                    bstart_time = None
-                continue
-            elif key == 'RUN_TIME':
-                aug_perf[jobid]['runtime'] = str_key
-            elif key == 'CPU_USED':
-                aug_perf[jobid]['cputime'] = str_key
-            elif key == 'SLOTS':
-                aug_perf[jobid]['slots'] = str_key
-
-        if bstart_time_string == sub_time_string:
-            aug_perf[jobid]['qtime'] = '0'
-        elif sub_time is not None and bstart_time is None:
-            try:
-                aug_perf[jobid]['qtime'] = str(int((datetime.now() - sub_time).total_seconds()))
-            except AttributeError:
-                aug_perf[jobid]['qtime'] = str(int(timedelta_total_seconds(datetime.now() - sub_time)))
-
-        elif sub_time is not None and bstart_time is not None:
-            try:
-                aug_perf[jobid]['qtime'] = str(int((bstart_time - sub_time).total_seconds()))
-            except AttributeError:
-                aug_perf[jobid]['qtime'] = str(int(timedelta_total_seconds(bstart_time - sub_time)))
-        else:
-            aug_perf[jobid]['qtime'] = '-'
-
+    for jobid, metrics in accounting.query(jobids).items():
+        for name in ('qtime', 'cputime', 'runtime', 'slots'):
+            aug_perf[jobid][name] = '-' if metrics[name] is None else str(int(metrics[name]))
     return aug_perf
 
 
@@ -867,7 +820,7 @@ def rocoto_run(params):
     return stat
 
 
-def get_tasklist(workflow_file):
+def parse_tasklist(workflow_file):
     tasks_ordered = []
     metatask_list = collections.defaultdict(list)
     try:
@@ -890,7 +843,7 @@ def get_tasklist(workflow_file):
             raise
 
     root = tree.getroot()
-    cycledef_group_cycles = collections.defaultdict(list)
+    cycledef_group_cycles = collections.defaultdict(CycleDefGroup)
     if list_tasks:
         curses.endwin()
         print()
@@ -903,7 +856,6 @@ def get_tasklist(workflow_file):
                 cycle_def_name = cycle_noname
             cycle_string = child.text.split()
 
-            ucgs_is_cron = None
             if PACKAGE.lower() == 'ugcs':
                 start_cycle = datetime.strptime(entity_values['SDATE'], '%Y%m%d%H%M')
                 end_cycle = datetime.strptime(entity_values['EDATE'], '%Y%m%d%H%M')
@@ -912,32 +864,12 @@ def get_tasklist(workflow_file):
                 inc_cycle = int(entity_values['INC_MONTHS'])
                 if inc_cycle == 0:
                     inc_cycle = string_to_timedelta(cycle_string[2])
-                    ucgs_is_cron = False
-                else:
-                    ucgs_is_cron = True
             else:
                 start_cycle = datetime.strptime(cycle_string[0], '%Y%m%d%H%M')
                 end_cycle = datetime.strptime(cycle_string[1], '%Y%m%d%H%M')
                 inc_cycle = string_to_timedelta(cycle_string[2])
 
-            while start_cycle <= end_cycle:
-                cycledef_group_cycles[cycle_def_name].append(start_cycle.strftime("%Y%m%d%H%M"))
-                if PACKAGE.lower() == 'ugcs' and ucgs_is_cron:
-                    try:
-                        start_cycle = start_cycle + relativedelta(months=+inc_cycle)
-                    except AttributeError:
-                        curses.endwin()
-                        eprint("""
-                            Could not handle cycle increment measured in months because dateutil
-                            could not be imported. In order to read this workflow, install dateutil
-                            using pip:
-
-                            > pip install python-dateutil --user
-
-                            """)
-                        sys.exit(-1)
-                else:
-                    start_cycle = start_cycle + inc_cycle
+            cycledef_group_cycles[cycle_def_name].append(CycleDef(start_cycle, end_cycle, inc_cycle))
         if child.tag == 'task':
             task_name = child.attrib['name']
             log_file = child.find('join').find('cyclestr').text.replace('@Y@m@d@H', 'CYCLE')
@@ -1022,164 +954,279 @@ def get_tasklist(workflow_file):
     return tasks_ordered, metatask_list, cycledef_group_cycles
 
 
+def get_tasklist_cache_file(workflow_file):
+    cache_home = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    name = hashlib.blake2b(os.path.realpath(workflow_file).encode(), digest_size=16).hexdigest()
+    return os.path.join(cache_home, 'rocoto_viewer', f'{name}.pickle')
+
+
+def get_workflow_signature(workflow_file, content):
+    """
+    The mtime, size and hash of the workflow XML and the mtime and size of the
+    external entities it includes
+    """
+    st = os.stat(workflow_file)
+    signature = {'version': tasklist_cache_version, 'package': PACKAGE,
+                 'mtime': (st.st_mtime_ns, st.st_size), 'hash': hashlib.blake2b(content).hexdigest(), 'entities': []}
+    for path in re.findall(rb'<!ENTITY\s+\S+\s+SYSTEM\s+"([^"]+)"', content):
+        path = os.path.join(os.path.dirname(os.path.abspath(workflow_file)), os.fsdecode(path))
+        try:
+            st = os.stat(path)
+            signature['entities'].append((path, st.st_mtime_ns, st.st_size))
+        except OSError:
+            signature['entities'].append((path, None, None))
+    return signature
+
+
+def get_tasklist(workflow_file):
+    """
+    Parsed task lists of the workflow, reusing the ones saved on disk when
+    neither the XML (mtime or hash) nor its external entities changed
+    """
+    if list_tasks:
+        return parse_tasklist(workflow_file)
+
+    cache_file = get_tasklist_cache_file(workflow_file)
+    with open(workflow_file, 'rb') as f:
+        content = f.read()
+    signature = get_workflow_signature(workflow_file, content)
+
+    try:
+        with open(cache_file, 'rb') as f:
+            cached_signature, tasklist = pickle.load(f)
+        same_file = cached_signature['mtime'] == signature['mtime'] or cached_signature['hash'] == signature['hash']
+        if same_file and all(cached_signature[key] == signature[key] for key in ('version', 'package', 'entities')):
+            return tasklist
+    except Exception:
+        pass
+
+    tasklist = parse_tasklist(workflow_file)
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(cache_file), delete=False) as f:
+            pickle.dump((signature, tasklist), f)
+        os.replace(f.name, cache_file)
+    except Exception:
+        # The cache is only an optimization
+        pass
+    return tasklist
+
+
+class RocotoStatCache:
+    """
+    Rows of the Rocoto database and status lines kept between refreshes
+
+    On each refresh only the job rows that are new, were changed, or may still
+    change are read back from the database, and the status lines are only
+    rebuilt for the cycles holding such rows.  The cache is passed to and
+    returned from get_rocoto_stat along with the task lists.
+    """
+
+    # Rocoto does not change jobs in these states again (a rewind deletes the row)
+    final_states = ('SUCCEEDED', 'DEAD')
+    # Number of the most recent ids read again on each refresh: SQLite gives a new
+    # row the id of a deleted one if that was the largest, e.g. when the last
+    # submitted job is rewound and resubmitted
+    recheck_window = 1000
+    # Maximum number of ids per "IN (...)" query
+    query_batch_size = 500
+
+    def __init__(self, accounting=None):
+        # Scheduler accounting provider (rocoto.accounting) used for the performance metrics
+        self.accounting = accounting
+        self.reset()
+
+    def reset(self, source=None):
+        self.source = source
+        self.last_id = 0
+        self.rows = dict()
+        self.changed_ids = set()
+        self.active = set()
+        self.task_ids = collections.defaultdict(set)
+        self.jobid_ids = collections.defaultdict(set)
+        self.cycles = dict()
+        self.lines = dict()
+        self.tasks_key = None
+        self.task_cycles = []
+
+    def _add_row(self, row):
+        theid, taskname, cycle = row[0], row[2], row[3]
+        self.rows[theid] = row
+        self.task_ids[(cycle, taskname)].add(theid)
+        self.jobid_ids[row[1]].add(theid)
+        if row[4] in self.final_states:
+            self.active.discard(theid)
+        else:
+            self.active.add(theid)
+        return cycle
+
+    def _remove_row(self, theid):
+        row = self.rows.pop(theid)
+        self.active.discard(theid)
+        task_ids = self.task_ids[(row[3], row[2])]
+        task_ids.discard(theid)
+        if len(task_ids) == 0:
+            del self.task_ids[(row[3], row[2])]
+        jobid_ids = self.jobid_ids[row[1]]
+        jobid_ids.discard(theid)
+        if len(jobid_ids) == 0:
+            del self.jobid_ids[row[1]]
+        return row[3]
+
+    def update(self, cursor, table, columns, changed_jobids=()):
+        """
+        Read the job and cycle rows changed since the last refresh, and the
+        rows of the jobs in changed_jobids (whose metrics were updated)
+
+        Returns the set of cycles whose status lines must be rebuilt
+        """
+        source = (table, columns)
+        if source != self.source:
+            self.reset(source)
+
+        low = max(0, self.last_id - self.recheck_window)
+        active = set(theid for theid in self.active if theid <= low)
+        for jobid in changed_jobids:
+            active.update(theid for theid in self.jobid_ids.get(jobid, ()) if theid <= low)
+        active = sorted(active)
+        recent = [theid for theid in range(low + 1, self.last_id + 1) if theid in self.rows]
+
+        rows = cursor.execute(f'SELECT {columns} FROM {table} WHERE id > ?', (low,)).fetchall()
+        for i in range(0, len(active), self.query_batch_size):
+            batch = active[i:i + self.query_batch_size]
+            rows.extend(cursor.execute(f'SELECT {columns} FROM {table} WHERE id IN ({",".join("?" * len(batch))})', batch))
+
+        dirty = set()
+        found = set()
+        self.changed_ids = set()
+        for row in rows:
+            row = tuple('-' if x is None else x for x in row)
+            found.add(row[0])
+            if self.rows.get(row[0]) == row:
+                continue
+            self.changed_ids.add(row[0])
+            if row[0] in self.rows:
+                dirty.add(self._remove_row(row[0]))
+            dirty.add(self._add_row(row))
+
+        # Rewound jobs are deleted from the database
+        for theid in active + recent:
+            if theid not in found:
+                dirty.add(self._remove_row(theid))
+        count, self.last_id = cursor.execute(f'SELECT count(*), max(id) FROM {table}').fetchone()
+        self.last_id = self.last_id or 0
+        if count != len(self.rows):
+            current = set(theid for theid, in cursor.execute(f'SELECT id FROM {table}'))
+            for theid in set(self.rows).difference(current):
+                dirty.add(self._remove_row(theid))
+
+        cycles = dict(cursor.execute('SELECT cycle, done FROM cycles'))
+        for cycle in set(self.cycles).symmetric_difference(cycles):
+            dirty.add(cycle)
+            self.lines.pop(cycle, None)
+        self.cycles = cycles
+
+        return dirty
+
+    def get_jobids(self, ids):
+        return [self.rows[theid][1] for theid in ids if theid in self.rows and self.rows[theid][1] != '-']
+
+    def set_tasks(self, tasks_ordered, cycledef_group_cycles):
+        """
+        Combine the cycledefs of each task into one group
+
+        Returns True if the tasks changed since the last refresh
+        """
+        tasks_key = (tuple(tasks_ordered), tuple(sorted(cycledef_group_cycles.items())))
+        if tasks_key == self.tasks_key:
+            return False
+
+        task_groups = dict()
+        self.task_cycles = []
+        for task in tasks_ordered:
+            if task[1] not in task_groups:
+                task_groups[task[1]] = CycleDefGroup()
+                for each_cycledef in task[1].split(','):
+                    if each_cycledef in cycledef_group_cycles:
+                        task_groups[task[1]].extend(cycledef_group_cycles[each_cycledef])
+            self.task_cycles.append(task_groups[task[1]])
+        self.tasks_key = tasks_key
+        return True
+
+    def cycle_lines(self, cycle, tasks_ordered):
+        """
+        Status lines of one cycle, one per task that runs for the cycle
+        """
+        lines = []
+        in_group = dict()
+        cycle_string = datetime.fromtimestamp(cycle).strftime('%Y%m%d%H%M')
+        for task, task_cycles in zip(tasks_ordered, self.task_cycles):
+            if id(task_cycles) not in in_group:
+                in_group[id(task_cycles)] = cycle_string in task_cycles
+            if not in_group[id(task_cycles)]:
+                continue
+            task_ids = self.task_ids.get((cycle, task[0]))
+            row = self.rows[min(task_ids)] if task_ids else None
+            if row is None or row[1] == '-':
+                lines.append(cycle_string + ' ' * 7 + task[0] + ' - - - - -')
+            elif len(row) > 8:
+                (theid, jobid, taskname, cycle, state, exit_status, duration, tries, qtime, cputime, runtime, slots) = row
+                lines.append(f"{cycle_string} {taskname} {str(jobid)} {str(state)} {str(exit_status)} "
+                             f"{str(tries)} {str(duration).split('.')[0]} {str(slots)} "
+                             f"{str(qtime)} {str(cputime).split('.')[0]} {str(runtime)}")
+            else:
+                (theid, jobid, taskname, cycle, state, exit_status, duration, tries) = row
+                lines.append(f"{cycle_string} {taskname} {str(jobid)} {str(state)} {str(exit_status)} "
+                             f"{str(tries)} {str(duration).split('.')[0]}")
+        return lines
+
+    def refresh(self, cursor, table, columns, tasks_ordered, cycledef_group_cycles, changed_jobids=()):
+        """
+        Bring the cache up to date and return the status lines of every cycle
+        """
+        dirty = self.update(cursor, table, columns, changed_jobids)
+        if self.set_tasks(tasks_ordered, cycledef_group_cycles):
+            dirty = set(self.cycles)
+
+        for cycle in dirty:
+            if cycle in self.cycles:
+                self.lines[cycle] = self.cycle_lines(cycle, tasks_ordered)
+
+        return [self.lines[cycle] for cycle in sorted(self.cycles) if len(self.lines[cycle]) != 0]
+
+
 def get_rocoto_stat(params, queue_stat):
-    workflow_file, database_file, tasks_ordered, metatask_list, cycledef_group_cycles = params
+    workflow_file, database_file, tasks_ordered, metatask_list, cycledef_group_cycles, stat_cache = params
 
     global database_file_agmented
     if len(tasks_ordered) == 0 or len(metatask_list) == 0 or len(cycledef_group_cycles) == 0 or list_tasks:
         tasks_ordered, metatask_list, cycledef_group_cycles = get_tasklist(workflow_file)
 
-    if use_performance_metrics:
-        aug_perf = get_aug_perf_values(get_user)
-    else:
-        aug_perf = None
-
-    info = collections.defaultdict(list)
-    cycles = set()
-
     connection = sqlite3.connect(database_file)
     c = connection.cursor()
 
     if use_performance_metrics:
-        c.execute("DROP TABLE IF EXISTS jobs_augment_tmp;")
-        sql_create_augment_table = "CREATE TABLE jobs_augment_tmp AS SELECT * FROM jobs;"
-        c.execute(sql_create_augment_table)
-        c.execute("alter table jobs_augment_tmp add column qtime integer;")
-        c.execute("alter table jobs_augment_tmp add column cputime integer;")
-        c.execute("alter table jobs_augment_tmp add column runtime integer;")
-        c.execute("alter table jobs_augment_tmp add column slots integer;")
-
-        sq_command = ''
-        column_updates = ('qtime', 'cputime', 'runtime', 'slots')
-        for column in column_updates:
-            sq_command += f"{column}=(SELECT jobs_augment.{column} FROM jobs_augment WHERE jobs_augment.id=jobs_augment_tmp.id)" + ','
-        sq_command = ';'.join(sq_command.rsplit(',', 1))
-        sq_command = 'UPDATE jobs_augment_tmp SET ' + sq_command
-        c.execute(sq_command)
-
-        sq_command = 'UPDATE jobs_augment_tmp SET'
-        for perf_jobid, perf_values in aug_perf.items():
-            for name, each_value in perf_values.items():
-                c.execute(f"{sq_command} {name} = '{each_value}' WHERE jobs_augment_tmp.jobid = {perf_jobid}")
-
-        c.execute("DROP TABLE IF EXISTS jobs_augment;")
-        c.execute("ALTER TABLE jobs_augment_tmp RENAME TO jobs_augment;")
-
-    cycledifitions = []
-    q = c.execute('SELECT id, groupname, cycledef FROM cycledef')
-    for row in q:
-        (theid, groupname, cycledef) = row
-        cycledifitions.append((theid, groupname, cycledef))
-
-    cycle_done_stat = dict()
-    q = c.execute('SELECT id,cycle,done FROM cycles')
-    for row in q:
-        (theid, cycle, done) = row
-        cycles.add(cycle)
-        cycle_done_stat[cycle] = done
-
-    if use_performance_metrics:
-        q = c.execute('SELECT id,jobid,taskname,cycle,state,exit_status,duration,tries,qtime,cputime,runtime,slots FROM jobs_augment')
+        perf_store = PerfMetricsStore(PerfMetricsStore.get_path(database_file))
+        c.execute('ATTACH DATABASE ? AS perf', (perf_store.path,))
+        table = 'jobs LEFT JOIN perf.metrics ON perf.metrics.jobid = jobs.jobid'
+        columns = ('jobs.id,jobs.jobid,taskname,cycle,state,exit_status,duration,tries,'
+                   'perf.metrics.qtime,perf.metrics.cputime,perf.metrics.runtime,perf.metrics.slots')
     else:
-        q = c.execute('SELECT id,jobid,taskname,cycle,state,exit_status,duration,tries FROM jobs')
-
-    q_get = []
-    entered_jobids = []
-    last_task_index = 0
-    for row in q:
-        row = tuple('-' if x is None else x for x in row)
-        if use_performance_metrics:
-            (theid, jobid, taskname, cycle, state, exit_status, duration, tries, qtime, cputime, runtime, slots) = row
-        else:
-            (theid, jobid, taskname, cycle, state, exit_status, duration, tries, ) = row
-        if jobid in entered_jobids:
-            continue
-        else:
-            if taskname in tasks_ordered:
-                task_index = [x[0] for x in task_ordered].index(taskname)
-                last_task_index = task_index
-            else:
-                task_index = last_task_index
+        table = 'jobs'
+        columns = 'id,jobid,taskname,cycle,state,exit_status,duration,tries'
 
-            if use_performance_metrics:
-                q_get.append((theid, jobid, task_index, taskname, cycle, state, exit_status, duration, tries, qtime, cputime, runtime, slots))
-            else:
-                q_get.append((theid, jobid, task_index, taskname, cycle, state, exit_status, duration, tries))
-        entered_jobids.append(jobid)
+    rocoto_stat = stat_cache.refresh(c, table, columns, tasks_ordered, cycledef_group_cycles)
 
-    q_get.sort(key=lambda x: x[2])
+    if use_performance_metrics and stat_cache.accounting is not None:
+        # Only ask the scheduler about the jobs that changed or are still in flight
+        jobids = stat_cache.get_jobids(stat_cache.active.union(stat_cache.changed_ids))
+        changed_jobids = perf_store.update(get_aug_perf_values(stat_cache.accounting, jobids))
+        if changed_jobids:
+            rocoto_stat = stat_cache.refresh(c, table, columns, tasks_ordered, cycledef_group_cycles, changed_jobids)
 
     connection.commit()
     c.close()
 
-    for row in q_get:
-        if use_performance_metrics:
-            (theid, jobid, task_order, taskname, cycle, state, exit_status, duration, tries, qtime, cputime, runtime, slots) = row
-        else:
-            (theid, jobid, task_order, taskname, cycle, state, exit_status, duration, tries) = row
-        if jobid != '-':
-            if use_performance_metrics:
-                line = (f"{datetime.fromtimestamp(cycle).strftime('%Y%m%d%H%M')} "
-                        f"{taskname} {str(jobid)} {str(state)} {str(exit_status)} "
-                        f"{str(tries)} {str(duration).split('.')[0]} {str(slots)} "
-                        f"{str(qtime)} {str(cputime).split('.')[0]} {str(runtime)}")
-            else:
-                line = (f"{datetime.fromtimestamp(cycle).strftime('%Y%m%d%H%M')} "
-                        f"{taskname} {str(jobid)} {str(state)} {str(exit_status)} "
-                        f"{str(tries)} {str(duration).split('.')[0]}")
-            info[cycle].append(line)
-
-    for every_cycle in cycles:
-        if len(info[every_cycle]) == 0:
-            info[every_cycle].append('place holder')
-
-    new_info = collections.defaultdict(list)
-    job_ids = []
-    job_id = ''
-    for each_cycle, lines_in_cycle in info.items():
-        for task in tasks_ordered:
-            skip_task = False
-            for each_line in lines_in_cycle:
-                if task[0] == each_line.split()[1]:
-                    job_id = each_line.split()[2]
-                    if job_id in job_ids:
-                        break
-                    cycle_string = datetime.fromtimestamp(each_cycle).strftime('%Y%m%d%H%M')
-                    cycledefs = task[1].split(',')
-                    if len(cycledefs) > 1:
-                        for each_cycledef in cycledefs:
-                            if cycle_string in cycledef_group_cycles[each_cycledef]:
-                                new_info[each_cycle].append(each_line)
-                                job_ids.append(job_id)
-                                skip_task = True
-                                break
-                    elif cycle_string in cycledef_group_cycles[task[1]]:
-                        new_info[each_cycle].append(each_line)
-                        job_ids.append(job_id)
-                        skip_task = True
-                        break
-            if skip_task:
-                continue
-            line = datetime.fromtimestamp(each_cycle).strftime('%Y%m%d%H%M') + ' ' * 7 + task[0] + ' - - - - -'
-            cycle_string = datetime.fromtimestamp(each_cycle).strftime('%Y%m%d%H%M')
-            cycledefs = task[1].split(',')
-            if len(cycledefs) > 1:
-                for each_cycledef in cycledefs:
-                    if cycle_string in cycledef_group_cycles[each_cycledef]:
-                        new_info[each_cycle].append(line)
-                        skip_task = True
-                        break
-            elif cycle_string in cycledef_group_cycles[task[1]]:
-                new_info[each_cycle].append(line)
-                skip_task = True
-            if skip_task:
-                continue
-
-    rocoto_stat = []
-    for cycle in sorted(cycles):
-        if len(new_info[cycle]) != 0:
-            rocoto_stat.append(new_info[cycle])
-
     if save_checkfile_path is not None:
         stat_update_time = str(datetime.now()).rsplit(':', 1)[0]
         with open(save_checkfile_path, 'w') as savefile:
@@ -1189,9 +1236,9 @@ def get_rocoto_stat(params, queue_stat):
             sys.exit(0)
 
     if use_multiprocessing:
-        queue_stat.put((rocoto_stat, tasks_ordered, metatask_list, cycledef_group_cycles))
+        queue_stat.put((rocoto_stat, tasks_ordered, metatask_list, cycledef_group_cycles, stat_cache))
     else:
-        return (rocoto_stat, tasks_ordered, metatask_list, cycledef_group_cycles)
+        return (rocoto_stat, tasks_ordered, metatask_list, cycledef_group_cycles, stat_cache)
 
 
 def display_results(results, screen, params):
@@ -1296,7 +1343,6 @@ def main(screen):
 
     global use_performance_metrics
     if use_performance_metrics:
-        augment_SQLite3(database_file)
         header_string += '  SLOTS   QTIME    CPU    RUN\n'
         header_string_under += '=============================\n'
         header_string += header_string_under
@@ -1382,7 +1428,14 @@ def main(screen):
 
     tasks_ordered = []
     metatask_list = collections.defaultdict(list)
-    cycledef_group_cycles = collections.defaultdict(list)
+    cycledef_group_cycles = collections.defaultdict(CycleDefGroup)
+    stat_cache = RocotoStatCache()
+    if use_performance_metrics:
+        scheduler = get_workflow_scheduler(workflow_file)
+        try:
+            stat_cache.accounting = get_accounting(scheduler)
+        except NotImplementedError:
+            eprint(f'WARNING: no performance metrics are available for scheduler {scheduler}')
 
     queue_stat = Queue()
     queue_check = Queue()
@@ -1391,7 +1444,7 @@ def main(screen):
         curses.endwin()
         sys.stdout = os.fdopen(0, 'w', 0)
         print('Creating check point file ...')
-        params = (workflow_file, database_file, tasks_ordered, metatask_list, cycledef_group_cycles)
+        params = (workflow_file, database_file, tasks_ordered, metatask_list, cycledef_group_cycles, stat_cache)
         get_rocoto_stat(params, queue_stat)
 
     stat_update_time = ''
@@ -1438,21 +1491,21 @@ def main(screen):
                 header = header[:-reduce_header_size]
                 header = header[reduce_header_size:]
     if list_tasks:
-        params = (workflow_file, database_file, tasks_ordered, metatask_list, cycledef_group_cycles)
+        params = (workflow_file, database_file, tasks_ordered, metatask_list, cycledef_group_cycles, stat_cache)
         get_rocoto_stat(params, Queue())
         curses.endwin()
         sys.stdout = os.fdopen(0, 'w', 0)
         sys.exit(0)
 
     if save_checkfile_path is None or (save_checkfile_path is not None and not os.path.isfile(save_checkfile_path)):
-        params = (workflow_file, database_file, tasks_ordered, metatask_list, cycledef_group_cycles)
+        params = (workflow_file, database_file, tasks_ordered, metatask_list, cycledef_group_cycles, stat_cache)
         if use_multiprocessing:
             process_get_rocoto_stat = Process(target=get_rocoto_stat, args=[params, queue_stat])
             process_get_rocoto_stat.start()
             screen.addstr(mlines - 2, 0, 'No checkpoint file, must get rocoto stats please wait', curses.A_BOLD)
             screen.addstr(mlines - 1, 0, 'Running rocotostat ', curses.A_BOLD)
         else:
-            (rocoto_stat, tasks_ordered, metatask_list, cycledef_group_cycles) = get_rocoto_stat(params, Queue())
+            (rocoto_stat, tasks_ordered, metatask_list, cycledef_group_cycles, stat_cache) = get_rocoto_stat(params, Queue())
             header = header_string
             stat_update_time = str(datetime.now()).rsplit(':', 1)[0]
             header = header.replace('t' * 16, stat_update_time)
@@ -1491,7 +1544,7 @@ def main(screen):
                     sys.exit(1)
 
             if len(rocoto_stat_params) != 0:
-                (rocoto_stat, tasks_ordered, metatask_list, cycledef_group_cycles) = rocoto_stat_params
+                (rocoto_stat, tasks_ordered, metatask_list, cycledef_group_cycles, stat_cache) = rocoto_stat_params
                 if use_multiprocessing:
                     process_get_rocoto_stat.join()
                     process_get_rocoto_stat.terminate()
@@ -2031,7 +2084,7 @@ def main(screen):
                 except Exception:
                     rocoto_stat_tmp = ''
                 if len(rocoto_stat_tmp) != 0:
-                    (rocoto_stat, tasks_ordered, metatask_list, cycledef_group_cycles) = rocoto_stat_tmp
+                    (rocoto_stat, tasks_ordered, metatask_list, cycledef_group_cycles, stat_cache) = rocoto_stat_tmp
                     process_get_rocoto_stat.join()
                     process_get_rocoto_stat.terminate()
                     update_pad = True
@@ -2458,8 +2511,8 @@ def main(screen):
             if diff > stat_read_time_delay and not loading_stat:
                 start_time = current_time
                 if not use_multiprocessing:
-                    params = (workflow_file, database_file, tasks_ordered, metatask_list, cycledef_group_cycles)
-                    (rocoto_stat, tasks_ordered, metatask_list, cycledef_group_cycles) = get_rocoto_stat(params, Queue())
+                    params = (workflow_file, database_file, tasks_ordered, metatask_list, cycledef_group_cycles, stat_cache)
+                    (rocoto_stat, tasks_ordered, metatask_list, cycledef_group_cycles, stat_cache) = get_rocoto_stat(params, Queue())
                     stat_update_time = str(datetime.now()).rsplit(':', 1)[0]
                     header = header_string
                     header = header.replace('t' * 16, stat_update_time)
@@ -2473,7 +2526,7 @@ def main(screen):
                 else:
                     loading_stat = True
                     screen.addstr(mlines - 2, 0, 'Running rocotostat                                        ')
-                    params = (workflow_file, database_file, tasks_ordered, metatask_list, cycledef_group_cycles)
+                    params = (workflow_file, database_file, tasks_ordered, metatask_list, cycledef_group_cycles, stat_cache)
                     process_get_rocoto_stat = Process(target=get_rocoto_stat, args=[params, queue_stat])
                     process_get_rocoto_stat.start()
 